@@ -0,0 +1,3 @@
+"""
+Пакет телеграм бота (точка входа - main.py)
+"""
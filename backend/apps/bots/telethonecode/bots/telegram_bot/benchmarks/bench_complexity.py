@@ -0,0 +1,134 @@
+"""
+Микробенчмарк анализатора сложности вопросов
+
+Сравнивает QuestionComplexityAnalyzer (один проход регулярки-дерева по всем
+ключевым словам + кэш) с прежней реализацией (keyword in text по каждому слову,
+re.search с некомпилированными паттернами) и проверяет, что результаты совпадают.
+Отдельно замеряется пакетный analyze_many.
+
+Запуск (из каталога telegram_bot):
+    python benchmarks/bench_complexity.py
+"""
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# Пакет telegram_bot - из каталога над ним
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from telegram_bot.src.utils.complexity_analyzer import QuestionComplexityAnalyzer
+
+analyzer = QuestionComplexityAnalyzer()
+
+
+def legacy_analyze_complexity(text: str) -> dict:
+    """Прежний QuestionComplexityAnalyzer.analyze_complexity"""
+    text_lower = text.lower()
+    complexity_score = 0
+    found_keywords = []
+    found_patterns = []
+
+    simple_found = False
+    for indicator in analyzer.simple_indicators:
+        if indicator in text_lower:
+            simple_found = True
+            break
+
+    for keyword in analyzer.complex_keywords:
+        if keyword in text_lower:
+            complexity_score += 2
+            found_keywords.append(keyword)
+
+    for pattern in analyzer.complex_patterns:
+        if re.search(pattern, text_lower):
+            complexity_score += 3
+            found_patterns.append(pattern)
+
+    word_count = len(text.split())
+    if word_count > 20:
+        complexity_score += 1
+    if word_count > 50:
+        complexity_score += 2
+
+    question_patterns = [
+        r'как\s+(?:можно\s+)?(?:лучше\s+)?(?:правильно\s+)?\w+',
+        r'каким\s+способом',
+        r'в\s+чем\s+(?:разница|отличие)',
+        r'почему\s+(?:так\s+происходит|это\s+работает)',
+        r'что\s+происходит\s+(?:когда|если)',
+    ]
+    for pattern in question_patterns:
+        if re.search(pattern, text_lower):
+            complexity_score += 1
+
+    if simple_found and complexity_score < 2:
+        complexity_level = "simple"
+    elif complexity_score < 4:
+        complexity_level = "medium"
+    elif complexity_score < 8:
+        complexity_level = "complex"
+    else:
+        complexity_level = "very_complex"
+
+    return {
+        "complexity_level": complexity_level,
+        "complexity_score": complexity_score,
+        "found_keywords": found_keywords,
+        "found_patterns": found_patterns,
+        "word_count": word_count,
+        "should_tag_human": complexity_level in ["complex", "very_complex"],
+        "use_human_behavior": False
+    }
+
+
+FILLER = ("привет как дела у нас проект по дизайну логотипа нужно обсудить сроки "
+          "и бюджет пришлите пожалуйста макеты hello thanks").split()
+
+
+def build_corpus(count: int, keyword_share: float, seed: int = 42) -> list:
+    """Сообщения из обычных слов вперемешку с ключевыми словами и паттернами"""
+    rng = random.Random(seed)
+    special = analyzer.complex_keywords + analyzer.simple_indicators + [
+        'как реализовать', 'каким образом', 'в чем разница', 'объясни подробно', 'Алгоритма', 'REST API'
+    ]
+
+    def word():
+        return rng.choice(special if rng.random() < keyword_share else FILLER)
+
+    return [" ".join(word() for _ in range(rng.randint(1, 80))) for _ in range(count)]
+
+
+def main():
+    # Проверка на текстах, почти целиком состоящих из ключевых слов (много пересечений)
+    for text in build_corpus(2000, keyword_share=0.9):
+        assert analyzer._analyze(text) == legacy_analyze_complexity(text), f"Результат отличается: {text[:80]}"
+    print("Результаты совпадают на 2000 сообщениях")
+
+    # Замеры - на обычных сообщениях (примерно каждое десятое слово - ключевое)
+    corpus = build_corpus(2000, keyword_share=0.1)
+
+    for label, texts in (("короткие (до 10 слов)", [t for t in corpus if len(t.split()) <= 10][:200]),
+                         ("длинные (50+ слов)", [t for t in corpus if len(t.split()) >= 50][:200])):
+        old = min(timeit.repeat(lambda: [legacy_analyze_complexity(t) for t in texts], number=5, repeat=3))
+        new = min(timeit.repeat(lambda: [analyzer._analyze(t) for t in texts], number=5, repeat=3))
+        cached = min(timeit.repeat(lambda: [analyzer.analyze_complexity(t) for t in texts], number=5, repeat=3))
+        per_call = 1e6 / (5 * len(texts))
+        print(f"\n{label}, {len(texts)} сообщений:")
+        print(f"  было               {old * per_call:8.1f} мкс/сообщение")
+        print(f"  один проход        {new * per_call:8.1f} мкс/сообщение ({old / new:.1f}x)")
+        print(f"  с кэшем (повтор)   {cached * per_call:8.1f} мкс/сообщение ({old / cached:.1f}x)")
+
+    # Пакетный пересчет: все сообщения разные, кэш не помогает
+    batch = build_corpus(20000, keyword_share=0.1, seed=7)
+    assert analyzer.analyze_many(batch) == [analyzer._analyze(t) for t in batch], "analyze_many: результат отличается"
+    single = min(timeit.repeat(lambda: [analyzer.analyze_complexity(t) for t in batch], number=1, repeat=3))
+    many = min(timeit.repeat(lambda: analyzer.analyze_many(batch), number=1, repeat=3))
+    print(f"\nпакет {len(batch)} сообщений:")
+    print(f"  analyze_complexity по одному {len(batch) / single:10.0f} сообщений/с")
+    print(f"  analyze_many                 {len(batch) / many:10.0f} сообщений/с ({single / many:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
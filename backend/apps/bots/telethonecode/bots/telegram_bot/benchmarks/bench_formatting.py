@@ -0,0 +1,173 @@
+"""
+Микробенчмарк форматирования ответов
+
+Сравнивает src.utils.formatting с прежней реализацией (регулярки компилировались
+на каждый вызов, lines.index() в цикле по строкам) и проверяет, что результат
+совпадает.
+
+Запуск (из каталога telegram_bot):
+    python benchmarks/bench_formatting.py
+"""
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# Пакет telegram_bot - из каталога над ним
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from telegram_bot.src.utils.formatting import format_chatgpt_markdown, format_for_telegram
+
+
+def legacy_format_response(response_text: str) -> str:
+    """Прежний GPTService.format_response (с исправленным lines.index для сравнения)"""
+    if not response_text:
+        return response_text
+    formatted_text = re.sub(r'```(\w+)\n(.*?)\n```', r'```\1\n\2\n```', response_text, flags=re.DOTALL)
+    formatted_text = re.sub(r'```\n?(.*?)\n?```', r'```\n\1\n```', formatted_text, flags=re.DOTALL)
+
+    def replace_inline_code(match):
+        code = match.group(1)
+        if '\n' not in code and len(code.strip()) < 100:
+            return f'`{code}`'
+        return match.group(0)
+
+    parts = formatted_text.split('```')
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'`([^`\n]+)`', replace_inline_code, parts[i])
+    formatted_text = '```'.join(parts)
+
+    lines = formatted_text.split('\n')
+    formatted_lines = []
+    in_code_block = False
+    for idx, line in enumerate(lines):
+        if line.strip().startswith('```'):
+            in_code_block = not in_code_block
+            formatted_lines.append(line)
+            continue
+        if in_code_block:
+            formatted_lines.append(line)
+            continue
+        stripped = line.strip()
+        if (stripped.endswith(':') and len(stripped) < 80 and
+                not stripped.startswith('#') and len(stripped.split()) <= 8):
+            title_keywords = ['пример', 'example', 'результат', 'вывод', 'output', 'result',
+                              'решение', 'ответ', 'объяснение', 'концепции', 'моменты',
+                              'использование', 'применение', 'как', 'что', 'зачем']
+            if any(keyword in stripped.lower() for keyword in title_keywords):
+                formatted_lines.append(f"## {stripped}")
+            else:
+                formatted_lines.append(line)
+        elif re.match(r'^\d+\.\s+', stripped):
+            formatted_lines.append(line)
+        elif re.match(r'^[-\*\+]\s+', stripped):
+            formatted_lines.append(line)
+        elif stripped and not stripped.startswith('#') and len(stripped) < 200:
+            prev_line = formatted_lines[-1].strip() if formatted_lines else ""
+            next_idx = lines.index(line) + 1 if LEGACY_INDEX else idx + 1
+            next_line = lines[next_idx].strip() if next_idx < len(lines) else ""
+            is_list_context = (
+                re.match(r'^\d+\.\s+', prev_line) or re.match(r'^[-\*\+]\s+', prev_line) or
+                re.match(r'^\d+\.\s+', next_line) or re.match(r'^[-\*\+]\s+', next_line)
+            )
+            if is_list_context and len(stripped.split()) < 15:
+                formatted_lines.append(f"- {stripped}")
+            else:
+                formatted_lines.append(line)
+        else:
+            formatted_lines.append(line)
+    formatted_text = '\n'.join(formatted_lines)
+
+    parts = formatted_text.split('```')
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\b([А-ЯЁ]{3,})\b', r'**\1**', parts[i])
+        parts[i] = re.sub(r'\b(Результат|Вывод|Output|Result):\s*', r'**\1:**\n', parts[i])
+        parts[i] = re.sub(r'\b(Пример|Example):\s*', r'**\1:**\n', parts[i])
+    formatted_text = '```'.join(parts)
+    formatted_text = re.sub(r'\n{3,}', '\n\n', formatted_text)
+    return formatted_text.strip()
+
+
+def legacy_format_telegram_response(response_text: str) -> str:
+    """Прежний BotGPTService.format_telegram_response"""
+    if not response_text:
+        return response_text
+    formatted_text = re.sub(r'```(\w+)\n(.*?)\n```', r'```\n\2\n```', response_text, flags=re.DOTALL)
+    formatted_text = re.sub(r'^#{1,6}\s+(.+)', r'*\1*', formatted_text, flags=re.MULTILINE)
+    lines = formatted_text.split('\n')
+    formatted_lines = []
+    for line in lines:
+        stripped = line.strip()
+        if re.match(r'^\d+\.\s+', stripped):
+            formatted_lines.append(line)
+        elif re.match(r'^[-\*\+]\s+', stripped):
+            content = re.sub(r'^[-\*\+]\s+', '', stripped)
+            formatted_lines.append(f"• {content}")
+        else:
+            formatted_lines.append(line)
+    formatted_text = '\n'.join(formatted_lines)
+    if len(formatted_text) > 4000:
+        formatted_text = formatted_text[:3950] + "\n\n... _(сообщение обрезано)_"
+    formatted_text = re.sub(r'\n{3,}', '\n\n', formatted_text)
+    return formatted_text.strip()
+
+
+LEGACY_INDEX = False
+
+SECTION = """## Решение задачи
+
+Пример использования:
+1. Установите зависимости
+2. Запустите скрипт
+дополнительная строка
+- пункт списка
+* еще пункт
+
+ВАЖНО: проверьте `config.py` перед запуском.
+
+```python
+def handler(update, context):
+    for i in range(10):
+        print(i)
+    return {"ok": True}
+```
+
+Результат: все работает. Example: see above.
+
+
+
+"""
+
+
+def build_sample(sections: int) -> str:
+    return SECTION * sections
+
+
+def bench(name: str, func, text: str, number: int) -> float:
+    seconds = min(timeit.repeat(lambda: func(text), number=number, repeat=5)) / number
+    print(f"  {name:<34} {seconds * 1000:8.3f} мс")
+    return seconds
+
+
+def main():
+    for sections in (1, 10, 100):
+        text = build_sample(sections)
+        number = max(3, 300 // sections)
+
+        assert format_chatgpt_markdown(text) == legacy_format_response(text), "format_response: результат отличается"
+        assert format_for_telegram(text) == legacy_format_telegram_response(text), "telegram: результат отличается"
+
+        print(f"\nОтвет {len(text)} символов ({text.count(chr(10))} строк):")
+        global LEGACY_INDEX
+        LEGACY_INDEX = True
+        old = bench("format_response (было)", legacy_format_response, text, number)
+        LEGACY_INDEX = False
+        new = bench("format_chatgpt_markdown", format_chatgpt_markdown, text, number)
+        print(f"  {'ускорение':<34} {old / new:8.1f}x")
+        old = bench("format_telegram_response (было)", legacy_format_telegram_response, text, number)
+        new = bench("format_for_telegram", format_for_telegram, text, number)
+        print(f"  {'ускорение':<34} {old / new:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,20 +7,23 @@ import signal
 import sys
 from pathlib import Path
 
-# Добавляем путь к src в PYTHONPATH
-src_path = Path(__file__).parent / "src"
-sys.path.insert(0, str(src_path))
+# Бот - пакет telegram_bot (его модули импортируют друг друга относительно).
+# При запуске скриптом (python main.py) пакет берется из родительского каталога
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from telegram.error import NetworkError, TelegramError
 
 # Импорты нашего проекта
-from config import config
-from src.database import init_database, close_database, db_manager
-from src.services import bot_gpt_service, human_behavior_service
-from src.bot import command_handlers
-from src.utils import setup_logging, rate_limiter
+from telegram_bot.config import config
+from telegram_bot.src.database import init_database, flush_database, close_database
+from telegram_bot.src.database import manager as database
+from telegram_bot.src.services import bot_gpt_service, human_behavior_service, response_cache, context_cache
+from telegram_bot.src.services import conversation_summarizer, http_pool, image_generation_service
+from telegram_bot.src.bot import command_handlers
+from telegram_bot.src.utils import setup_logging, rate_limiter, TokenBucketRateLimitBackend, cpu_executor
 
 # Настройка логирования
 logger = setup_logging(config.LOG_LEVEL, config.LOG_FILE)
@@ -31,6 +34,7 @@ class TelegramBot:
     def __init__(self):
         self.application = None
         self.is_running = False
+        self._warm_up_task = None
         
         # Валидируем конфигурацию
         if not config.validate():
@@ -45,6 +49,9 @@ class TelegramBot:
         try:
             logger.info("🚀 Инициализация телеграм бота...")
             
+            # g4f импортируется в фоне, пока идет авторизация Telethon и подключение к БД
+            self._warm_up_task = asyncio.create_task(self._warm_up_g4f())
+            
             # ПЕРВЫМ ДЕЛОМ - инициализация Telethon с авторизацией через аккаунт
             logger.info("🤖 Инициализация сервиса человеческого поведения...")
             print("\n" + "🔥"*60)
@@ -63,9 +70,22 @@ class TelegramBot:
             
             # Инициализация базы данных
             logger.info("💾 Подключение к базе данных...")
-            await init_database(config.DATABASE_URL)
+            await init_database(
+                config.DATABASE_URL,
+                config.DB_WRITE_BATCH_SIZE,
+                config.DB_WRITE_FLUSH_INTERVAL,
+                config.DB_ENTITY_CACHE_TTL,
+                config.DB_ACTIVITY_UPDATE_INTERVAL
+            )
             logger.info("✅ База данных подключена успешно")
             
+            # Общий для всех реплик rate limiter (при недоступности Redis остаемся в памяти)
+            if config.RATE_LIMIT_BACKEND == 'redis':
+                logger.info("🚦 Подключение rate limiter к Redis...")
+                await rate_limiter.use_redis(config.REDIS_URL)
+            elif config.RATE_LIMIT_BACKEND == 'token_bucket':
+                rate_limiter.use_backend(TokenBucketRateLimitBackend())
+            
             # Создание приложения Telegram
             logger.info("📱 Создание Telegram приложения...")
             self.application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
@@ -90,6 +110,7 @@ class TelegramBot:
         self.application.add_handler(CommandHandler("start", command_handlers.start_command))
         self.application.add_handler(CommandHandler("help", command_handlers.help_command))
         self.application.add_handler(CommandHandler("ask", command_handlers.ask_command))
+        self.application.add_handler(CommandHandler("image", command_handlers.image_command))
         self.application.add_handler(CommandHandler("status", command_handlers.status_command))
         self.application.add_handler(CommandHandler("stats", command_handlers.stats_command))
         
@@ -97,6 +118,7 @@ class TelegramBot:
         self.application.add_handler(CommandHandler("admin", command_handlers.admin_command))
         self.application.add_handler(CommandHandler("reset", command_handlers.reset_command))
         self.application.add_handler(CommandHandler("providers", command_handlers.providers_command))
+        self.application.add_handler(CommandHandler("cache", command_handlers.cache_command))
         
         # Обработчик инлайн-кнопок
         self.application.add_handler(CallbackQueryHandler(command_handlers.handle_callback_query))
@@ -156,6 +178,9 @@ class TelegramBot:
             # Периодическая очистка rate limiter
             asyncio.create_task(self._cleanup_task())
             
+            # Фоновое сжатие длинных разговоров в резюме
+            conversation_summarizer.start()
+            
             # Ждем сигнала остановки
             await self._wait_for_shutdown()
             
@@ -177,9 +202,26 @@ class TelegramBot:
                 await self.application.shutdown()
                 logger.info("📱 Telegram приложение остановлено")
             
+            # Останавливаем фоновое сжатие истории и генерацию изображений
+            await conversation_summarizer.stop()
+            await image_generation_service.stop()
+            
             # Закрываем Telethon соединение
             await human_behavior_service.close()
             
+            # Закрываем общие соединения к провайдерам
+            await http_pool.close()
+            
+            # Соединение rate limiter с Redis (если подключен)
+            await rate_limiter.close()
+            
+            # Пул для CPU-задач больше не нужен
+            cpu_executor.shutdown()
+            
+            # Дописываем в БД отложенные записи (сообщения, ответы, логи запросов)
+            await flush_database()
+            logger.info("💾 Очередь записи в БД сброшена")
+            
             # Закрываем соединение с БД
             await close_database()
             logger.info("💾 Соединение с базой данных закрыто")
@@ -189,14 +231,27 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"❌ Ошибка при остановке бота: {e}")
     
+    async def _warm_up_g4f(self):
+        """Импорт g4f и разрешение провайдеров/моделей в отдельном потоке"""
+        try:
+            await asyncio.to_thread(bot_gpt_service.warm_up)
+        except Exception as e:
+            # Не фатально: провайдеры разрешатся при первом запросе
+            logger.error(f"❌ Ошибка прогрева g4f: {e}")
+    
     async def _cleanup_task(self):
-        """Периодическая очистка rate limiter"""
+        """Периодическая очистка rate limiter и кэша ответов"""
         while self.is_running:
             try:
                 await asyncio.sleep(3600)  # Каждый час
                 if self.is_running:
                     rate_limiter.cleanup()
-                    logger.info("🧹 Выполнена очистка rate limiter")
+                    response_cache.cleanup()
+                    context_cache.cleanup()
+                    if database.db_manager:
+                        database.db_manager.user_cache.cleanup()
+                        database.db_manager.chat_cache.cleanup()
+                    logger.info("🧹 Выполнена очистка rate limiter и кэша ответов")
             except Exception as e:
                 logger.error(f"❌ Ошибка при очистке rate limiter: {e}")
     
@@ -229,8 +284,8 @@ async def main():
 
 if __name__ == "__main__":
     # Проверяем версию Python
-    if sys.version_info < (3, 8):
-        print("❌ Требуется Python 3.8 или выше")
+    if sys.version_info < (3, 9):
+        print("❌ Требуется Python 3.9 или выше")
         sys.exit(1)
     
     # Запускаем бота
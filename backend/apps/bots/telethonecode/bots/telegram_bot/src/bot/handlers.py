@@ -4,15 +4,18 @@
 import asyncio
 import logging
 import time
-from typing import Optional
+from typing import Optional, Dict, Any
 from telegram import Update, Message, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
 from telegram.constants import ParseMode, ChatAction
 
-from ..database import db_manager
-from ..services import bot_gpt_service, human_behavior_service
+from ..database import manager as database
+from ..services import bot_gpt_service, human_behavior_service, response_cache, image_pipeline
+from ..services import image_generation_service, chat_delivery, chat_progress
 from ..utils import rate_limiter, format_duration, split_long_message, complexity_analyzer
-from config import config
+from ..utils import cpu_executor
+from ...config import config
+from .streaming import StreamingReply
 
 logger = logging.getLogger(__name__)
 
@@ -39,9 +42,9 @@ class CommandHandlers:
             return
         
         # Регистрируем пользователя и чат в базе данных
-        if db_manager:
+        if database.db_manager:
             try:
-                await db_manager.get_or_create_user(
+                await database.db_manager.get_or_create_user(
                     telegram_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
@@ -49,7 +52,7 @@ class CommandHandlers:
                     is_admin=True
                 )
                 
-                await db_manager.get_or_create_chat(
+                await database.db_manager.get_or_create_chat(
                     chat_id=chat.id,
                     chat_type=chat.type,
                     title=getattr(chat, 'title', None)
@@ -103,6 +106,7 @@ _Поддерживается работа с изображениями и ис
 *📝 Основные команды:*
 • `/start` - Начать работу с ботом
 • `/ask [вопрос]` - Задать вопрос AI ассистенту
+• `/image [описание]` - Сгенерировать изображение
 • `/help` - Показать эту справку
 • `/status` - Проверить статус системы
 • `/stats` - Ваша персональная статистика
@@ -111,6 +115,7 @@ _Поддерживается работа с изображениями и ис
 • `/admin` - Панель администратора
 • `/reset [user_id]` - Сбросить лимиты для пользователя
 • `/providers` - Информация о AI провайдерах
+• `/cache [on|off]` - Кэш ответов в этом чате и его статистика
 
 *💡 Примеры команды /ask:*
 ```
@@ -150,7 +155,7 @@ _Бот работает 24/7 и сохраняет историю всех ра
             return
         
         # Проверяем rate limiting
-        is_allowed, error_msg = rate_limiter.is_allowed(
+        is_allowed, error_msg = await rate_limiter.is_allowed(
             user.id, 
             max_requests=config.MAX_REQUESTS_PER_MINUTE,
             time_window=60
@@ -170,21 +175,8 @@ _Бот работает 24/7 и сохраняет историю всех ра
         image_data = None
         if message.photo:
             try:
-                # Получаем изображение наибольшего размера
-                photo = message.photo[-1]
-                file = await context.bot.get_file(photo.file_id)
-                
-                # Скачиваем изображение
-                import io
-                import base64
-                
-                image_bytes = io.BytesIO()
-                await file.download_to_memory(image_bytes)
-                image_bytes.seek(0)
-                
-                # Конвертируем в base64
-                image_base64 = base64.b64encode(image_bytes.getvalue()).decode('utf-8')
-                image_data = f"data:image/jpeg;base64,{image_base64}"
+                # Наименьший достаточный размер фото, уменьшенный и в base64 (повторные фото - из кэша)
+                image_data = await image_pipeline.prepare(context.bot, message.photo)
                 
                 logger.info(f"[IMAGE] Получено изображение от пользователя {user.id}")
                 
@@ -218,15 +210,17 @@ _Бот работает 24/7 и сохраняет историю всех ра
         logger.info(f"🤖 Эмулируем человеческое поведение для команды /ask - задержка {human_delay/60:.1f} минут")
         
         # Анализируем сложность вопроса для тега человека  
-        complexity_analysis = complexity_analyzer.analyze_complexity(question_text)
+        complexity_analysis = await cpu_executor.run(
+            complexity_analyzer.analyze_complexity, question_text, size=len(question_text)
+        )
         should_tag_human = complexity_analysis["should_tag_human"]
         
         # Сохраняем сообщение пользователя в БД
         saved_message = None
-        if db_manager:
+        if database.db_manager:
             try:
-                # Обновляем информацию о пользователе
-                await db_manager.get_or_create_user(
+                # Обновляем информацию о пользователе (запись в БД - отложенная, пачками)
+                database.db_manager.writer.touch_user(
                     telegram_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
@@ -235,7 +229,7 @@ _Бот работает 24/7 и сохраняет историю всех ра
                 )
                 
                 # Сохраняем сообщение
-                saved_message = await db_manager.save_message(
+                saved_message = database.db_manager.writer.save_message(
                     telegram_message_id=message.message_id,
                     chat_id=chat.id,
                     user_id=user.id,
@@ -246,7 +240,7 @@ _Бот работает 24/7 и сохраняет историю всех ра
                     has_image=bool(image_data)
                 )
                 
-                logger.info(f"[DB] Сообщение сохранено в БД: {saved_message.id}")
+                logger.info(f"[DB] Сообщение поставлено в очередь записи в БД (чат {chat.id})")
             except Exception as e:
                 logger.error(f"[DB_ERROR] Ошибка сохранения сообщения: {e}")
         
@@ -263,12 +257,18 @@ _Бот работает 24/7 и сохраняет историю всех ра
             import time
             start_time = time.time()
             
-            response_data = await self.gpt_service.get_response_async(
-                message=question_text,
-                image_data=image_data,
-                chat_id=chat.id,
-                model="auto"
-            )
+            # Потоковый режим: текст появляется по мере генерации (только без изображения)
+            streamed = config.STREAM_RESPONSES and not image_data
+            if streamed:
+                tag_prefix = await self._human_tag_prefix(context) if should_tag_human else ""
+                response_data = await self._stream_ai_response(message, question_text, chat.id, tag_prefix)
+            else:
+                response_data = await self.gpt_service.get_response_async(
+                    message=question_text,
+                    image_data=image_data,
+                    chat_id=chat.id,
+                    model="auto"
+                )
             
             end_time = time.time()
             response_time_ms = int((end_time - start_time) * 1000)
@@ -278,48 +278,45 @@ _Бот работает 24/7 и сохраняет историю всех ра
                 provider_used = response_data.get("provider_used", "unknown")
                 model_used = response_data.get("model_used", "unknown")
                 
-                # Если вопрос сложный, добавляем тег пользователя
-                if should_tag_human and config.HUMAN_TAG_USER_ID:
-                    try:
-                        human_user = await context.bot.get_chat(config.HUMAN_TAG_USER_ID)
-                        human_mention = f"@{human_user.username}" if human_user.username else f"[Человек](tg://user?id={config.HUMAN_TAG_USER_ID})"
-                        response_text = f"🧠 *Сложный вопрос для эксперта* {human_mention}\n\n{response_text}"
-                    except Exception as e:
-                        logger.error(f"[TAG_ERROR] Ошибка при теге человека: {e}")
-                
-                # Разбиваем длинные ответы на части
-                message_parts = split_long_message(response_text, max_length=4000)
+                # В потоковом режиме ответ уже показан (и тег уже добавлен)
+                if not streamed:
+                    # Если вопрос сложный, добавляем тег пользователя
+                    if should_tag_human:
+                        response_text = await self._human_tag_prefix(context) + response_text
+                    
+                    # Разбиваем длинные ответы на части
+                    message_parts = await cpu_executor.run(split_long_message, response_text, 4000, size=len(response_text))
                 
-                # Отправляем ответ с эмуляцией человеческого поведения через Telethon
-                for i, part in enumerate(message_parts):
-                    try:
-                        # Используем Telethon для эмуляции человеческого поведения
-                        if human_behavior_service.is_initialized:
-                            await human_behavior_service.send_message_with_human_behavior(
-                                chat_id=chat.id,
-                                message=part
-                            )
-                        else:
-                            # Fallback на обычный Bot API
+                    # Отправляем ответ с эмуляцией человеческого поведения через Telethon
+                    for i, part in enumerate(message_parts):
+                        try:
+                            # Используем Telethon для эмуляции человеческого поведения
+                            if human_behavior_service.is_initialized:
+                                await human_behavior_service.send_message_with_human_behavior(
+                                    chat_id=chat.id,
+                                    message=part
+                                )
+                            else:
+                                # Fallback на обычный Bot API
+                                await message.reply_text(
+                                    part,
+                                    parse_mode=ParseMode.MARKDOWN,
+                                    disable_web_page_preview=True
+                                )
+                        except Exception as send_error:
+                            logger.error(f"[SEND_ERROR] Ошибка отправки через Telethon, используем fallback: {send_error}")
+                            # Fallback на обычный telegram API
                             await message.reply_text(
                                 part,
                                 parse_mode=ParseMode.MARKDOWN,
                                 disable_web_page_preview=True
                             )
-                    except Exception as send_error:
-                        logger.error(f"[SEND_ERROR] Ошибка отправки через Telethon, используем fallback: {send_error}")
-                        # Fallback на обычный telegram API
-                        await message.reply_text(
-                            part,
-                            parse_mode=ParseMode.MARKDOWN,
-                            disable_web_page_preview=True
-                        )
                 
                 # Обновляем сообщение в БД
-                if db_manager and saved_message:
+                if database.db_manager and saved_message:
                     try:
-                        await db_manager.update_message_response(
-                            message_id=saved_message.id,
+                        database.db_manager.writer.update_message_response(
+                            saved_message,
                             gpt_response=response_text,
                             model_used=model_used,
                             provider_used=provider_used,
@@ -327,7 +324,7 @@ _Бот работает 24/7 и сохраняет историю всех ра
                         )
                         
                         # Логируем запрос
-                        await db_manager.log_request(
+                        database.db_manager.writer.log_request(
                             user_id=user.id,
                             chat_id=chat.id,
                             request_type='ask',
@@ -345,13 +342,14 @@ _Бот работает 24/7 и сохраняет историю всех ра
                 
             else:
                 # Ошибка получения ответа
-                error_text = response_data.get("response", "🚫 Не удалось получить ответ от AI.")
-                await message.reply_text(error_text)
+                if not streamed:
+                    error_text = response_data.get("response", "🚫 Не удалось получить ответ от AI.")
+                    await message.reply_text(error_text)
                 
                 # Логируем ошибку
-                if db_manager:
+                if database.db_manager:
                     try:
-                        await db_manager.log_request(
+                        database.db_manager.writer.log_request(
                             user_id=user.id,
                             chat_id=chat.id,
                             request_type='ask',
@@ -372,9 +370,9 @@ _Бот работает 24/7 и сохраняет историю всех ра
             )
             
             # Логируем критическую ошибку
-            if db_manager:
+            if database.db_manager:
                 try:
-                    await db_manager.log_request(
+                    database.db_manager.writer.log_request(
                         user_id=user.id,
                         chat_id=chat.id,
                         request_type='ask',
@@ -385,6 +383,56 @@ _Бот работает 24/7 и сохраняет историю всех ра
                 except Exception as db_e:
                     logger.error(f"[DB_ERROR] Ошибка логирования критической ошибки: {db_e}")
     
+    async def image_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /image - генерация изображения в фоновой очереди"""
+        user = update.effective_user
+        chat = update.effective_chat
+        message = update.message
+        
+        # Проверяем права доступа
+        if user.id not in config.TELEGRAM_ADMIN_IDS:
+            await message.reply_text("🚫 Доступ запрещен.")
+            return
+        
+        # Проверяем rate limiting
+        is_allowed, error_msg = await rate_limiter.is_allowed(
+            user.id,
+            max_requests=config.MAX_REQUESTS_PER_MINUTE,
+            time_window=60
+        )
+        
+        if not is_allowed:
+            await message.reply_text(f"⏱️ {error_msg}")
+            logger.warning(f"[RATE_LIMIT] Пользователь {user.id} превысил лимит: {error_msg}")
+            return
+        
+        prompt = " ".join(context.args) if context.args else ""
+        if not prompt:
+            await message.reply_text(
+                "❓ Пожалуйста, опишите изображение.\n\n"
+                "*Пример:* `/image кот в скафандре на Луне`",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+        
+        # Генерация занимает 20+ секунд - ставим задачу в очередь, результат придет в чат
+        result = await image_generation_service.submit(
+            prompt,
+            chat_id=chat.id,
+            user_id=user.id,
+            on_complete=chat_delivery(context.bot),
+            on_progress=chat_progress(context.bot)
+        )
+        
+        if not result["success"]:
+            await message.reply_text(f"🚫 {result.get('message') or result.get('error')}")
+            return
+        
+        position = result.get("position")
+        queue_text = f" (место в очереди: {position})" if position and position > 1 else ""
+        await message.reply_text(f"🎨 Генерирую изображение{queue_text}, пришлю его сюда, когда будет готово.")
+        logger.info(f"[IMAGE_JOBS] Пользователь {user.id} поставил задачу {result['job_id']}")
+    
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /status"""
         user = update.effective_user
@@ -398,16 +446,18 @@ _Бот работает 24/7 и сохраняет историю всех ра
             provider_info = self.gpt_service.get_provider_info()
             
             # Получаем статистику пользователя
-            user_stats = rate_limiter.get_user_stats(user.id)
+            user_stats = await rate_limiter.get_user_stats(user.id)
             
             # Получаем статистику из БД
             db_stats = None
-            if db_manager:
+            if database.db_manager:
                 try:
-                    db_stats = await db_manager.get_system_stats()
+                    db_stats = await database.db_manager.get_system_stats()
                 except Exception as e:
                     logger.error(f"[DB_ERROR] Ошибка получения статистики из БД: {e}")
             
+            executor_stats = cpu_executor.get_stats()
+            
             status_text = f"""📊 *Статус системы*
 
 *🤖 AI Провайдеры:*
@@ -435,7 +485,8 @@ _Бот работает 24/7 и сохраняет историю всех ра
 *⚙️ Конфигурация:*
 • Лимит запросов: {config.MAX_REQUESTS_PER_MINUTE}/мин
 • Макс. длина ответа: {config.MAX_MESSAGE_LENGTH} символов
-• База данных: {'✅ Подключена' if db_manager else '❌ Отключена'}
+• База данных: {'✅ Подключена' if database.db_manager else '❌ Отключена'}
+• Блокировка цикла: {executor_stats['loop_blocked_seconds']:.2f}с (макс. {executor_stats['max_inline_seconds'] * 1000:.0f} мс), в пуле: {executor_stats['offloaded_calls']}
 
 _Обновлено: {time.strftime('%H:%M:%S')}_"""
 
@@ -461,13 +512,13 @@ _Обновлено: {time.strftime('%H:%M:%S')}_"""
         
         try:
             # Получаем статистику из rate limiter
-            rate_stats = rate_limiter.get_user_stats(user.id)
+            rate_stats = await rate_limiter.get_user_stats(user.id)
             
             # Получаем статистику из БД
             db_stats = None
-            if db_manager:
+            if database.db_manager:
                 try:
-                    db_stats = await db_manager.get_user_stats(user.id)
+                    db_stats = await database.db_manager.get_user_stats(user.id)
                 except Exception as e:
                     logger.error(f"[DB_ERROR] Ошибка получения статистики пользователя: {e}")
             
@@ -544,9 +595,9 @@ _Статистика обновлена: {time.strftime('%H:%M:%S')}_"""
                 admin_text += "\n_Статистика пока не собрана_"
 
             # Информация о системе
-            if db_manager:
+            if database.db_manager:
                 try:
-                    system_stats = await db_manager.get_system_stats()
+                    system_stats = await database.db_manager.get_system_stats()
                     admin_text += f"""
 
 *📈 Система:*
@@ -603,7 +654,7 @@ _Панель обновлена: {time.strftime('%H:%M:%S')}_"""
             target_user_id = int(context.args[0])
             
             # Сбрасываем лимиты
-            rate_limiter.reset_user(target_user_id)
+            await rate_limiter.reset_user(target_user_id)
             
             await update.message.reply_text(
                 f"✅ Лимиты пользователя `{target_user_id}` сброшены.",
@@ -618,6 +669,44 @@ _Панель обновлена: {time.strftime('%H:%M:%S')}_"""
             logger.error(f"[ERROR] Ошибка сброса лимитов: {e}")
             await update.message.reply_text("🚫 Ошибка при сбросе лимитов.")
     
+    async def cache_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /cache - статистика кэша ответов и отключение его для чата"""
+        user = update.effective_user
+        chat = update.effective_chat
+        
+        # Проверяем права доступа
+        if user.id not in config.TELEGRAM_ADMIN_IDS:
+            return
+        
+        if context.args:
+            action = context.args[0].lower()
+            if action not in ('on', 'off'):
+                await update.message.reply_text(
+                    "❓ Использование: `/cache`, `/cache on` или `/cache off`",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                return
+            response_cache.set_chat_enabled(chat.id, action == 'on')
+            logger.info(f"[CACHE] Администратор {user.id} {'включил' if action == 'on' else 'отключил'} кэш для чата {chat.id}")
+        
+        stats = response_cache.get_stats()
+        hit_ratio = f"{stats['hit_ratio']:.0%}" if stats['hit_ratio'] is not None else "нет данных"
+        chat_status = "✅ включен" if response_cache.is_enabled_for(chat.id) else "❌ отключен"
+        
+        cache_text = f"""🗄️ *Кэш ответов*
+
+*В этом чате:* {chat_status}
+
+*📊 Статистика:*
+• Записей: {stats['size']}/{stats['max_entries']}
+• Попадания: {stats['exact_hits']} точных, {stats['similar_hits']} похожих
+• Промахи: {stats['misses']}
+• Доля попаданий: {hit_ratio}
+• Мимо кэша (изображения, отключенные чаты): {stats['bypassed']}
+• Вытеснено: {stats['evictions']}, просрочено: {stats['expired']}"""
+        
+        await update.message.reply_text(cache_text, parse_mode=ParseMode.MARKDOWN)
+    
     async def providers_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /providers - детальная информация о провайдерах"""
         user = update.effective_user
@@ -641,27 +730,19 @@ _Панель обновлена: {time.strftime('%H:%M:%S')}_"""
 *⚡ Быстрые провайдеры (до 3с):*"""
             
             for provider in self.gpt_service.fast_providers:
-                status = "🟢" if provider == provider_info['current'] else "⚪"
-                usage = provider_info['provider_stats'].get(provider, 0)
-                providers_text += f"\n{status} `{provider}` - {usage} использований"
+                providers_text += self._format_provider_line(provider, provider_info)
             
             providers_text += "\n\n*🔶 Средние провайдеры (3-6с):*"
             for provider in self.gpt_service.medium_providers:
-                status = "🟢" if provider == provider_info['current'] else "⚪"
-                usage = provider_info['provider_stats'].get(provider, 0)
-                providers_text += f"\n{status} `{provider}` - {usage} использований"
+                providers_text += self._format_provider_line(provider, provider_info)
             
             providers_text += "\n\n*🟠 Медленные провайдеры (6с+):*"
             for provider in self.gpt_service.slow_providers:
-                status = "🟢" if provider == provider_info['current'] else "⚪"
-                usage = provider_info['provider_stats'].get(provider, 0)
-                providers_text += f"\n{status} `{provider}` - {usage} использований"
+                providers_text += self._format_provider_line(provider, provider_info)
             
             providers_text += "\n\n*👁️ Vision провайдеры:*"
             for provider in self.gpt_service.vision_providers:
-                status = "🟢" if provider == provider_info['current'] else "⚪"
-                usage = provider_info['provider_stats'].get(provider, 0)
-                providers_text += f"\n{status} `{provider}` - {usage} использований"
+                providers_text += self._format_provider_line(provider, provider_info)
             
             providers_text += f"\n\n_Обновлено: {time.strftime('%H:%M:%S')}_"
             
@@ -681,6 +762,25 @@ _Панель обновлена: {time.strftime('%H:%M:%S')}_"""
             logger.error(f"[ERROR] Ошибка получения информации о провайдерах: {e}")
             await update.message.reply_text("🚫 Ошибка получения информации о провайдерах.")
     
+    def _format_provider_line(self, provider: str, provider_info: dict) -> str:
+        """Строка провайдера для /providers: использование и живая задержка"""
+        status = "🟢" if provider == provider_info['current'] else "⚪"
+        usage = provider_info['provider_stats'].get(provider, 0)
+        line = f"\n{status} `{provider}` - {usage} использований"
+        
+        health = provider_info.get('provider_health', {}).get(provider)
+        if health and health['p50'] is not None:
+            line += f", p50 {health['p50']:.1f}с / p95 {health['p95']:.1f}с"
+        if health and health['success_ratio'] is not None:
+            line += f", успех {health['success_ratio']:.0%}"
+        
+        circuit = provider_info.get('circuit_breakers', {}).get(provider)
+        if circuit and circuit['state'] == 'open':
+            line += f" ⛔ отключен ещё {circuit['retry_in']:.0f}с"
+        elif circuit and circuit['state'] == 'half_open':
+            line += " 🔁 пробный запрос"
+        return line
+    
     async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на инлайн-кнопки"""
         query = update.callback_query
@@ -785,7 +885,7 @@ _Ожидаю ваш вопрос..._"""
         """Показать статус в инлайн режиме"""
         try:
             provider_info = self.gpt_service.get_provider_info()
-            user_stats = rate_limiter.get_user_stats(query.from_user.id)
+            user_stats = await rate_limiter.get_user_stats(query.from_user.id)
             
             status_text = f"""📊 *Статус системы*
 
@@ -801,7 +901,7 @@ _Ожидаю ваш вопрос..._"""
 
 *⚙️ Конфигурация:*
 • Лимит запросов: {config.MAX_REQUESTS_PER_MINUTE}/мин
-• База данных: {'✅ Подключена' if db_manager else '❌ Отключена'}"""
+• База данных: {'✅ Подключена' if database.db_manager else '❌ Отключена'}"""
 
             keyboard = [[InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -819,12 +919,12 @@ _Ожидаю ваш вопрос..._"""
         """Показать статистику пользователя в инлайн режиме"""
         try:
             user = query.from_user
-            rate_stats = rate_limiter.get_user_stats(user.id)
+            rate_stats = await rate_limiter.get_user_stats(user.id)
             
             db_stats = None
-            if db_manager:
+            if database.db_manager:
                 try:
-                    db_stats = await db_manager.get_user_stats(user.id)
+                    db_stats = await database.db_manager.get_user_stats(user.id)
                 except Exception as e:
                     logger.error(f"[DB_ERROR] Ошибка получения статистики: {e}")
             
@@ -875,9 +975,9 @@ _Ожидаю ваш вопрос..._"""
                 for i, (provider, count) in enumerate(top_providers, 1):
                     admin_text += f"\n{i}. `{provider}` - {count}"
 
-            if db_manager:
+            if database.db_manager:
                 try:
-                    system_stats = await db_manager.get_system_stats()
+                    system_stats = await database.db_manager.get_system_stats()
                     admin_text += f"""
 
 *📈 Система:*
@@ -997,7 +1097,7 @@ _Ожидаю ваш вопрос..._"""
         message = update.message
         
         # Проверяем rate limiting
-        is_allowed, error_msg = rate_limiter.is_allowed(
+        is_allowed, error_msg = await rate_limiter.is_allowed(
             user.id, 
             max_requests=config.MAX_REQUESTS_PER_MINUTE,
             time_window=60
@@ -1012,7 +1112,9 @@ _Ожидаю ваш вопрос..._"""
         question_text = message.text or ""
         
         # Анализируем сложность вопроса
-        complexity_analysis = complexity_analyzer.analyze_complexity(question_text)
+        complexity_analysis = await cpu_executor.run(
+            complexity_analyzer.analyze_complexity, question_text, size=len(question_text)
+        )
         should_tag_human = complexity_analysis["should_tag_human"]
         
         logger.info(f"[SIMPLE_MSG] Пользователь {user.id}: '{question_text[:50]}...' (сложность: {complexity_analysis['complexity_level']})")
@@ -1038,12 +1140,18 @@ _Ожидаю ваш вопрос..._"""
             import time
             start_time = time.time()
             
-            response_data = await self.gpt_service.get_response_async(
-                message=question_text,
-                image_data=None,
-                chat_id=chat.id,
-                model="auto"
-            )
+            # Потоковый режим: текст появляется по мере генерации
+            streamed = config.STREAM_RESPONSES
+            if streamed:
+                tag_prefix = await self._human_tag_prefix(context) if should_tag_human else ""
+                response_data = await self._stream_ai_response(message, question_text, chat.id, tag_prefix)
+            else:
+                response_data = await self.gpt_service.get_response_async(
+                    message=question_text,
+                    image_data=None,
+                    chat_id=chat.id,
+                    model="auto"
+                )
             
             end_time = time.time()
             response_time_ms = int((end_time - start_time) * 1000)
@@ -1053,56 +1161,96 @@ _Ожидаю ваш вопрос..._"""
                 provider_used = response_data.get("provider_used", "unknown")
                 model_used = response_data.get("model_used", "unknown")
                 
-                # Если вопрос сложный, добавляем тег пользователя
-                if should_tag_human and config.HUMAN_TAG_USER_ID:
-                    try:
-                        human_user = await context.bot.get_chat(config.HUMAN_TAG_USER_ID)
-                        human_mention = f"@{human_user.username}" if human_user.username else f"[Человек](tg://user?id={config.HUMAN_TAG_USER_ID})"
-                        response_text = f"🧠 *Сложный вопрос для эксперта* {human_mention}\n\n{response_text}"
-                    except Exception as e:
-                        logger.error(f"[TAG_ERROR] Ошибка при теге человека: {e}")
-                
-                # Разбиваем длинные ответы на части
-                message_parts = split_long_message(response_text, max_length=4000)
+                # В потоковом режиме ответ уже показан (и тег уже добавлен)
+                if not streamed:
+                    # Если вопрос сложный, добавляем тег пользователя
+                    if should_tag_human:
+                        response_text = await self._human_tag_prefix(context) + response_text
+                    
+                    # Разбиваем длинные ответы на части
+                    message_parts = await cpu_executor.run(split_long_message, response_text, 4000, size=len(response_text))
                 
-                # Отправляем ответ с эмуляцией человеческого поведения через Telethon
-                for i, part in enumerate(message_parts):
-                    try:
-                        # Используем Telethon для более человечного поведения
-                        if human_behavior_service.is_initialized and chat.type == 'private':
-                            # Отправляем через Telethon с человеческим поведением
-                            await human_behavior_service.send_message_with_human_behavior(
-                                chat_id=chat.id,
-                                message=part
-                            )
-                        else:
-                            # Fallback на обычный API
+                    # Отправляем ответ с эмуляцией человеческого поведения через Telethon
+                    for i, part in enumerate(message_parts):
+                        try:
+                            # Используем Telethon для более человечного поведения
+                            if human_behavior_service.is_initialized and chat.type == 'private':
+                                # Отправляем через Telethon с человеческим поведением
+                                await human_behavior_service.send_message_with_human_behavior(
+                                    chat_id=chat.id,
+                                    message=part
+                                )
+                            else:
+                                # Fallback на обычный API
+                                await message.reply_text(
+                                    part,
+                                    parse_mode=ParseMode.MARKDOWN,
+                                    disable_web_page_preview=True
+                                )
+                        except Exception as send_error:
+                            logger.error(f"[SEND_ERROR] Ошибка отправки через Telethon, используем fallback: {send_error}")
+                            # Fallback на обычный telegram API
                             await message.reply_text(
                                 part,
                                 parse_mode=ParseMode.MARKDOWN,
                                 disable_web_page_preview=True
                             )
-                    except Exception as send_error:
-                        logger.error(f"[SEND_ERROR] Ошибка отправки через Telethon, используем fallback: {send_error}")
-                        # Fallback на обычный telegram API
-                        await message.reply_text(
-                            part,
-                            parse_mode=ParseMode.MARKDOWN,
-                            disable_web_page_preview=True
-                        )
                 
                 logger.info(f"[SIMPLE_SUCCESS] Ответ отправлен пользователю {user.id}. Провайдер: {provider_used}, сложность: {complexity_analysis['complexity_level']}")
                 
             else:
                 # Ошибка получения ответа
-                error_text = response_data.get("response", "🚫 Не удалось получить ответ от AI.")
-                await message.reply_text(error_text)
+                if not streamed:
+                    error_text = response_data.get("response", "🚫 Не удалось получить ответ от AI.")
+                    await message.reply_text(error_text)
                 logger.warning(f"[SIMPLE_ERROR] Не удалось получить ответ для пользователя {user.id}: {response_data.get('error')}")
         
         except Exception as e:
             logger.error(f"[SIMPLE_CRITICAL] Критическая ошибка при обработке простого сообщения: {e}")
             await message.reply_text("🚫 Произошла ошибка при обработке запроса. Попробуйте позже.")
     
+    async def _stream_ai_response(self, message: Message, question_text: str, chat_id: int,
+                                  tag_prefix: str = "") -> Dict[str, Any]:
+        """Потоковый ответ AI: заглушка, затем правки сообщения по мере генерации"""
+        reply = StreamingReply(message, edit_interval=config.STREAM_EDIT_INTERVAL)
+        await reply.start()
+        
+        error_text = "🚫 Не удалось получить ответ от AI."
+        stream = self.gpt_service.stream_response(question_text, chat_id=chat_id, model="auto")
+        deltas = stream.__aiter__()
+        try:
+            async for delta in deltas:
+                await reply.push(delta)
+            response_data = stream.result or {"success": False, "error": "Поток завершился без результата",
+                                              "response": error_text}
+            if response_data["success"]:
+                response_data["response"] = tag_prefix + response_data["response"]
+                await reply.finish(response_data["response"])
+                return response_data
+        except Exception as e:
+            # Ошибка Telegram (сеть, BadRequest) или провайдера - заглушка не должна остаться в чате
+            logger.error(f"[STREAM] Потоковый ответ прерван: {e}")
+            await deltas.aclose()
+            response_data = {"success": False, "error": str(e), "response": error_text}
+        
+        try:
+            await reply.fail(response_data.get("response", error_text))
+        except Exception as e:
+            logger.error(f"[STREAM] Не удалось показать ошибку в чате: {e}")
+        return response_data
+    
+    async def _human_tag_prefix(self, context: ContextTypes.DEFAULT_TYPE) -> str:
+        """Тег эксперта для сложного вопроса (пустая строка, если тег не настроен или недоступен)"""
+        if not config.HUMAN_TAG_USER_ID:
+            return ""
+        try:
+            human_user = await context.bot.get_chat(config.HUMAN_TAG_USER_ID)
+            human_mention = f"@{human_user.username}" if human_user.username else f"[Человек](tg://user?id={config.HUMAN_TAG_USER_ID})"
+            return f"🧠 *Сложный вопрос для эксперта* {human_mention}\n\n"
+        except Exception as e:
+            logger.error(f"[TAG_ERROR] Ошибка при теге человека: {e}")
+            return ""
+    
     async def _process_ai_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE, use_human_behavior: bool = False):
         """Обработка вопроса к AI (вынесено из ask_command)"""
         user = update.effective_user
@@ -1110,7 +1258,7 @@ _Ожидаю ваш вопрос..._"""
         message = update.message
         
         # Проверяем rate limiting
-        is_allowed, error_msg = rate_limiter.is_allowed(
+        is_allowed, error_msg = await rate_limiter.is_allowed(
             user.id, 
             max_requests=config.MAX_REQUESTS_PER_MINUTE,
             time_window=60
@@ -1134,21 +1282,8 @@ _Ожидаю ваш вопрос..._"""
         image_data = None
         if message.photo:
             try:
-                # Получаем изображение наибольшего размера
-                photo = message.photo[-1]
-                file = await context.bot.get_file(photo.file_id)
-                
-                # Скачиваем изображение
-                import io
-                import base64
-                
-                image_bytes = io.BytesIO()
-                await file.download_to_memory(image_bytes)
-                image_bytes.seek(0)
-                
-                # Конвертируем в base64
-                image_base64 = base64.b64encode(image_bytes.getvalue()).decode('utf-8')
-                image_data = f"data:image/jpeg;base64,{image_base64}"
+                # Наименьший достаточный размер фото, уменьшенный и в base64 (повторные фото - из кэша)
+                image_data = await image_pipeline.prepare(context.bot, message.photo)
                 
                 logger.info(f"[IMAGE] Получено изображение от пользователя {user.id}")
                 
@@ -1187,15 +1322,17 @@ _Ожидаю ваш вопрос..._"""
             logger.info(f"🤖 Эмулируем человеческое поведение - задержка {human_delay/60:.1f} минут")
         
         # Анализируем сложность вопроса для тега человека
-        complexity_analysis = complexity_analyzer.analyze_complexity(question_text)
+        complexity_analysis = await cpu_executor.run(
+            complexity_analyzer.analyze_complexity, question_text, size=len(question_text)
+        )
         should_tag_human = complexity_analysis["should_tag_human"]
         
         # Сохраняем сообщение пользователя в БД
         saved_message = None
-        if db_manager:
+        if database.db_manager:
             try:
-                # Обновляем информацию о пользователе
-                await db_manager.get_or_create_user(
+                # Обновляем информацию о пользователе (запись в БД - отложенная, пачками)
+                database.db_manager.writer.touch_user(
                     telegram_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
@@ -1204,7 +1341,7 @@ _Ожидаю ваш вопрос..._"""
                 )
                 
                 # Сохраняем сообщение
-                saved_message = await db_manager.save_message(
+                saved_message = database.db_manager.writer.save_message(
                     telegram_message_id=message.message_id,
                     chat_id=chat.id,
                     user_id=user.id,
@@ -1215,7 +1352,7 @@ _Ожидаю ваш вопрос..._"""
                     has_image=bool(image_data)
                 )
                 
-                logger.info(f"[DB] Сообщение сохранено в БД: {saved_message.id}")
+                logger.info(f"[DB] Сообщение поставлено в очередь записи в БД (чат {chat.id})")
             except Exception as e:
                 logger.error(f"[DB_ERROR] Ошибка сохранения сообщения: {e}")
         
@@ -1249,7 +1386,7 @@ _Ожидаю ваш вопрос..._"""
                 model_used = response_data.get("model_used", "unknown")
                 
                 # Разбиваем длинные ответы на части
-                message_parts = split_long_message(response_text, max_length=4000)
+                message_parts = await cpu_executor.run(split_long_message, response_text, 4000, size=len(response_text))
                 
                 # Отправляем ответ с эмуляцией человеческого поведения
                 for i, part in enumerate(message_parts):
@@ -1312,10 +1449,10 @@ _Ожидаю ваш вопрос..._"""
                             )
                 
                 # Обновляем сообщение в БД
-                if db_manager and saved_message:
+                if database.db_manager and saved_message:
                     try:
-                        await db_manager.update_message_response(
-                            message_id=saved_message.id,
+                        database.db_manager.writer.update_message_response(
+                            saved_message,
                             gpt_response=response_text,
                             model_used=model_used,
                             provider_used=provider_used,
@@ -1323,7 +1460,7 @@ _Ожидаю ваш вопрос..._"""
                         )
                         
                         # Логируем запрос
-                        await db_manager.log_request(
+                        database.db_manager.writer.log_request(
                             user_id=user.id,
                             chat_id=chat.id,
                             request_type='ask_button',
@@ -1349,9 +1486,9 @@ _Ожидаю ваш вопрос..._"""
                 await message.reply_text(error_text, reply_markup=reply_markup)
                 
                 # Логируем ошибку
-                if db_manager:
+                if database.db_manager:
                     try:
-                        await db_manager.log_request(
+                        database.db_manager.writer.log_request(
                             user_id=user.id,
                             chat_id=chat.id,
                             request_type='ask_button',
@@ -1377,9 +1514,9 @@ _Ожидаю ваш вопрос..._"""
             )
             
             # Логируем критическую ошибку
-            if db_manager:
+            if database.db_manager:
                 try:
-                    await db_manager.log_request(
+                    database.db_manager.writer.log_request(
                         user_id=user.id,
                         chat_id=chat.id,
                         request_type='ask_button',
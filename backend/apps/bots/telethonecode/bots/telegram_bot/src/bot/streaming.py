@@ -0,0 +1,144 @@
+"""
+Потоковая отправка ответа: одно сообщение, которое дописывается через edit_message_text
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import List, Optional
+from telegram import Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from ..utils import split_long_message, cpu_executor
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingReply:
+    """
+    Ответ, который появляется по мере генерации
+
+    Сначала отправляется короткая заглушка, затем текст дописывается правками
+    не чаще одной в edit_interval секунд (Telegram ограничивает частоту правок,
+    при RetryAfter правки откладываются). Промежуточный текст отправляется без
+    разметки - незакрытый markdown Telegram не примет. В finish() итоговый
+    отформатированный текст ставится с ParseMode.MARKDOWN.
+    """
+
+    def __init__(self, message: Message, edit_interval: float = 1.5,
+                 max_length: int = 4000, placeholder: str = "💭 ..."):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.placeholder = placeholder
+        self.messages: List[Message] = []  # Отправленные сообщения (длинный ответ - несколько)
+        self.text = ""                      # Весь накопленный текст
+        self.offset = 0                     # С какого символа начинается текущее сообщение
+        self.shown = ""                     # Что сейчас видно в текущем сообщении
+        self.next_edit_at = 0.0
+        self.edits = 0
+        self.first_visible_at: Optional[float] = None
+        self.started_at = time.time()
+
+    async def start(self):
+        """Отправить заглушку, которую будем дописывать"""
+        sent = await self.message.reply_text(self.placeholder)
+        self.messages.append(sent)
+        self.next_edit_at = time.monotonic() + self.edit_interval
+
+    async def push(self, delta: str):
+        """Добавить фрагмент; сообщение правится, только если прошло edit_interval"""
+        self.text += delta
+
+        # Текущее сообщение переполнено - фиксируем его и начинаем следующее
+        while len(self.text) - self.offset > self.max_length:
+            chunk = self.text[self.offset:self.offset + self.max_length]
+            cut = chunk.rfind('\n')
+            if cut <= 0:
+                cut = len(chunk)
+            await self._edit(self.messages[-1], chunk[:cut], force=True)
+            self.offset += cut
+            sent = await self.message.reply_text(self.placeholder)
+            self.messages.append(sent)
+            self.shown = ""
+
+        if time.monotonic() >= self.next_edit_at:
+            await self._edit(self.messages[-1], self.text[self.offset:])
+
+    async def finish(self, final_text: str):
+        """Заменить черновик итоговым текстом (с разметкой и разбиением на части)"""
+        parts = await cpu_executor.run(split_long_message, final_text, self.max_length, size=len(final_text))
+
+        for i, part in enumerate(parts):
+            if i < len(self.messages):
+                await self._edit(self.messages[i], part, force=True, parse_mode=ParseMode.MARKDOWN)
+            else:
+                try:
+                    sent = await self.message.reply_text(part, parse_mode=ParseMode.MARKDOWN,
+                                                         disable_web_page_preview=True)
+                except BadRequest:
+                    sent = await self.message.reply_text(part, disable_web_page_preview=True)
+                self.messages.append(sent)
+
+        # Черновик оказался длиннее итогового текста - лишние сообщения удаляем
+        for extra in self.messages[len(parts):]:
+            try:
+                await extra.delete()
+            except Exception as e:
+                logger.debug(f"[STREAM] Не удалось удалить лишнее сообщение: {e}")
+        del self.messages[len(parts):]
+
+        if self.first_visible_at is not None:
+            logger.info(f"[STREAM] Первый текст через {self.first_visible_at:.2f}с, правок: {self.edits}")
+
+    async def fail(self, error_text: str):
+        """Показать ошибку вместо заглушки (если в текущем сообщении еще не показан текст)"""
+        # shown относится к последнему сообщению: после перехода на новое сообщение
+        # заглушка - в нем, а в предыдущих уже виден текст ответа
+        if self.messages and not self.shown:
+            await self._edit(self.messages[-1], error_text, force=True)
+        else:
+            await self.message.reply_text(error_text)
+
+    async def _edit(self, target: Message, text: str, force: bool = False, parse_mode: str = None):
+        text = text.strip()
+        if not text or (target is self.messages[-1] and text == self.shown and parse_mode is None):
+            return
+
+        if force:
+            # Итоговую правку нельзя потерять - дожидаемся окна, если Telegram попросил подождать
+            delay = self.next_edit_at - time.monotonic()
+            if delay > 0 and self.edits:
+                await asyncio.sleep(min(delay, self.edit_interval))
+
+        try:
+            await target.edit_text(text, parse_mode=parse_mode, disable_web_page_preview=True)
+        except RetryAfter as e:
+            # В новых версиях python-telegram-bot retry_after - timedelta, в 20.x - секунды
+            if isinstance(e.retry_after, timedelta):
+                retry_after = e.retry_after.total_seconds()
+            else:
+                retry_after = float(e.retry_after)
+            logger.warning(f"[STREAM] Telegram просит подождать {retry_after:.0f}с перед правкой")
+            self.next_edit_at = time.monotonic() + retry_after
+            if not force:
+                return
+            await asyncio.sleep(retry_after)
+            await target.edit_text(text, parse_mode=parse_mode, disable_web_page_preview=True)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                pass
+            elif parse_mode:
+                # Разметка не прошла - оставляем текст без форматирования
+                logger.warning(f"[STREAM] Markdown не принят, отправляем без разметки: {e}")
+                await target.edit_text(text, disable_web_page_preview=True)
+            else:
+                raise
+
+        self.edits += 1
+        self.next_edit_at = time.monotonic() + self.edit_interval
+        if target is self.messages[-1]:
+            self.shown = text
+        if self.first_visible_at is None:
+            self.first_visible_at = time.time() - self.started_at
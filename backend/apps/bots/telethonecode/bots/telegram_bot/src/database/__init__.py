@@ -1,10 +1,13 @@
 """
 Инициализация пакета базы данных
 """
-from .models import User, Chat, Message, RequestLog
-from .manager import DatabaseManager, db_manager, init_database, close_database
+from .models import User, Chat, Message, RequestLog, ChatSummary, ImageJobRecord
+from .manager import DatabaseManager, db_manager, init_database, flush_database, close_database
+from .write_behind import WriteBehindQueue, PendingMessage
+from .entity_cache import EntityCache
 
 __all__ = [
-    'User', 'Chat', 'Message', 'RequestLog',
-    'DatabaseManager', 'db_manager', 'init_database', 'close_database'
+    'User', 'Chat', 'Message', 'RequestLog', 'ChatSummary', 'ImageJobRecord',
+    'DatabaseManager', 'db_manager', 'init_database', 'flush_database', 'close_database',
+    'WriteBehindQueue', 'PendingMessage', 'EntityCache'
 ]
@@ -0,0 +1,103 @@
+"""
+Кэш известных пользователей и чатов
+
+Каждое входящее сообщение "касается" пользователя и чата. Если профиль не
+изменился, а last_activity обновлялась недавно, в БД идти не нужно.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEntity:
+    """Запись кэша: строка из БД (если есть) и отпечаток записанных полей"""
+
+    __slots__ = ('entity', 'fingerprint', 'written_at', 'expires_at')
+
+    def __init__(self, entity: Any, fingerprint: Tuple, written_at: float, expires_at: float):
+        self.entity = entity
+        self.fingerprint = fingerprint
+        self.written_at = written_at
+        self.expires_at = expires_at
+
+
+class EntityCache:
+    """
+    TTL-кэш сущностей (пользователей или чатов) по внешнему id
+
+    is_fresh() отвечает, можно ли пропустить запись в БД: запись есть, не
+    просрочена, отпечаток полей совпадает, а с последней записи прошло меньше
+    activity_interval секунд (так last_activity обновляется не чаще раза в интервал).
+    """
+
+    def __init__(self, name: str, ttl: float = 600, activity_interval: float = 60,
+                 max_entries: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.activity_interval = activity_interval
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, CachedEntity]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _get(self, key: Hashable) -> Optional[CachedEntity]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def fingerprint_of(self, key: Hashable) -> Optional[Tuple]:
+        """Последний записанный в БД отпечаток полей"""
+        entry = self._get(key)
+        return entry.fingerprint if entry else None
+
+    def get(self, key: Hashable) -> Any:
+        """Закэшированная строка из БД (или None)"""
+        entry = self._get(key)
+        return entry.entity if entry else None
+
+    def is_fresh(self, key: Hashable, fingerprint: Tuple, need_entity: bool = False) -> bool:
+        """Можно ли не писать в БД"""
+        entry = self._get(key)
+        fresh = (entry is not None
+                 and entry.fingerprint == fingerprint
+                 and (entry.entity is not None or not need_entity)
+                 and time.monotonic() - entry.written_at < self.activity_interval)
+        self.stats["hits" if fresh else "misses"] += 1
+        return fresh
+
+    def store(self, key: Hashable, fingerprint: Tuple, entity: Any = None):
+        """Запомнить, что поля записаны в БД прямо сейчас"""
+        previous = self.entries.get(key)
+        if entity is None and previous is not None and previous.fingerprint == fingerprint:
+            entity = previous.entity  # Строка из БД по-прежнему актуальна
+
+        now = time.monotonic()
+        self.entries[key] = CachedEntity(entity, fingerprint, now, now + self.ttl)
+        self.entries.move_to_end(key)
+        self.stats["writes"] += 1
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def cleanup(self):
+        """Удалить просроченные записи"""
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            logger.debug(f"[DB_CACHE] {self.name}: удалено просроченных записей: {len(expired)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "size": len(self.entries)}
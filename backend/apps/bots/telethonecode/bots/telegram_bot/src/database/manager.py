@@ -4,18 +4,22 @@
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import selectinload
-from sqlalchemy import select, func, desc, and_, or_
-from .models import Base, User, Chat, Message, RequestLog
+from sqlalchemy import select, update, func, desc, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .models import Base, User, Chat, Message, RequestLog, ChatSummary, ImageJobRecord
+from .write_behind import WriteBehindQueue
+from .entity_cache import EntityCache
 
 logger = logging.getLogger(__name__)
 
 class DatabaseManager:
     """Менеджер для работы с базой данных"""
     
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, write_batch_size: int = 100, write_flush_interval: float = 1.0,
+                 entity_cache_ttl: float = 600, activity_update_interval: float = 60):
         # Преобразуем URL для асинхронного подключения
         if database_url.startswith('postgresql://'):
             database_url = database_url.replace('postgresql://', 'postgresql+asyncpg://', 1)
@@ -33,6 +37,13 @@ class DatabaseManager:
             class_=AsyncSession,
             expire_on_commit=False
         )
+        
+        # Известные пользователи и чаты: неизменный профиль и свежая активность не пишутся в БД
+        self.user_cache = EntityCache('users', ttl=entity_cache_ttl, activity_interval=activity_update_interval)
+        self.chat_cache = EntityCache('chats', ttl=entity_cache_ttl, activity_interval=activity_update_interval)
+        
+        # Очередь отложенной записи для горячего пути обработки сообщений
+        self.writer = WriteBehindQueue(self, batch_size=write_batch_size, flush_interval=write_flush_interval)
     
     async def init_db(self):
         """Инициализация базы данных"""
@@ -51,40 +62,46 @@ class DatabaseManager:
     
     # === УПРАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯМИ ===
     
+    def user_fingerprint(self, telegram_id: int, username: str = None, first_name: str = None,
+                         last_name: str = None, is_admin: bool = False) -> tuple:
+        """Отпечаток профиля пользователя; права администратора только добавляются"""
+        known = self.user_cache.fingerprint_of(telegram_id)
+        return (username, first_name, last_name, bool(is_admin or (known and known[3])))
+    
     async def get_or_create_user(self, telegram_id: int, username: str = None, 
                                 first_name: str = None, last_name: str = None,
                                 is_admin: bool = False) -> User:
-        """Получить или создать пользователя"""
+        """Получить или создать пользователя (один INSERT ... ON CONFLICT DO UPDATE)"""
+        fingerprint = self.user_fingerprint(telegram_id, username, first_name, last_name, is_admin)
+        if self.user_cache.is_fresh(telegram_id, fingerprint, need_entity=True):
+            return self.user_cache.get(telegram_id)
+        
+        stmt = pg_insert(User).values(
+            telegram_id=telegram_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            is_admin=fingerprint[3],
+            last_activity=datetime.utcnow()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={
+                "username": stmt.excluded.username,
+                "first_name": stmt.excluded.first_name,
+                "last_name": stmt.excluded.last_name,
+                "last_activity": stmt.excluded.last_activity,
+                "is_admin": User.is_admin | stmt.excluded.is_admin,
+            }
+        ).returning(User)
+        
         async with self.async_session() as session:
-            # Попытка найти существующего пользователя
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
-            
-            if user:
-                # Обновляем информацию о пользователе
-                user.username = username
-                user.first_name = first_name
-                user.last_name = last_name
-                user.last_activity = datetime.utcnow()
-                if is_admin:
-                    user.is_admin = True
-            else:
-                # Создаем нового пользователя
-                user = User(
-                    telegram_id=telegram_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name,
-                    is_admin=is_admin,
-                    last_activity=datetime.utcnow()
-                )
-                session.add(user)
-            
+            user = (await session.scalars(stmt, execution_options={"populate_existing": True})).one()
             await session.commit()
-            await session.refresh(user)
-            return user
+        
+        # В БД права могли быть выданы раньше - запоминаем итоговое значение
+        self.user_cache.store(telegram_id, fingerprint[:3] + (bool(user.is_admin),), user)
+        return user
     
     async def is_user_admin(self, telegram_id: int) -> bool:
         """Проверить, является ли пользователь администратором"""
@@ -111,29 +128,26 @@ class DatabaseManager:
     # === УПРАВЛЕНИЕ ЧАТАМИ ===
     
     async def get_or_create_chat(self, chat_id: int, chat_type: str, title: str = None) -> Chat:
-        """Получить или создать чат"""
+        """Получить или создать чат (один INSERT ... ON CONFLICT DO UPDATE)"""
+        fingerprint = (chat_type, title)
+        if self.chat_cache.is_fresh(chat_id, fingerprint, need_entity=True):
+            return self.chat_cache.get(chat_id)
+        
+        stmt = pg_insert(Chat).values(chat_id=chat_id, chat_type=chat_type, title=title)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Chat.chat_id],
+            set_={
+                "title": stmt.excluded.title,
+                "updated_at": datetime.utcnow(),
+            }
+        ).returning(Chat)
+        
         async with self.async_session() as session:
-            result = await session.execute(
-                select(Chat).where(Chat.chat_id == chat_id)
-            )
-            chat = result.scalar_one_or_none()
-            
-            if chat:
-                # Обновляем информацию о чате
-                chat.title = title
-                chat.updated_at = datetime.utcnow()
-            else:
-                # Создаем новый чат
-                chat = Chat(
-                    chat_id=chat_id,
-                    chat_type=chat_type,
-                    title=title
-                )
-                session.add(chat)
-            
+            chat = (await session.scalars(stmt, execution_options={"populate_existing": True})).one()
             await session.commit()
-            await session.refresh(chat)
-            return chat
+        
+        self.chat_cache.store(chat_id, fingerprint, chat)
+        return chat
     
     # === УПРАВЛЕНИЕ СООБЩЕНИЯМИ ===
     
@@ -176,12 +190,13 @@ class DatabaseManager:
                 message.processed_at = datetime.utcnow()
                 await session.commit()
     
-    async def get_chat_history(self, chat_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-        """Получить историю сообщений чата"""
+    async def get_chat_history(self, chat_id: int, limit: int = 20,
+                               after_message_id: int = 0) -> List[Dict[str, Any]]:
+        """Получить историю сообщений чата (только с id > after_message_id - новее резюме)"""
         async with self.async_session() as session:
             result = await session.execute(
                 select(Message)
-                .where(Message.chat_id == chat_id)
+                .where(and_(Message.chat_id == chat_id, Message.id > after_message_id))
                 .order_by(desc(Message.created_at))
                 .limit(limit)
             )
@@ -206,6 +221,137 @@ class DatabaseManager:
             
             return history
     
+    async def iter_message_texts(self, chunk_size: int = 5000,
+                                 after_id: int = 0) -> AsyncIterator[List[Tuple[int, str]]]:
+        """
+        Тексты всех сообщений пачками (id, message_text) по возрастанию id
+        
+        Постраничное чтение по ключу (id > последнего прочитанного): каждая пачка -
+        отдельный короткий запрос по первичному ключу, без OFFSET и без долгой транзакции.
+        """
+        last_id = after_id
+        while True:
+            async with self.async_session() as session:
+                result = await session.execute(
+                    select(Message.id, Message.message_text)
+                    .where(and_(Message.id > last_id, Message.message_text.is_not(None)))
+                    .order_by(Message.id)
+                    .limit(chunk_size)
+                )
+                rows = [tuple(row) for row in result.all()]
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                return
+    
+    # === РЕЗЮМЕ РАЗГОВОРОВ ===
+    
+    async def get_chat_summary(self, chat_id: int) -> Optional[ChatSummary]:
+        """Получить резюме старой части разговора"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(ChatSummary).where(ChatSummary.chat_id == chat_id)
+            )
+            return result.scalar_one_or_none()
+    
+    async def get_messages_to_summarize(self, chat_id: int, after_message_id: int = 0,
+                                        keep_recent: int = 10, limit: int = 100) -> List[Message]:
+        """
+        Сообщения, которые пора сжать в резюме
+        
+        Возвращает сообщения с id > after_message_id, кроме keep_recent самых новых
+        (они отправляются модели как есть), от старых к новым
+        """
+        async with self.async_session() as session:
+            recent = (
+                select(Message.id)
+                .where(Message.chat_id == chat_id)
+                .order_by(desc(Message.id))
+                .limit(keep_recent)
+                .scalar_subquery()
+            )
+            result = await session.execute(
+                select(Message)
+                .where(
+                    and_(
+                        Message.chat_id == chat_id,
+                        Message.id > after_message_id,
+                        Message.id.not_in(recent)
+                    )
+                )
+                .order_by(Message.id)
+                .limit(limit)
+            )
+            return list(result.scalars().all())
+    
+    async def save_chat_summary(self, chat_id: int, summary: str, last_message_id: int,
+                                messages_count: int) -> None:
+        """Сохранить резюме (INSERT ... ON CONFLICT DO UPDATE)"""
+        stmt = pg_insert(ChatSummary).values(
+            chat_id=chat_id,
+            summary=summary,
+            last_message_id=last_message_id,
+            messages_count=messages_count
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ChatSummary.chat_id],
+            set_={
+                "summary": stmt.excluded.summary,
+                "last_message_id": stmt.excluded.last_message_id,
+                "messages_count": ChatSummary.messages_count + stmt.excluded.messages_count,
+                "updated_at": datetime.utcnow(),
+            }
+        )
+        async with self.async_session() as session:
+            await session.execute(stmt)
+            await session.commit()
+    
+    # === ЗАДАЧИ ГЕНЕРАЦИИ ИЗОБРАЖЕНИЙ ===
+    
+    async def save_image_job(self, job: Dict[str, Any]) -> None:
+        """Записать состояние задачи (INSERT ... ON CONFLICT DO UPDATE по job_id)"""
+        values = {key: job.get(key) for key in (
+            "job_id", "chat_id", "user_id", "prompt", "status", "provider", "image_url", "error",
+            "created_at", "started_at", "finished_at"
+        )}
+        if job.get("response_time") is not None:
+            values["response_time"] = int(job["response_time"] * 1000)
+        stmt = pg_insert(ImageJobRecord).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ImageJobRecord.job_id],
+            set_={key: stmt.excluded[key] for key in values if key not in ("job_id", "created_at")}
+        )
+        async with self.async_session() as session:
+            await session.execute(stmt)
+            await session.commit()
+    
+    async def get_image_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задачи по ее ID"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(ImageJobRecord).where(ImageJobRecord.job_id == job_id)
+            )
+            record = result.scalar_one_or_none()
+            return record.to_dict() if record else None
+    
+    async def fail_unfinished_image_jobs(self, error: str, created_before: datetime = None) -> int:
+        """Пометить как failed задачи, оставшиеся в queued/running (после перезапуска)
+        
+        created_before - только задачи, созданные раньше (чтобы не задеть живые задачи других реплик)
+        """
+        query = update(ImageJobRecord).where(ImageJobRecord.status.in_(('queued', 'running')))
+        if created_before is not None:
+            query = query.where(ImageJobRecord.created_at < created_before)
+        async with self.async_session() as session:
+            result = await session.execute(
+                query
+                .values(status='failed', error=error, finished_at=datetime.utcnow())
+            )
+            await session.commit()
+            return result.rowcount or 0
+    
     # === ЛОГИРОВАНИЕ ЗАПРОСОВ ===
     
     async def log_request(self, user_id: int, chat_id: int, request_type: str,
@@ -313,14 +459,24 @@ class DatabaseManager:
 # Глобальный экземпляр менеджера БД (будет инициализирован позже)
 db_manager: Optional[DatabaseManager] = None
 
-async def init_database(database_url: str) -> DatabaseManager:
+async def init_database(database_url: str, write_batch_size: int = 100,
+                        write_flush_interval: float = 1.0, entity_cache_ttl: float = 600,
+                        activity_update_interval: float = 60) -> DatabaseManager:
     """Инициализация менеджера базы данных"""
     global db_manager
-    db_manager = DatabaseManager(database_url)
+    db_manager = DatabaseManager(database_url, write_batch_size, write_flush_interval,
+                                 entity_cache_ttl, activity_update_interval)
     await db_manager.init_db()
+    db_manager.writer.start()
     return db_manager
 
+async def flush_database():
+    """Дописать в БД все, что накопилось в очереди отложенной записи"""
+    if db_manager:
+        await db_manager.writer.stop()
+
 async def close_database():
     """Закрытие соединения с базой данных"""
     if db_manager:
+        await db_manager.writer.stop()
         await db_manager.close()
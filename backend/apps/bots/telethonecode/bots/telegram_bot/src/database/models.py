@@ -80,6 +80,64 @@ class Message(Base):
     def __repr__(self):
         return f"<Message(id={self.id}, chat_id={self.chat_id}, user_id={self.user_id})>"
 
+class ChatSummary(Base):
+    """Сжатое резюме старой части разговора"""
+    __tablename__ = 'chat_summaries'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, unique=True, nullable=False, index=True)
+    summary = Column(Text, nullable=False)
+    
+    # Резюме покрывает сообщения чата с id <= last_message_id
+    last_message_id = Column(Integer, nullable=False)
+    messages_count = Column(Integer, default=0, nullable=False)
+    
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    
+    def __repr__(self):
+        return f"<ChatSummary(chat_id={self.chat_id}, last_message_id={self.last_message_id})>"
+
+class ImageJobRecord(Base):
+    """Задача фоновой генерации изображения (services.image_jobs)"""
+    __tablename__ = 'image_jobs'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(32), unique=True, nullable=False, index=True)
+    chat_id = Column(BigInteger, nullable=True, index=True)
+    user_id = Column(BigInteger, nullable=True)
+    prompt = Column(Text, nullable=False)
+    
+    # Состояние: 'queued', 'running', 'done', 'failed'
+    status = Column(String(20), nullable=False, index=True)
+    provider = Column(String(100), nullable=True)
+    image_url = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    response_time = Column(Integer, nullable=True)  # в миллисекундах
+    
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "prompt": self.prompt,
+            "chat_id": self.chat_id,
+            "user_id": self.user_id,
+            "provider": self.provider,
+            "image_url": self.image_url,
+            "error": self.error,
+            "response_time": self.response_time / 1000 if self.response_time is not None else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+    
+    def __repr__(self):
+        return f"<ImageJobRecord(job_id={self.job_id}, status={self.status})>"
+
 class RequestLog(Base):
     """Лог запросов для мониторинга и ограничения частоты"""
     __tablename__ = 'request_logs'
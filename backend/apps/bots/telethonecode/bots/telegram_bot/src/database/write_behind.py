@@ -0,0 +1,285 @@
+"""
+Отложенная пакетная запись в БД (write-behind)
+
+Горячий путь обработки сообщения (пользователь, сообщение, ответ, лог запроса)
+не ходит в БД сам: записи копятся в очереди и сбрасываются одной транзакцией
+из нескольких многострочных INSERT/UPDATE - по размеру пачки или по таймеру.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .models import User, Message, RequestLog
+
+logger = logging.getLogger(__name__)
+
+
+class PendingMessage:
+    """Сообщение в очереди; id появляется после сброса в БД"""
+
+    __slots__ = ('values', 'id', 'flushing', 'late_update')
+
+    def __init__(self, values: Dict[str, Any]):
+        self.values = values
+        self.id: Optional[int] = None
+        self.flushing = False
+        self.late_update: Optional[Dict[str, Any]] = None  # Ответ пришел, пока сообщение сбрасывалось
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи
+
+    - touch_user: профили пользователей схлопываются по telegram_id и пишутся
+      одним INSERT ... ON CONFLICT DO UPDATE
+    - save_message + update_message_response: если ответ пришел до сброса,
+      сообщение уходит в БД одним INSERT уже с ответом
+    - log_request: логи пишутся многострочным INSERT
+    """
+
+    def __init__(self, manager, batch_size: int = 100, flush_interval: float = 1.0,
+                 max_pending: int = 10000):
+        self.manager = manager
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending  # Потолок очереди, если БД долго недоступна
+
+        self.pending_users: Dict[int, Dict[str, Any]] = {}
+        self.pending_messages: List[PendingMessage] = []
+        self.pending_updates: Dict[int, Dict[str, Any]] = {}
+        self.pending_logs: List[Dict[str, Any]] = []
+
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+        self.stats = {"flushes": 0, "rows": 0, "failed_flushes": 0, "dropped": 0}
+
+    # --- Жизненный цикл ---
+
+    def start(self):
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._flush_loop())
+            logger.info(f"[DB_QUEUE] Отложенная запись включена: пачка {self.batch_size}, интервал {self.flush_interval}с")
+
+    async def stop(self):
+        """Остановить фоновый сброс и записать все, что осталось в очереди"""
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    # --- Постановка в очередь ---
+
+    @property
+    def pending_count(self) -> int:
+        return (len(self.pending_users) + len(self.pending_messages) +
+                len(self.pending_updates) + len(self.pending_logs))
+
+    def _enqueued(self):
+        if self.pending_count >= self.batch_size:
+            self._wake.set()
+
+    def touch_user(self, telegram_id: int, username: str = None, first_name: str = None,
+                   last_name: str = None, is_admin: bool = False):
+        """Создать пользователя или обновить профиль и last_activity"""
+        previous = self.pending_users.get(telegram_id)
+        if previous is None:
+            fingerprint = self.manager.user_fingerprint(telegram_id, username, first_name, last_name, is_admin)
+            if self.manager.user_cache.is_fresh(telegram_id, fingerprint):
+                return  # Профиль не менялся, активность обновлялась недавно
+
+        self.pending_users[telegram_id] = {
+            "telegram_id": telegram_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "is_admin": is_admin or bool(previous and previous["is_admin"]),
+            "last_activity": datetime.utcnow(),
+        }
+        self._enqueued()
+
+    def save_message(self, telegram_message_id: int, chat_id: int, user_id: int,
+                     message_text: str = None, message_type: str = 'text',
+                     is_command: bool = False, command_name: str = None,
+                     has_image: bool = False) -> PendingMessage:
+        """Поставить сообщение пользователя в очередь"""
+        pending = PendingMessage({
+            "telegram_message_id": telegram_message_id,
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "message_text": message_text,
+            "message_type": message_type,
+            "is_command": is_command,
+            "command_name": command_name,
+            "has_image": has_image,
+            # Время ставим сразу: в одной транзакции now() у всех строк одинаковый
+            "created_at": datetime.utcnow(),
+            "gpt_response": None,
+            "gpt_model_used": None,
+            "gpt_provider_used": None,
+            "gpt_response_time": None,
+            "processed_at": None,
+        })
+        self.pending_messages.append(pending)
+        self._enqueued()
+        return pending
+
+    def update_message_response(self, message: PendingMessage, gpt_response: str,
+                                model_used: str = None, provider_used: str = None,
+                                response_time: int = None):
+        """Записать ответ GPT к сообщению из очереди"""
+        fields = {
+            "gpt_response": gpt_response,
+            "gpt_model_used": model_used,
+            "gpt_provider_used": provider_used,
+            "gpt_response_time": response_time,
+            "processed_at": datetime.utcnow(),
+        }
+        if message.id is not None:
+            self.pending_updates[message.id] = fields
+        elif message.flushing:
+            message.late_update = fields
+        else:
+            # Сообщение еще в очереди - уйдет в БД одним INSERT вместе с ответом
+            message.values.update(fields)
+        self._enqueued()
+
+    def log_request(self, user_id: int, chat_id: int, request_type: str,
+                    input_length: int = None, output_length: int = None,
+                    response_time: int = None, success: bool = True,
+                    error_message: str = None, provider_used: str = None,
+                    model_used: str = None):
+        """Поставить лог запроса в очередь"""
+        self.pending_logs.append({
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "request_type": request_type,
+            "input_length": input_length,
+            "output_length": output_length,
+            "response_time": response_time,
+            "success": success,
+            "error_message": error_message,
+            "provider_used": provider_used,
+            "model_used": model_used,
+            "created_at": datetime.utcnow(),
+        })
+        self._enqueued()
+
+    # --- Сброс ---
+
+    async def flush(self):
+        """Записать накопленное одной транзакцией"""
+        async with self._flush_lock:
+            if not self.pending_count:
+                return
+
+            users, self.pending_users = self.pending_users, {}
+            messages, self.pending_messages = self.pending_messages, []
+            updates, self.pending_updates = self.pending_updates, {}
+            logs, self.pending_logs = self.pending_logs, []
+            for message in messages:
+                message.flushing = True
+
+            try:
+                async with self.manager.async_session() as session:
+                    async with session.begin():
+                        if users:
+                            stmt = pg_insert(User).values(list(users.values()))
+                            stmt = stmt.on_conflict_do_update(
+                                index_elements=[User.telegram_id],
+                                set_={
+                                    "username": stmt.excluded.username,
+                                    "first_name": stmt.excluded.first_name,
+                                    "last_name": stmt.excluded.last_name,
+                                    "last_activity": stmt.excluded.last_activity,
+                                    "is_admin": User.is_admin | stmt.excluded.is_admin,
+                                }
+                            )
+                            await session.execute(stmt)
+
+                        if messages:
+                            result = await session.execute(
+                                insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                                [message.values for message in messages]
+                            )
+                            for message, message_id in zip(messages, result.scalars().all()):
+                                message.id = message_id
+
+                        if updates:
+                            await session.execute(
+                                update(Message),
+                                [{"id": message_id, **fields} for message_id, fields in updates.items()]
+                            )
+
+                        if logs:
+                            await session.execute(insert(RequestLog), logs)
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                logger.error(f"[DB_QUEUE] Ошибка сброса очереди в БД: {e}")
+                self._requeue(users, messages, updates, logs)
+                return
+
+            for telegram_id, values in users.items():
+                self.manager.user_cache.store(
+                    telegram_id,
+                    (values["username"], values["first_name"], values["last_name"], values["is_admin"])
+                )
+
+            for message in messages:
+                message.flushing = False
+                if message.late_update:
+                    self.pending_updates[message.id] = message.late_update
+                    message.late_update = None
+
+            rows = len(users) + len(messages) + len(updates) + len(logs)
+            self.stats["flushes"] += 1
+            self.stats["rows"] += rows
+            logger.debug(f"[DB_QUEUE] Записано строк: {rows} (пользователи {len(users)}, сообщения {len(messages)}, "
+                         f"ответы {len(updates)}, логи {len(logs)})")
+
+    def _requeue(self, users: dict, messages: list, updates: dict, logs: list):
+        """Вернуть несохраненное в очередь (новые записи важнее старых)"""
+        for message in messages:
+            message.flushing = False
+            message.id = None
+            if message.late_update:
+                message.values.update(message.late_update)
+                message.late_update = None
+
+        for telegram_id, values in users.items():
+            self.pending_users.setdefault(telegram_id, values)
+        self.pending_messages = messages + self.pending_messages
+        self.pending_updates = {**updates, **self.pending_updates}
+        self.pending_logs = logs + self.pending_logs
+
+        # БД недоступна долго - сначала жертвуем логами запросов, потом самыми старыми сообщениями
+        overflow = self.pending_count - self.max_pending
+        if overflow > 0:
+            dropped_logs = min(overflow, len(self.pending_logs))
+            del self.pending_logs[:dropped_logs]
+            dropped_messages = min(overflow - dropped_logs, len(self.pending_messages))
+            del self.pending_messages[:dropped_messages]
+            self.stats["dropped"] += dropped_logs + dropped_messages
+            logger.warning(f"[DB_QUEUE] Очередь переполнена, отброшено записей: {dropped_logs + dropped_messages}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": self.pending_count}
@@ -2,6 +2,37 @@
 Инициализация пакета сервисов
 """
 from .gpt_service import BotGPTService, bot_gpt_service
+from .g4f_registry import G4FRegistry, g4f_registry
+from .http_pool import ProviderConnectionPool, http_pool
+from .llm_gateway import LLMGateway, RoutingPolicy, llm_gateway
+from .deadline import RequestDeadline
+from .single_flight import SingleFlight, single_flight
+from .image_pipeline import ImagePipeline, image_pipeline
+from .vision_cache import VisionCache, vision_cache
+from .image_jobs import ImageJob, ImageJobQueue, chat_delivery, chat_progress
+from .image_generation import ImageGenerationService, image_generation_service
 from .human_behavior import HumanBehaviorService, human_behavior_service
+from .provider_health import ProviderHealthRegistry, provider_health
+from .circuit_breaker import CircuitBreakerRegistry, circuit_breakers
+from .response_cache import ResponseCache, response_cache
+from .context_cache import ContextCache, context_cache
+from .context_budget import ContextBudgeter, context_budgeter
+from .summarizer import ConversationSummarizer, conversation_summarizer
 
-__all__ = ['BotGPTService', 'bot_gpt_service', 'HumanBehaviorService', 'human_behavior_service']
+__all__ = [
+    'BotGPTService', 'bot_gpt_service', 'HumanBehaviorService', 'human_behavior_service',
+    'G4FRegistry', 'g4f_registry',
+    'ProviderConnectionPool', 'http_pool', 'RequestDeadline',
+    'LLMGateway', 'RoutingPolicy', 'llm_gateway',
+    'SingleFlight', 'single_flight',
+    'ImagePipeline', 'image_pipeline',
+    'VisionCache', 'vision_cache',
+    'ImageJob', 'ImageJobQueue', 'chat_delivery', 'chat_progress',
+    'ImageGenerationService', 'image_generation_service',
+    'ProviderHealthRegistry', 'provider_health',
+    'CircuitBreakerRegistry', 'circuit_breakers',
+    'ResponseCache', 'response_cache',
+    'ContextCache', 'context_cache',
+    'ContextBudgeter', 'context_budgeter',
+    'ConversationSummarizer', 'conversation_summarizer'
+]
@@ -0,0 +1,176 @@
+"""
+Circuit breaker для AI провайдеров (общий для всех GPT сервисов процесса)
+"""
+import logging
+import re
+import time
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Состояния цепи
+CLOSED = 'closed'        # Провайдер работает, запросы идут
+OPEN = 'open'            # Провайдер отключен до конца кулдауна
+HALF_OPEN = 'half_open'  # Кулдаун истек, пропускаем один пробный запрос
+
+# Кулдаун (в секундах) по классу ошибки
+ERROR_COOLDOWNS = {
+    'rate_limit': 60,
+    'unavailable': 120,   # "available in ..." - если в тексте есть время, берем его
+    'blocked': 900,
+    'timeout': 30,
+    'error': 30,
+}
+
+# Сколько ошибок подряд открывают цепь
+FAILURE_THRESHOLDS = {
+    'rate_limit': 1,
+    'unavailable': 1,
+    'blocked': 1,
+    'timeout': 2,
+    'error': 3,
+}
+
+MAX_COOLDOWN = 1800  # Потолок для экспоненциального роста кулдауна
+
+RETRY_AFTER_PATTERN = re.compile(r'(?:available in|retry after|try again in)\s*(\d+)', re.IGNORECASE)
+
+
+def classify_error(error_msg: str) -> str:
+    """
+    Класс ошибки провайдера по тексту исключения
+
+    Returns:
+        'unavailable', 'rate_limit', 'blocked' или 'error'
+    """
+    lower = error_msg.lower()
+    if "available in" in lower:
+        return 'unavailable'
+    if "rate" in lower or "limit" in lower or "429" in error_msg:
+        return 'rate_limit'
+    if "block" in lower or "forbidden" in lower:
+        return 'blocked'
+    return 'error'
+
+
+class CircuitBreaker:
+    """Состояние цепи одного провайдера"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = 0.0
+        self.open_until = 0.0
+        self.last_error_class: Optional[str] = None
+        self.probe_in_flight = False
+        self.trips = 0  # Сколько раз цепь размыкалась
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error_class,
+            "retry_in": max(0.0, round(self.open_until - time.monotonic(), 1)) if self.state == OPEN else 0.0,
+            "trips": self.trips,
+        }
+
+
+class CircuitBreakerRegistry:
+    """
+    Реестр circuit breaker'ов по провайдерам
+
+    closed -> open: после FAILURE_THRESHOLDS ошибок подряд, кулдаун по классу ошибки
+    open -> half_open: по истечении кулдауна пропускается один пробный запрос
+    half_open -> closed: пробный запрос успешен
+    half_open -> open: пробный запрос упал, кулдаун удваивается (до MAX_COOLDOWN)
+    """
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            self.breakers[name] = breaker
+        return breaker
+
+    def allow(self, name: str) -> bool:
+        """Можно ли сейчас отправить запрос провайдеру"""
+        breaker = self.get(name)
+        if breaker.state == CLOSED:
+            return True
+
+        if breaker.state == OPEN:
+            if time.monotonic() < breaker.open_until:
+                return False
+            breaker.state = HALF_OPEN
+            breaker.probe_in_flight = False
+            logger.info(f"[CIRCUIT] {name}: кулдаун истек, пробный запрос")
+
+        # HALF_OPEN - пропускаем только один пробный запрос
+        if breaker.probe_in_flight:
+            return False
+        breaker.probe_in_flight = True
+        return True
+
+    def release(self, name: str):
+        """Пробный запрос отменен без результата (например, проиграл hedged-гонку)"""
+        breaker = self.breakers.get(name)
+        if breaker and breaker.state == HALF_OPEN:
+            breaker.probe_in_flight = False
+
+    def record_success(self, name: str):
+        breaker = self.get(name)
+        if breaker.state != CLOSED:
+            logger.info(f"[CIRCUIT] {name}: провайдер снова работает, цепь замкнута")
+        breaker.state = CLOSED
+        breaker.consecutive_failures = 0
+        breaker.cooldown = 0.0
+        breaker.probe_in_flight = False
+
+    def record_failure(self, name: str, error_class: str = 'error', error_msg: str = ""):
+        """
+        Учесть ошибку провайдера
+
+        Args:
+            name: Имя провайдера
+            error_class: Класс ошибки (см. classify_error, плюс 'timeout')
+            error_msg: Текст ошибки - из него берется время "available in N"
+        """
+        breaker = self.get(name)
+        breaker.consecutive_failures += 1
+        breaker.last_error_class = error_class
+
+        if breaker.state == HALF_OPEN:
+            # Пробный запрос не прошел - размыкаем снова с удвоенным кулдауном
+            self._open(breaker, min(max(breaker.cooldown * 2, self._cooldown_for(error_class, error_msg)), MAX_COOLDOWN))
+        elif breaker.consecutive_failures >= FAILURE_THRESHOLDS.get(error_class, 3):
+            self._open(breaker, self._cooldown_for(error_class, error_msg))
+
+    def _cooldown_for(self, error_class: str, error_msg: str) -> float:
+        match = RETRY_AFTER_PATTERN.search(error_msg or "")
+        if match:
+            return min(float(match.group(1)), MAX_COOLDOWN)
+        return ERROR_COOLDOWNS.get(error_class, ERROR_COOLDOWNS['error'])
+
+    def _open(self, breaker: CircuitBreaker, cooldown: float):
+        breaker.state = OPEN
+        breaker.cooldown = cooldown
+        breaker.open_until = time.monotonic() + cooldown
+        breaker.probe_in_flight = False
+        breaker.trips += 1
+        logger.warning(f"[CIRCUIT] {breaker.name}: цепь разомкнута на {cooldown:.0f}с ({breaker.last_error_class})")
+
+    def open_providers(self) -> List[str]:
+        """Провайдеры, которые сейчас отключены"""
+        now = time.monotonic()
+        return [name for name, breaker in self.breakers.items()
+                if breaker.state == OPEN and now < breaker.open_until]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: breaker.to_dict() for name, breaker in self.breakers.items()}
+
+# Глобальный реестр circuit breaker'ов
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,153 @@
+"""
+Бюджет контекста в токенах: история подгоняется под окно конкретной модели
+"""
+import logging
+import math
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько токенов истории отправляем разным моделям (с запасом от реального окна:
+# бесплатные провайдеры часто режут контекст сильнее, а длинный промпт - это задержка)
+MODEL_CONTEXT_BUDGETS = {
+    'gpt-3.5-turbo': 3000,
+    'gpt-4': 6000,
+    'gpt-4o-mini': 12000,
+    'gpt-4o': 12000,
+    'gpt-4.1': 12000,
+    'claude': 12000,
+    'gemini': 12000,
+    'deepseek': 8000,
+    'llama': 4000,
+    'mistral': 4000,
+    'qwen': 6000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+
+REPLY_RESERVE = 1000   # Токены, оставляемые под ответ модели
+MESSAGE_OVERHEAD = 4   # Служебные токены на каждое сообщение (роль, разделители)
+IMAGE_TOKENS = 765     # Изображение detail=high 512x512 в терминах OpenAI
+
+_encoding = None
+_encoding_checked = False
+
+
+def _get_encoding():
+    """Токенизатор tiktoken, если установлен (необязательная зависимость)"""
+    global _encoding, _encoding_checked
+    if not _encoding_checked:
+        _encoding_checked = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+            logger.info("[BUDGET] Токены считаются через tiktoken (cl100k_base)")
+        except Exception:
+            logger.info("[BUDGET] tiktoken не установлен - токены оцениваются по длине текста")
+    return _encoding
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка количества токенов в тексте
+
+    Без tiktoken: латиница ~4 символа на токен, кириллица и прочее ~2 символа
+    (BPE-словари дробят не-ASCII текст сильнее).
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Токены одного сообщения chat_history (текст или мультимедиа-контент)"""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if part.get("type") == "text":
+                total += estimate_tokens(str(part.get("text", "")))
+            else:
+                total += IMAGE_TOKENS
+        return total + MESSAGE_OVERHEAD
+    return estimate_tokens(str(content)) + MESSAGE_OVERHEAD
+
+
+class ContextBudgeter:
+    """
+    Подгонка истории под бюджет модели
+
+    Системные сообщения и текущее сообщение отправляются всегда, из диалога
+    между ними оставляются самые новые реплики, которые помещаются в бюджет.
+    """
+
+    def __init__(self, budgets: Dict[str, int] = None, default_budget: int = DEFAULT_CONTEXT_BUDGET,
+                 reply_reserve: int = REPLY_RESERVE):
+        self.budgets = dict(budgets or MODEL_CONTEXT_BUDGETS)
+        self.default_budget = default_budget
+        self.reply_reserve = reply_reserve
+        self.stats = {"fitted": 0, "trimmed": 0, "dropped_turns": 0}
+
+    def budget_for(self, model: Optional[str]) -> int:
+        """Бюджет модели: точное совпадение или самый длинный подходящий префикс"""
+        name = str(model or '').lower()
+        if name in self.budgets:
+            return self.budgets[name]
+        prefixes = [key for key in self.budgets if name.startswith(key)]
+        if prefixes:
+            return self.budgets[max(prefixes, key=len)]
+        return self.default_budget
+
+    def fit(self, chat_history: List[Dict[str, Any]], model: Optional[str]) -> List[Dict[str, Any]]:
+        """
+        Обрезать историю под бюджет модели
+
+        Args:
+            chat_history: Системные сообщения, диалог и текущее сообщение последним
+            model: Имя модели, под которую собирается запрос
+
+        Returns:
+            Новый список; исходный не меняется
+        """
+        self.stats["fitted"] += 1
+        if len(chat_history) < 2:
+            return chat_history
+
+        system_count = 0
+        while system_count < len(chat_history) - 1 and chat_history[system_count].get("role") == "system":
+            system_count += 1
+        system, dialog, current = chat_history[:system_count], chat_history[system_count:-1], chat_history[-1]
+
+        available = (self.budget_for(model) - self.reply_reserve
+                     - sum(message_tokens(m) for m in system) - message_tokens(current))
+
+        kept = len(dialog)
+        used = 0
+        for i in range(len(dialog) - 1, -1, -1):
+            used += message_tokens(dialog[i])
+            if used > available:
+                kept = len(dialog) - 1 - i
+                break
+
+        # История не должна начинаться с ответа бота без вопроса
+        start = len(dialog) - kept
+        while start < len(dialog) and dialog[start].get("role") == "assistant":
+            start += 1
+
+        if start:
+            self.stats["trimmed"] += 1
+            self.stats["dropped_turns"] += start
+            logger.info(f"[BUDGET] {model}: история не помещается в {self.budget_for(model)} токенов, "
+                        f"отброшено старых реплик: {start}")
+        return system + dialog[start:] + [current]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+# Глобальный бюджетер контекста
+context_budgeter = ContextBudgeter()
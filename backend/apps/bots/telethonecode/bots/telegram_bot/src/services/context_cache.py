@@ -0,0 +1,131 @@
+"""
+Кэш контекста разговора по чатам
+
+Вместо чтения истории из БД на каждое сообщение держим в памяти готовые к
+отправке реплики {"role", "content"} последних ходов каждого чата вместе с
+посчитанными для них токенами. Кэш дополняется после каждого ответа, БД
+читается только при промахе.
+"""
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+
+from ...config import config
+from .context_budget import message_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ChatContext:
+    """Кольцевой буфер реплик одного чата; токены каждой реплики считаются один раз"""
+
+    __slots__ = ('turns', 'token_counts', 'tokens', 'expires_at')
+
+    def __init__(self, max_turns: int, expires_at: float):
+        self.turns: deque = deque(maxlen=max_turns)
+        self.token_counts: deque = deque(maxlen=max_turns)
+        self.tokens = 0
+        self.expires_at = expires_at
+
+    def append(self, turn: Dict[str, str]):
+        if len(self.turns) == self.turns.maxlen:
+            self.tokens -= self.token_counts[0]  # deque сам вытолкнет самую старую реплику
+        count = message_tokens(turn)
+        self.turns.append(turn)
+        self.token_counts.append(count)
+        self.tokens += count
+
+    def trim(self, max_tokens: int):
+        """Выкинуть самые старые реплики, пока контекст больше max_tokens"""
+        while self.turns and self.tokens > max_tokens:
+            self.turns.popleft()
+            self.tokens -= self.token_counts.popleft()
+
+
+class ContextCache:
+    """
+    LRU-кэш контекстов чатов
+
+    - get(): реплики чата или None при промахе (тогда историю нужно загрузить из БД через load())
+    - append(): дописать реплику пользователя или ответ, если контекст чата уже в кэше
+    - invalidate(): забыть контекст (например, после очистки истории)
+    """
+
+    def __init__(self, max_turns: int = 20, max_tokens: int = 12000, ttl: float = 3600,
+                 max_chats: int = 1000):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens  # Больше не отправим ни одной модели (см. MODEL_CONTEXT_BUDGETS)
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.chats: "OrderedDict[int, ChatContext]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+
+    def _get(self, chat_id: int) -> Optional[ChatContext]:
+        context = self.chats.get(chat_id)
+        if context is None:
+            return None
+        if context.expires_at <= time.monotonic():
+            del self.chats[chat_id]
+            return None
+        self.chats.move_to_end(chat_id)
+        return context
+
+    def get(self, chat_id: int) -> Optional[List[Dict[str, str]]]:
+        """Реплики чата от старых к новым или None, если контекста нет в кэше"""
+        context = self._get(chat_id)
+        if context is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return list(context.turns)
+
+    def load(self, chat_id: int, turns: List[Dict[str, str]]):
+        """Положить в кэш историю, загруженную из БД"""
+        context = ChatContext(self.max_turns, time.monotonic() + self.ttl)
+        for turn in turns:
+            context.append({"role": turn["role"], "content": str(turn["content"])})
+        context.trim(self.max_tokens)
+
+        self.chats[chat_id] = context
+        self.chats.move_to_end(chat_id)
+        self.stats["loads"] += 1
+
+        while len(self.chats) > self.max_chats:
+            self.chats.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def append(self, chat_id: int, role: str, content: str):
+        """Дописать реплику; чат не в кэше - ничего не делаем, при промахе история придет из БД"""
+        context = self._get(chat_id)
+        if context is None or not content:
+            return
+        context.append({"role": role, "content": str(content)})
+        context.trim(self.max_tokens)
+        context.expires_at = time.monotonic() + self.ttl
+
+    def append_exchange(self, chat_id: int, message: str, response: str):
+        """Дописать вопрос пользователя и ответ бота"""
+        self.append(chat_id, "user", message)
+        self.append(chat_id, "assistant", response)
+
+    def invalidate(self, chat_id: int):
+        self.chats.pop(chat_id, None)
+
+    def cleanup(self):
+        """Удалить просроченные контексты"""
+        now = time.monotonic()
+        expired = [chat_id for chat_id, context in self.chats.items() if context.expires_at <= now]
+        for chat_id in expired:
+            del self.chats[chat_id]
+        if expired:
+            logger.info(f"[CONTEXT] Удалено просроченных контекстов: {len(expired)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "chats": len(self.chats), "max_turns": self.max_turns}
+
+# Глобальный кэш контекста чатов
+context_cache = ContextCache(
+    max_turns=config.CONTEXT_CACHE_MAX_TURNS,
+    ttl=config.CONTEXT_CACHE_TTL,
+)
@@ -0,0 +1,80 @@
+"""
+Сквозной дедлайн запроса к GPT
+
+Раньше каждая попытка получала фиксированный таймаут (90-120 с), и при десятках
+попыток худший случай измерялся часами. Теперь у запроса целиком есть бюджет
+(текст - 20 с, изображения - 60 с), а таймаут попытки выводится из остатка
+бюджета и p95 задержки конкретного провайдера.
+"""
+import time
+from typing import Any, Dict
+
+from ...config import config
+from .provider_health import provider_health
+
+
+class RequestDeadline:
+    """
+    Бюджет времени на весь запрос: все попытки всех провайдеров вместе
+
+    Таймаут попытки = p95 провайдера * p95_factor (пока замеров мало - доля
+    unknown_share от бюджета), не меньше min_attempt и не больше остатка;
+    если после попытки на следующую не хватит времени - весь остаток.
+    """
+
+    def __init__(self, budget: float, min_attempt: float = 2.0, p95_factor: float = 1.5,
+                 unknown_share: float = 0.5):
+        self.budget = budget
+        self.min_attempt = min_attempt
+        self.p95_factor = p95_factor
+        self.unknown_share = unknown_share
+        self.started = time.monotonic()
+        self.attempts = 0
+
+    @classmethod
+    def for_request(cls, image_data: str = None) -> 'RequestDeadline':
+        """Дедлайн по настройкам: для изображений бюджет больше"""
+        return cls(config.GPT_VISION_DEADLINE if image_data else config.GPT_TEXT_DEADLINE)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.budget - self.elapsed)
+
+    @property
+    def expired(self) -> bool:
+        """Бюджет исчерпан: на осмысленную попытку времени не осталось"""
+        return self.remaining < self.min_attempt
+
+    def attempt_timeout(self, provider_name: str) -> float:
+        """Таймаут очередной попытки к провайдеру"""
+        p95 = provider_health.p95(provider_name)
+        limit = p95 * self.p95_factor if p95 is not None else self.budget * self.unknown_share
+        timeout = max(self.min_attempt, limit)
+        remaining = self.remaining
+        # На следующую попытку времени все равно не останется - отдаем весь остаток
+        if remaining - timeout < self.min_attempt:
+            return remaining
+        return timeout
+
+    def start_attempt(self, provider_name: str) -> float:
+        """Учесть очередную попытку и вернуть ее таймаут"""
+        self.attempts += 1
+        return self.attempt_timeout(provider_name)
+
+    def timeout_result(self, image_data: str = None) -> Dict[str, Any]:
+        """Ответ, когда бюджет исчерпан раньше, чем кто-то из провайдеров ответил"""
+        return {
+            "success": False,
+            "error": f"Превышено время ожидания ответа ({self.budget:.0f}с)",
+            "error_type": "timeout",
+            "timed_out": True,
+            "response": f"⏱ Не удалось получить ответ за {self.budget:.0f} секунд. Попробуйте еще раз чуть позже.",
+            "deadline": self.budget,
+            "elapsed": round(self.elapsed, 2),
+            "total_attempts": self.attempts,
+            "image_request": bool(image_data)
+        }
@@ -0,0 +1,141 @@
+"""
+Ленивый импорт g4f и реестр провайдеров/моделей
+
+Импорт g4f тянет сотни модулей провайдеров и занимает секунды, поэтому он
+откладывается до прогрева (warm_up в фоне после запуска) или первого запроса.
+Асинхронный код сначала ждет ensure_loaded(): импорт идет в потоке, и event loop
+не встает на блокировке, пока прогрев еще импортирует g4f.
+Имена провайдеров и моделей разрешаются один раз и дальше берутся из словарей,
+без hasattr/getattr по g4f.Provider и g4f.models на каждой попытке.
+"""
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class G4FRegistry:
+    """
+    Разрешенные провайдеры и модели g4f
+
+    - provider(name): класс провайдера или None (промахи тоже запоминаются)
+    - model(name): объект g4f.models ('gpt-4o' -> g4f.models.gpt_4o), иначе сама строка
+    - warm_up(): импорт g4f и разрешение всех известных имен заранее
+    """
+
+    def __init__(self):
+        self._g4f = None
+        self._lock = threading.Lock()
+        self._loading: Optional[asyncio.Future] = None  # Импорт в потоке, которого ждут корутины
+        self._providers: Dict[str, Any] = {}
+        self._models: Dict[str, Any] = {}
+
+        self.import_seconds: Optional[float] = None
+        self.warm_up_seconds: Optional[float] = None
+
+    @property
+    def g4f(self):
+        """Модуль g4f (импортируется при первом обращении)"""
+        if self._g4f is None:
+            with self._lock:
+                if self._g4f is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module('g4f')
+                    self.import_seconds = time.perf_counter() - started
+                    self._g4f = module
+                    logger.info(f"[G4F] g4f импортирован за {self.import_seconds:.2f}с")
+        return self._g4f
+
+    async def ensure_loaded(self):
+        """Дождаться импорта g4f, не блокируя event loop (импорт или ожидание прогрева - в потоке)"""
+        if self._g4f is not None:
+            return self._g4f
+        if self._loading is None:
+            loading = asyncio.get_running_loop().run_in_executor(None, lambda: self.g4f)
+            # После импорта (или ошибки - тогда следующий вызов попробует снова) future не нужен
+            loading.add_done_callback(lambda _: setattr(self, '_loading', None))
+            self._loading = loading
+        return await asyncio.shield(self._loading)
+
+    @property
+    def default_model(self):
+        return self.g4f.models.default
+
+    def provider(self, name: str):
+        """Класс провайдера по имени или None"""
+        try:
+            return self._providers[name]
+        except KeyError:
+            pass
+        try:
+            provider = getattr(self.g4f.Provider, name, None)
+        except Exception as e:
+            logger.error(f"Ошибка получения провайдера {name}: {e}")
+            provider = None
+        self._providers[name] = provider
+        return provider
+
+    def model(self, name: Optional[str]):
+        """Модель g4f по имени ('gpt-4o' или 'gpt_4o'); неизвестное имя возвращается как есть"""
+        if not name:
+            return self.default_model
+        try:
+            return self._models[name]
+        except KeyError:
+            pass
+        models = self.g4f.models
+        try:
+            resolved = getattr(models, name.replace('-', '_'), None)
+            if resolved is None:
+                resolved = getattr(models, name, name)
+        except Exception as e:
+            logger.warning(f"[MODEL] Ошибка при поиске модели {name}: {e}")
+            resolved = models.default
+        self._models[name] = resolved
+        return resolved
+
+    async def create_async(self, **kwargs):
+        """g4f.ChatCompletion.create_async"""
+        g4f = await self.ensure_loaded()
+        return await g4f.ChatCompletion.create_async(**kwargs)
+
+    def create_stream(self, **kwargs):
+        """g4f.ChatCompletion.create_async(stream=True) - асинхронный генератор фрагментов (после ensure_loaded)"""
+        return self.g4f.ChatCompletion.create_async(stream=True, **kwargs)
+
+    def warm_up(self, providers: Iterable[str] = (), models: Iterable[str] = ()) -> Dict[str, Any]:
+        """
+        Импорт g4f и разрешение имен заранее (синхронно - запускать в потоке)
+
+        Returns:
+            Статистика: время импорта и прогрева, сколько провайдеров не найдено
+        """
+        started = time.perf_counter()
+        self.g4f
+        missing = [name for name in dict.fromkeys(providers) if self.provider(name) is None]
+        for name in dict.fromkeys(models):
+            self.model(name)
+        self.warm_up_seconds = time.perf_counter() - started
+
+        if missing:
+            logger.warning(f"[G4F] Провайдеры не найдены в g4f: {', '.join(missing)}")
+        logger.info(f"[G4F] Реестр прогрет за {self.warm_up_seconds:.2f}с: "
+                    f"{len(self._providers) - len(missing)} провайдеров, {len(self._models)} моделей")
+        return self.get_stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "imported": self._g4f is not None,
+            "import_seconds": round(self.import_seconds, 3) if self.import_seconds is not None else None,
+            "warm_up_seconds": round(self.warm_up_seconds, 3) if self.warm_up_seconds is not None else None,
+            "providers": sum(1 for provider in self._providers.values() if provider is not None),
+            "missing_providers": [name for name, provider in self._providers.items() if provider is None],
+            "models": len(self._models),
+        }
+
+# Глобальный реестр g4f
+g4f_registry = G4FRegistry()
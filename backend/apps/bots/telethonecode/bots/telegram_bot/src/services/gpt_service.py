@@ -7,11 +7,25 @@ import sys
 import asyncio
 import logging
 import random
-import time
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Union
 
-# Простой импорт g4f
-import g4f
+from ...config import config
+from .g4f_registry import g4f_registry
+from .llm_gateway import (
+    llm_gateway, StreamOutcome, RoutingPolicy, HISTORY_LIMIT,
+    turns_from_db_history, turns_from_conversation, user_message,
+)
+from .deadline import RequestDeadline
+from .single_flight import single_flight
+from .response_cache import response_cache
+from .vision_cache import vision_cache
+from .context_cache import context_cache
+from .context_budget import context_budgeter
+from .summarizer import conversation_summarizer
+from .image_pipeline import image_pipeline
+from ..utils.formatting import format_for_telegram
+from ..utils.images import ImageAttachment
+from ..utils.executor import cpu_executor
 
 logger = logging.getLogger(__name__)
 
@@ -19,108 +33,160 @@ class BotGPTService:
     """Сервис для работы с GPT через библиотеку g4f для телеграм бота"""
     
     def __init__(self):
-        # ПРОВЕРЕННЫЕ РАБОЧИЕ ПРОВАЙДЕРЫ (из оригинального файла)
-        
-        # Быстрые провайдеры (до 3 секунд)
-        self.fast_providers = [
-            'Chatai',             # 0.78с - самый быстрый
-            'AnyProvider',        # 0.98с - очень быстрый
-            'Blackbox',           # 2.14с - стабильный для кода
-            'OpenAIFM',           # 2.34с - быстрый
-            'Qwen_Qwen_2_5_Max',  # 2.46с - быстрый
-            'OIVSCodeSer0501',    # 2.53с - стабильный
-            'WeWordle',           # 2.54с - быстрый
-            'CohereForAI_C4AI_Command', # 2.58с - стабильный
-        ]
-        
-        # Средние провайдеры (3-6 секунд) - БЕЗ Free2GPT!
-        self.medium_providers = [
-            'OIVSCodeSer2',       # 4.76с - стабильный
-            'Qwen_Qwen_2_5',      # 5.25с - хороший (НЕ поддерживает vision!)
-            'Yqcloud',            # 5.64с - работает
-        ]
-        
-        # Медленные провайдеры (больше 6 секунд, но работают)
-        self.slow_providers = [
-            'ImageLabs',          # 8.27с - для изображений
-            'Qwen_Qwen_3',        # 15.45с - умный но медленный
-            'LambdaChat',         # 16.67с - с рассуждениями
-            'BlackForestLabs_Flux1Dev', # 23.02с - для изображений
-        ]
-        
-        # Провайдеры с поддержкой изображений (vision)
-        self.vision_providers = [
-            'PollinationsAI',     # ✅ 8.95с - РАБОТАЕТ с gpt-4o, РЕАЛЬНО ВИДИТ ИЗОБРАЖЕНИЯ!
-        ]
-        
-        # Провайдеры для генерации изображений
-        self.image_providers = [
-            'ImageLabs',          # ✅ Генерирует изображения (SD XL)
-            'BlackForestLabs_Flux1Dev',  # ✅ Генерирует изображения (Flux.1 Dev)
-        ]
-        
-        # Проблематичные провайдеры (исключаем)
-        self.problematic_providers = [
-            'Free2GPT',           # Отправляет ответы на китайском языке
-        ]
-        
-        # Основные рабочие провайдеры
-        self.working_providers = self.fast_providers + self.medium_providers
-        
-        # Резервные провайдеры
-        self.backup_providers = self.slow_providers
-        
-        self.current_provider = 'Chatai'  # Самый быстрый
-        self.default_model = g4f.models.default
+        # Каталог провайдеров и их статистика - общие, в шлюзе (LLMGateway)
+        self.gateway = llm_gateway
+        self.fast_providers = llm_gateway.fast_providers
+        self.medium_providers = llm_gateway.medium_providers
+        self.slow_providers = llm_gateway.slow_providers
+        self.vision_providers = llm_gateway.vision_providers
+        self.image_providers = llm_gateway.image_providers
+        self.problematic_providers = llm_gateway.problematic_providers
+        self.vision_model_map = llm_gateway.vision_model_map
+        self.provider_stats = llm_gateway.provider_stats
         
         # Настройки прокси - отключаем по умолчанию
         self.proxy = None
         self.use_proxy = False
         
-        # Статистика провайдеров
-        self.provider_stats = {}
         self.max_retries = 3
-        
-        # Карта моделей для vision провайдеров
-        self.vision_model_map = {
-            'PollinationsAI': 'gpt-4o',
-        }
+    
+    @property
+    def working_providers(self) -> List[str]:
+        """Основные рабочие провайдеры (быстрые + средние)"""
+        return self.gateway.working_providers
+    
+    @property
+    def backup_providers(self) -> List[str]:
+        """Резервные провайдеры (медленные)"""
+        return self.gateway.backup_providers
+    
+    @property
+    def current_provider(self) -> str:
+        return self.gateway.current_provider
+    
+    @property
+    def default_model(self):
+        return g4f_registry.default_model
+    
+    def warm_up(self) -> Dict[str, Any]:
+        """Импорт g4f и разрешение всех провайдеров и моделей заранее (синхронно - запускать в потоке)"""
+        return self.gateway.warm_up(models=[config.DEFAULT_MODEL])
     
     def get_all_providers(self) -> List[str]:
         """Получить список всех провайдеров"""
-        seen = set()
-        ordered = []
-        for p in self.fast_providers + self.medium_providers + self.slow_providers:
-            if p not in seen:
-                ordered.append(p)
-                seen.add(p)
-        return ordered
-    
-    def trim_history(self, history: list, max_length: int = 50000) -> list:
-        """Обрезка истории разговора"""
-        if not history:
-            return history
-            
-        # Ограничиваем количество сообщений
-        if len(history) > 50:  # Максимум 50 сообщений
-            history = history[-50:]
-        
-        # Проверяем общую длину
-        current_length = sum(len(str(message.get("content", ""))) for message in history)
-        
-        # Удаляем старые сообщения если слишком длинно
-        while history and current_length > max_length:
-            removed_message = history.pop(0)
-            current_length -= len(str(removed_message.get("content", "")))
-        
-        return history
+        return self.gateway.get_all_providers()
     
     async def get_response_async(self, message: str, conversation_history: list = None, 
                                 model: str = None, providers: list = None, 
-                                image_data: str = None, chat_id: int = None) -> Dict[str, Any]:
-        """Асинхронное получение ответа от GPT"""
+                                image_data: Union[str, ImageAttachment] = None,
+                                chat_id: int = None) -> Dict[str, Any]:
+        """
+        Асинхронное получение ответа от GPT (в пределах сквозного дедлайна)
+        
+        image_data - ImageAttachment от image_pipeline (base64 строится шлюзом только
+        перед отправкой провайдеру) или готовая data URL / base64 строка.
+        """
+        deadline = RequestDeadline.for_request(image_data)
+        
+        chat_history = await self._build_chat_history(message, conversation_history, image_data, chat_id, model)
+        
+        # Повторяющиеся запросы отдаем из кэша (запросы с изображениями идут мимо)
+        cached = response_cache.get(chat_history, message, model, chat_id, image_data)
+        if cached:
+            self._remember_exchange(chat_id, message, cached)
+            return cached
+        
+        # Тот же вопрос о том же фото Telegram (по file_unique_id) - без vision запроса
+        cached = vision_cache.get_answer(image_data, message, model, chat_id)
+        if cached:
+            self._remember_exchange(chat_id, message, cached)
+            return cached
+        
+        # Одинаковые одновременные запросы (в группах) ждут один общий вызов провайдеров
+        key = single_flight.make_key(chat_history, message, model, providers, image_data)
+        result = await single_flight.run(
+            key, lambda: self._call_providers(message, chat_history, model, providers, image_data, deadline)
+        )
+        
+        if not result.get("coalesced"):
+            response_cache.put(chat_history, message, result, model, chat_id, image_data)
+            vision_cache.put_answer(image_data, message, result, model, chat_id)
+        self._remember_exchange(chat_id, message, result)
+        return result
+    
+    async def _call_providers(self, message: str, chat_history: list, model: str, providers: list,
+                              image_data: str, deadline: RequestDeadline) -> Dict[str, Any]:
+        """Ответ через шлюз (строго по очереди) + форматирование для Telegram"""
+        logger.info(f"[START] Обработка сообщения: '{message[:50]}...'")
         
-        # Подготавливаем историю разговора
+        result = await self.gateway.complete(chat_history, model, providers, image_data, deadline)
+        if not result["success"]:
+            return result
+        
+        response_text = result["raw_response"]
+        result["response"] = await cpu_executor.run(
+            self.format_telegram_response, response_text, size=len(response_text)
+        )
+        result["message_length"] = len(message)
+        result["history_length"] = len(chat_history)
+        return result
+    
+    def stream_response(self, message: str, conversation_history: list = None,
+                        model: str = None, providers: list = None, chat_id: int = None) -> 'ResponseStream':
+        """
+        Потоковое получение ответа от GPT (только текст, без изображений)
+        
+        Пример:
+            stream = bot_gpt_service.stream_response(question, chat_id=chat.id, model="auto")
+            async for delta in stream:
+                ...  # очередной фрагмент текста
+            stream.result  # итоговый словарь в формате get_response_async
+        """
+        return ResponseStream(self, message, conversation_history, model, providers, chat_id)
+    
+    async def _stream_deltas(self, stream: 'ResponseStream') -> AsyncIterator[str]:
+        """
+        Генератор фрагментов ответа с переключением провайдера до первого фрагмента
+        
+        Дедлайн ограничивает ожидание первого фрагмента и переключения; начатый
+        поток не обрывается - пользователь уже видит ответ.
+        """
+        deadline = RequestDeadline.for_request()
+        chat_history = await self._build_chat_history(stream.message, stream.conversation_history, None,
+                                                      stream.chat_id, stream.model)
+        
+        cached = response_cache.get(chat_history, stream.message, stream.model, stream.chat_id)
+        if cached:
+            stream.result = cached
+            self._remember_exchange(stream.chat_id, stream.message, cached)
+            yield cached["raw_response"]
+            return
+        
+        logger.info(f"[STREAM] Потоковая обработка сообщения: '{stream.message[:50]}...'")
+        
+        outcome = StreamOutcome()
+        async for delta in self.gateway.stream(chat_history, outcome, stream.model, stream.providers, deadline):
+            yield delta
+        
+        stream.result = outcome.result
+        if not stream.result["success"]:
+            return
+        
+        response_text = stream.result["raw_response"]
+        stream.result["response"] = await cpu_executor.run(self.format_telegram_response, response_text,
+                                                           size=len(response_text))
+        stream.result["message_length"] = len(stream.message)
+        stream.result["history_length"] = len(chat_history)
+        response_cache.put(chat_history, stream.message, stream.result, stream.model, stream.chat_id)
+        self._remember_exchange(stream.chat_id, stream.message, stream.result)
+    
+    async def _build_chat_history(self, message: str, conversation_history: list = None,
+                                  image_data: str = None, chat_id: int = None, model: str = None) -> list:
+        """
+        Собрать историю для запроса: системный промпт, история чата, переданная история, текущее сообщение
+        
+        История обрезается под бюджет токенов модели, которой уйдет запрос.
+        """
         chat_history = []
         
         # Системный промпт для телеграм бота
@@ -143,235 +209,58 @@ class BotGPTService:
 
         chat_history.append({"role": "system", "content": system_prompt})
         
-        # Получаем историю из БД если есть chat_id
+        # Резюме старой части разговора (последние реплики идут ниже как есть)
+        summary, summarized_until = await conversation_summarizer.get_summary_info(chat_id)
+        if summary:
+            chat_history.append({"role": "system", "content": f"Краткое содержание предыдущей части разговора:\n{summary}"})
+        
+        # Контекст чата: из кэша, при промахе - из БД
         if chat_id:
-            try:
-                from ..database import db_manager
-                if db_manager:
-                    db_history = await db_manager.get_chat_history(chat_id, limit=10)
-                    logger.info(f"[DB_HISTORY] Загружено {len(db_history)} сообщений для чата {chat_id}")
-                    
-                    # Конвертируем историю из БД
-                    for hist_msg in db_history:
-                        if hist_msg.get("message_type") == "user":
-                            chat_history.append({
-                                "role": "user", 
-                                "content": str(hist_msg.get("message", ""))
-                            })
-                        elif hist_msg.get("message_type") == "assistant":
-                            response_text = hist_msg.get("response") or hist_msg.get("message", "")
-                            chat_history.append({
-                                "role": "assistant", 
-                                "content": str(response_text)
-                            })
-            except Exception as e:
-                logger.warning(f"[DB_HISTORY] Ошибка загрузки истории: {e}")
+            turns = context_cache.get(chat_id)
+            if turns is None:
+                turns = await self._load_context(chat_id, message, summarized_until)
+            chat_history.extend(turns)
         
         # Добавляем переданную историю
-        if conversation_history:
-            for msg in conversation_history:
-                if msg.get("message"):
-                    chat_history.append({"role": "user", "content": str(msg.get("message"))})
-                if msg.get("response"):
-                    chat_history.append({"role": "assistant", "content": str(msg.get("response"))})
+        chat_history.extend(turns_from_conversation(conversation_history))
         
         # Добавляем текущее сообщение
+        chat_history.append(user_message(message, image_data))
         if image_data:
-            # Сообщение с изображением
-            image_url = image_data
-            if not image_data.startswith('data:'):
-                image_url = f"data:image/jpeg;base64,{image_data}"
-            
-            current_message = {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": str(message) if message else "Опиши что ты видишь на изображении"
-                    },
-                    {
-                        "type": "image_url", 
-                        "image_url": {
-                            "url": image_url,
-                            "detail": "high"
-                        }
-                    }
-                ]
-            }
-            chat_history.append(current_message)
             logger.info(f"[VISION] Добавлено сообщение с изображением")
-        else:
-            # Обычное текстовое сообщение
-            chat_history.append({"role": "user", "content": str(message)})
-        
-        # Определяем провайдеры для использования
-        if image_data:
-            # Для изображений используем только vision провайдеры
-            providers_to_try = self.vision_providers
-            model_to_use = 'gpt-4o'
-            logger.info(f"[VISION] Используем vision провайдеры: {providers_to_try}")
-        elif providers:
-            providers_to_try = providers
-            model_to_use = model
-        elif model and model != 'auto':
-            providers_to_try = self.working_providers + self.backup_providers
-            model_to_use = model
-        else:
-            # Авто режим - только быстрые и средние провайдеры
-            providers_to_try = self.working_providers
-            model_to_use = 'gpt-4'
         
-        # Исключаем проблематичные провайдеры
-        providers_to_try = [p for p in providers_to_try if p not in self.problematic_providers]
-        
-        # Создаем список для попыток (с циклическим обходом)
-        current_index = 0
-        if self.current_provider in providers_to_try:
-            current_index = providers_to_try.index(self.current_provider)
-        
-        final_providers_list = []
-        max_cycles = 2  # Максимум 2 полных круга
-        total_providers = len(providers_to_try)
-        
-        for cycle in range(max_cycles):
-            for i in range(total_providers):
-                provider_index = (current_index + i) % total_providers
-                provider = providers_to_try[provider_index]
-                final_providers_list.append(provider)
-        
-        # Ограничиваем попытки
-        final_providers_list = final_providers_list[:15]
-        
-        logger.info(f"[START] Обработка сообщения: '{message[:50]}...'")
-        logger.info(f"[PROVIDERS] Будем пробовать {len(final_providers_list)} провайдеров")
-        
-        rate_limited_providers = set()
-        
-        for attempt, provider_name in enumerate(final_providers_list):
-            try:
-                # Сброс rate limit после полного круга
-                if attempt > 0 and attempt % total_providers == 0:
-                    rate_limited_providers.clear()
-                
-                # Пропускаем провайдеров с rate limit
-                if provider_name in rate_limited_providers:
-                    continue
-                    
-                logger.info(f"[ATTEMPT] Попытка {attempt + 1}: {provider_name}")
-                
-                # Дополнительная проверка для vision
-                if image_data and provider_name not in self.vision_providers:
-                    logger.warning(f"[VISION_SKIP] Пропускаем {provider_name} - не поддерживает vision")
-                    continue
-                
-                # Получаем провайдера
-                provider = self._get_provider_by_name(provider_name)
-                if not provider:
-                    logger.warning(f"[ERROR] Провайдер {provider_name} не найден")
-                    continue
-                
-                # Выбираем модель
-                final_model_to_use = model_to_use
-                if image_data and provider_name in self.vision_model_map:
-                    final_model_to_use = self.vision_model_map[provider_name]
-                
-                # Обработка модели
-                if final_model_to_use:
-                    try:
-                        if hasattr(g4f.models, final_model_to_use.replace('-', '_')):
-                            final_model_to_use = getattr(g4f.models, final_model_to_use.replace('-', '_'))
-                        elif hasattr(g4f.models, final_model_to_use):
-                            final_model_to_use = getattr(g4f.models, final_model_to_use)
-                    except Exception:
-                        final_model_to_use = g4f.models.default
-                else:
-                    final_model_to_use = g4f.models.default
-                
-                # Параметры запроса
-                request_kwargs = {
-                    "model": final_model_to_use,
-                    "messages": chat_history,
-                    "provider": provider,
-                    "timeout": 90,  # Таймаут 90 секунд
-                }
-                
-                # Засекаем время
-                start_time = time.time()
-                
-                # Делаем запрос
-                response = await g4f.ChatCompletion.create_async(**request_kwargs)
-                
-                end_time = time.time()
-                response_time = round(end_time - start_time, 2)
-                
-                # Проверяем ответ
-                if response and len(str(response).strip()) > 0:
-                    response_text = str(response).strip()
-                    
-                    # Форматируем ответ
-                    formatted_response = self.format_telegram_response(response_text)
-                    
-                    logger.info(f"[SUCCESS] Провайдер: {provider_name}, время: {response_time}с")
-                    
-                    # Обновляем статистику
-                    self.provider_stats[provider_name] = self.provider_stats.get(provider_name, 0) + 1
-                    self.current_provider = provider_name
-                    
-                    return {
-                        "success": True,
-                        "response": formatted_response,
-                        "raw_response": response_text,
-                        "model_used": str(final_model_to_use),
-                        "provider_used": provider_name,
-                        "attempt_number": attempt + 1,
-                        "response_time": response_time,
-                        "message_length": len(message),
-                        "history_length": len(chat_history)
-                    }
-                else:
-                    logger.warning(f"[WARNING] {provider_name} вернул пустой ответ")
-                    
-            except asyncio.TimeoutError:
-                logger.warning(f"[TIMEOUT] {provider_name}: превышен таймаут")
-                continue
-            except Exception as e:
-                error_msg = str(e)
-                if "rate" in error_msg.lower() or "limit" in error_msg.lower() or "429" in error_msg:
-                    logger.warning(f"[RATE_LIMIT] {provider_name}: превышен лимит - {error_msg}")
-                    rate_limited_providers.add(provider_name)
-                    continue
-                elif "available in" in error_msg.lower():
-                    logger.warning(f"[RATE_LIMIT] {provider_name}: временно недоступен - {error_msg}")
-                    rate_limited_providers.add(provider_name)
-                    continue
-                else:
-                    logger.warning(f"[ERROR] {provider_name}: {error_msg}")
-                continue
-        
-        # Если все провайдеры не сработали
-        error_type = "vision провайдеры" if image_data else "AI провайдеры"
-        logger.error(f"[FAILED] Все {error_type} недоступны!")
+        # Модель та же, что выберет политика маршрутизации (для бюджета важно только семейство)
+        return context_budgeter.fit(chat_history, RoutingPolicy.model_for(model, image_data))
+    
+    async def _load_context(self, chat_id: int, message: str = None, summarized_until: int = 0) -> list:
+        """Загрузить историю чата из БД в кэш контекста (без сообщений, уже вошедших в резюме)"""
+        try:
+            from ..database import manager as database
+            db_history = []
+            if database.db_manager:
+                db_history = await database.db_manager.get_chat_history(
+                    chat_id, limit=HISTORY_LIMIT, after_message_id=summarized_until
+                )
+                logger.info(f"[DB_HISTORY] Загружено {len(db_history)} сообщений для чата {chat_id}")
+        except Exception as e:
+            # Кэш не заполняем - попробуем загрузить историю в следующий раз
+            logger.warning(f"[DB_HISTORY] Ошибка загрузки истории: {e}")
+            return []
         
-        error_response = f"🚫 Извините, все {error_type} временно недоступны. Попробуйте позже."
+        turns = turns_from_db_history(db_history, message)
         
-        return {
-            "success": False,
-            "error": f"Все {error_type} недоступны",
-            "response": error_response,
-            "total_attempts": len(final_providers_list),
-            "rate_limited_count": len(rate_limited_providers),
-            "image_request": bool(image_data)
-        }
+        context_cache.load(chat_id, turns)
+        return context_cache.get(chat_id) or []
+    
+    def _remember_exchange(self, chat_id: int, message: str, result: Dict[str, Any]):
+        """Дописать вопрос и ответ в кэш контекста чата"""
+        if chat_id and result.get("success"):
+            context_cache.append_exchange(chat_id, message, result.get("response"))
+            conversation_summarizer.note_exchange(chat_id)
     
     def _get_provider_by_name(self, provider_name: str):
-        """Получить провайдера по имени"""
-        try:
-            if hasattr(g4f.Provider, provider_name):
-                return getattr(g4f.Provider, provider_name)
-            return None
-        except Exception as e:
-            logger.error(f"Ошибка получения провайдера {provider_name}: {e}")
-            return None
+        """Получить провайдера по имени (из реестра, разрешается один раз)"""
+        return g4f_registry.provider(provider_name)
     
     def get_response_sync(self, message: str, conversation_history: list = None, 
                          model: str = None, providers: list = None, 
@@ -397,58 +286,40 @@ class BotGPTService:
     
     def format_telegram_response(self, response_text: str) -> str:
         """Форматирование ответа специально для Telegram"""
-        if not response_text:
-            return response_text
-            
-        import re
-        
-        formatted_text = response_text
-        
-        # 1. Убираем избыточные markdown символы которые не поддерживает Telegram
-        formatted_text = re.sub(r'```(\w+)\n(.*?)\n```', r'```\n\2\n```', formatted_text, flags=re.DOTALL)
-        
-        # 2. Конвертируем заголовки в жирный текст
-        formatted_text = re.sub(r'^#{1,6}\s+(.+)', r'*\1*', formatted_text, flags=re.MULTILINE)
-        
-        # 3. Сохраняем списки, но убираем лишние символы
-        lines = formatted_text.split('\n')
-        formatted_lines = []
-        
-        for line in lines:
-            stripped = line.strip()
-            
-            # Обрабатываем списки
-            if re.match(r'^\d+\.\s+', stripped):
-                # Нумерованные списки оставляем как есть
-                formatted_lines.append(line)
-            elif re.match(r'^[-\*\+]\s+', stripped):
-                # Маркированные списки конвертируем в единый формат
-                content = re.sub(r'^[-\*\+]\s+', '', stripped)
-                formatted_lines.append(f"• {content}")
-            else:
-                formatted_lines.append(line)
-        
-        formatted_text = '\n'.join(formatted_lines)
-        
-        # 4. Ограничиваем длину для Telegram (максимум 4096 символов)
-        if len(formatted_text) > 4000:
-            formatted_text = formatted_text[:3950] + "\n\n... _(сообщение обрезано)_"
-        
-        # 5. Убираем лишние пустые строки
-        formatted_text = re.sub(r'\n{3,}', '\n\n', formatted_text)
-        
-        return formatted_text.strip()
+        return format_for_telegram(response_text)
     
     def get_provider_info(self) -> Dict[str, Any]:
         """Получить информацию о провайдерах"""
         return {
-            "current": self.current_provider,
+            **self.gateway.get_stats(),
             "working_providers": len(self.working_providers),
             "backup_providers": len(self.backup_providers),
             "vision_providers": len(self.vision_providers),
-            "provider_stats": self.provider_stats,
+            "response_cache": response_cache.get_stats(),
+            "vision_cache": vision_cache.get_stats(),
+            "context_cache": context_cache.get_stats(),
+            "context_budget": context_budgeter.get_stats(),
+            "summarizer": conversation_summarizer.get_stats(),
+            "single_flight": single_flight.get_stats(),
+            "image_pipeline": image_pipeline.get_stats(),
             "all": self.get_all_providers()
         }
 
+class ResponseStream:
+    """Поток фрагментов ответа; после завершения итерации в result лежит итоговый словарь"""
+    
+    def __init__(self, service: BotGPTService, message: str, conversation_history: list = None,
+                 model: str = None, providers: list = None, chat_id: int = None):
+        self.service = service
+        self.message = message
+        self.conversation_history = conversation_history
+        self.model = model
+        self.providers = providers
+        self.chat_id = chat_id
+        self.result: Optional[Dict[str, Any]] = None
+    
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.service._stream_deltas(self)
+
 # Глобальный экземпляр сервиса
 bot_gpt_service = BotGPTService()
@@ -0,0 +1,151 @@
+"""
+Общий пул HTTP-соединений для запросов к провайдерам g4f
+
+Без пула каждый вызов create_async открывает свою aiohttp-сессию, и каждая
+попытка (в том числе переход к следующему провайдеру) заново платит за DNS и
+TLS-рукопожатие. Провайдерам, которые принимают параметр connector, передается
+долгоживущий TCPConnector - свой на каждого провайдера, с keep-alive и кэшем DNS.
+"""
+import asyncio
+import inspect
+import logging
+from typing import Any, Dict, Optional
+
+from ...config import config
+
+logger = logging.getLogger(__name__)
+
+
+async def _noop():
+    pass
+
+
+class ProviderConnectionPool:
+    """
+    Долгоживущие TCPConnector по провайдерам
+
+    Провайдер g4f открывает ClientSession(connector=...) на каждый запрос и закрывает
+    его после ответа; закрытие сессии закрыло бы и соединения, поэтому у общих
+    коннекторов close() ничего не делает - по-настоящему они закрываются в close() пула.
+    """
+
+    def __init__(self, enabled: bool = True, limit_per_host: int = 10,
+                 keepalive_timeout: float = 75, dns_cache_ttl: int = 300):
+        self.enabled = enabled
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+
+        self._connectors: Dict[str, Any] = {}
+        self._accepts_connector: Dict[str, bool] = {}
+        self._connector_class = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._available: Optional[bool] = None
+
+        self.stats = {"pooled_requests": 0, "unpooled_requests": 0}
+
+    def _get_connector_class(self):
+        """TCPConnector, который не закрывается вместе с сессией провайдера (aiohttp - необязательная зависимость)"""
+        if self._available is None:
+            try:
+                from aiohttp import TCPConnector
+            except ImportError:
+                logger.warning("[HTTP_POOL] aiohttp не установлен - провайдеры открывают соединения сами")
+                self._available = False
+                return None
+
+            class SharedTCPConnector(TCPConnector):
+                def close(self):
+                    return _noop()
+
+                def close_shared(self):
+                    return TCPConnector.close(self)
+
+            self._connector_class = SharedTCPConnector
+            self._available = True
+        return self._connector_class
+
+    def accepts_connector(self, provider_name: str, provider) -> bool:
+        """Принимает ли провайдер параметр connector (проверяется один раз)"""
+        accepts = self._accepts_connector.get(provider_name)
+        if accepts is None:
+            accepts = False
+            for method_name in ('create_async_generator', 'create_async'):
+                method = getattr(provider, method_name, None)
+                if method is None:
+                    continue
+                try:
+                    accepts = 'connector' in inspect.signature(method).parameters
+                except (TypeError, ValueError):
+                    accepts = False
+                break
+            self._accepts_connector[provider_name] = accepts
+        return accepts
+
+    def connector_for(self, provider_name: str):
+        """Общий коннектор провайдера (создается при первом запросе в текущем event loop)"""
+        if not self.enabled:
+            return None
+        connector_class = self._get_connector_class()
+        if connector_class is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif self._loop is not loop:
+            # get_response_sync крутит свой временный цикл - соединения пула к нему не привязать
+            return None
+
+        connector = self._connectors.get(provider_name)
+        if connector is None or connector.closed:
+            connector = connector_class(
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._connectors[provider_name] = connector
+            logger.info(f"[HTTP_POOL] Пул соединений для {provider_name}")
+        return connector
+
+    def request_kwargs(self, provider_name: str, provider) -> Dict[str, Any]:
+        """Дополнительные параметры create_async: {'connector': ...} или пусто"""
+        connector = None
+        if self.accepts_connector(provider_name, provider):
+            connector = self.connector_for(provider_name)
+        if connector is None:
+            self.stats["unpooled_requests"] += 1
+            return {}
+        self.stats["pooled_requests"] += 1
+        return {"connector": connector}
+
+    async def close(self):
+        """Закрыть все соединения пула (при остановке бота)"""
+        connectors, self._connectors = self._connectors, {}
+        for provider_name, connector in connectors.items():
+            try:
+                result = connector.close_shared()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"[HTTP_POOL] Ошибка закрытия соединений {provider_name}: {e}")
+        self._loop = None
+        if connectors:
+            logger.info(f"[HTTP_POOL] Закрыто пулов соединений: {len(connectors)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled and self._available is not False,
+            "providers": sorted(self._connectors),
+            "without_connector_param": sorted(name for name, accepts in self._accepts_connector.items() if not accepts),
+        }
+
+# Глобальный пул соединений к провайдерам
+http_pool = ProviderConnectionPool(
+    enabled=config.HTTP_POOL_ENABLED,
+    limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+    keepalive_timeout=config.HTTP_POOL_KEEPALIVE,
+    dns_cache_ttl=config.HTTP_POOL_DNS_TTL,
+)
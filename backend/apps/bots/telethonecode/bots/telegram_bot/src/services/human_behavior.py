@@ -7,7 +7,7 @@ import random
 from typing import Optional, Union
 from telethon import TelegramClient, errors
 from telethon.tl.types import User
-from config import config
+from ...config import config
 
 logger = logging.getLogger(__name__)
 
@@ -0,0 +1,287 @@
+"""
+Генерация изображений по текстовому описанию (ImageLabs, Flux и др.)
+
+Генерация идет через фоновую очередь (ImageJobQueue): команда /image бота ставит
+задачу и сразу отвечает, результат приходит в чат колбэком. Очередь одна на процесс -
+ее же использует GPTService, поэтому лимиты воркеров и слотов провайдеров общие.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Dict, Optional
+
+from ...config import config
+from .g4f_registry import g4f_registry
+from .llm_gateway import llm_gateway
+from .image_jobs import ImageJobQueue
+
+logger = logging.getLogger(__name__)
+
+
+class ImageGenerationService:
+    """Генерация изображений с перебором провайдеров и фоновой очередью задач"""
+
+    def __init__(self, workers: int = 2, per_provider: int = 1, max_pending: int = 100):
+        self.image_providers = llm_gateway.image_providers
+        self.jobs = ImageJobQueue(self.generate, workers=workers, per_provider=per_provider,
+                                  max_pending=max_pending)
+
+    async def stop(self):
+        """Остановить воркеры очереди"""
+        await self.jobs.stop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.jobs.get_stats()
+
+    async def submit(self, prompt: str, chat_id: int = None, user_id: int = None,
+                     provider_name: str = None, on_complete=None, on_progress=None) -> Dict[str, Any]:
+        """Поставить генерацию изображения в фоновую очередь и сразу вернуть ID задачи
+        
+        Args:
+            prompt: Текстовое описание изображения для генерации
+            on_complete: Корутина (job) после завершения - например, chat_delivery(bot)
+            on_progress: Корутина (job) при смене статуса и каждой попытке с провайдером
+            
+        Returns:
+            Словарь с job_id и позицией в очереди или информацией об ошибке
+        """
+        if provider_name is not None and provider_name not in self.image_providers:
+            return {
+                "success": False,
+                "error": f"Провайдер {provider_name} не является валидным провайдером изображений",
+                "available_providers": self.image_providers
+            }
+        
+        job = await self.jobs.submit(prompt, chat_id, user_id, provider_name, on_complete, on_progress)
+        if job is None:
+            return {
+                "success": False,
+                "error": "Очередь генерации изображений переполнена",
+                "message": "Сейчас генерируется слишком много изображений. Пожалуйста, попробуйте позже."
+            }
+        status = await self.jobs.get(job.job_id)
+        return {"success": True, "job_id": job.job_id, "status": status["status"], "position": status.get("position")}
+    
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи генерации изображения (queued/running/done/failed, image_url, error)"""
+        return await self.jobs.get(job_id)
+    
+    async def generate(self, prompt: str, provider_name: str = None, job=None) -> Dict[str, Any]:
+        """Генерация изображения из текстового описания
+        
+        Выполняется воркером очереди (submit); прямой вызов ждет результата,
+        но тоже соблюдает лимит одновременных генераций на провайдера.
+        
+        Args:
+            prompt: Текстовое описание изображения для генерации
+            provider_name: Опциональный конкретный провайдер (ImageLabs или BlackForestLabs_Flux1Dev)
+            job: Задача очереди (для колбэков прогресса)
+            
+        Returns:
+            Словарь с данными изображения или информацией об ошибке
+        """
+        await g4f_registry.ensure_loaded()
+        
+        # Если провайдер не указан, используем циклический перебор всех доступных
+        try_all_providers = provider_name is None
+        
+        # Создаём список провайдеров для перебора
+        providers_to_try = []
+        
+        if try_all_providers:
+            # Пробуем все доступные провайдеры изображений
+            providers_to_try = self.image_providers.copy()
+            # Дублируем список для второго прохода на случай неудачи
+            providers_to_try = providers_to_try + providers_to_try
+        else:
+            # Если указан конкретный провайдер, проверяем его допустимость
+            if provider_name not in self.image_providers:
+                return {
+                    "success": False,
+                    "error": f"Провайдер {provider_name} не является валидным провайдером изображений",
+                    "available_providers": self.image_providers
+                }
+            providers_to_try = [provider_name]
+        
+        # Переменные для отслеживания ошибок
+        quota_errors = []
+        last_error = None
+        
+        logger.info(f"[IMAGE] Начинаем генерацию изображения: '{prompt[:50]}...'")
+        
+        # Перебираем провайдеры до первого успеха
+        for current_provider in providers_to_try:
+            try:
+                logger.info(f"[IMAGE] Попытка генерации с провайдером: {current_provider}")
+                
+                # Получаем провайдер
+                provider = g4f_registry.provider(current_provider)
+                if not provider:
+                    logger.warning(f"[IMAGE] Провайдер {current_provider} не найден в g4f")
+                    continue
+                
+                # Не больше IMAGE_JOB_PER_PROVIDER одновременных генераций у провайдера
+                await self.jobs.report(job, current_provider)
+                async with self.jobs.provider_slot(current_provider):
+                    # Измеряем время выполнения
+                    start_time = time.time()
+                    
+                    # Ограничение по времени
+                    timeout_seconds = 60  # 60 секунд максимум
+                    
+                    # Создаем сообщения для запроса (некоторые провайдеры требуют этот формат)
+                    messages = [{"role": "user", "content": prompt}]
+                    
+                    # Отправляем запрос на генерацию изображения с таймаутом
+                    if current_provider == "ImageLabs":
+                        # ImageLabs требует model и messages
+                        image_data = await asyncio.wait_for(
+                            g4f_registry.create_async(
+                                model=g4f_registry.default_model,
+                                messages=messages,
+                                provider=provider,
+                                # Дополнительные параметры для генерации изображений
+                                **{"prompt": prompt, "image_model": "sd_xl_base_1.0"}
+                            ),
+                            timeout=timeout_seconds
+                        )
+                    elif current_provider == "BlackForestLabs_Flux1Dev":
+                        # BlackForestLabs Flux.1 Dev
+                        image_data = await asyncio.wait_for(
+                            g4f_registry.create_async(
+                                model=g4f_registry.default_model,
+                                messages=messages,
+                                provider=provider,
+                                **{"prompt": prompt}
+                            ),
+                            timeout=timeout_seconds
+                        )
+                    else:
+                        # Универсальный подход для других провайдеров
+                        image_data = await asyncio.wait_for(
+                            g4f_registry.create_async(
+                                model=g4f_registry.default_model,
+                                messages=messages,
+                                provider=provider
+                            ),
+                            timeout=timeout_seconds
+                        )
+                    
+                    end_time = time.time()
+                response_time = round(end_time - start_time, 2)
+                
+                # Проверяем, что ответ не пустой
+                if not image_data:
+                    logger.warning(f"[IMAGE] Пустой ответ от провайдера {current_provider}")
+                    continue
+                
+                # Проверяем на наличие сообщения о превышении квоты
+                if isinstance(image_data, str) and any(keyword in image_data.lower() for keyword in 
+                                                       ["quota", "квота", "exceeded", "limit", "wait", "ожидание"]):
+                    # Извлекаем время ожидания из сообщения
+                    wait_time_match = re.search(r'(\d+)\s*(s|sec|seconds|секунд)', image_data.lower())
+                    wait_time = wait_time_match.group(1) if wait_time_match else "неизвестно"
+                    
+                    error_msg = f"Квота провайдера {current_provider} исчерпана. Время ожидания: {wait_time} секунд"
+                    logger.warning(f"[IMAGE] {error_msg}")
+                    quota_errors.append(error_msg)
+                    continue
+                
+                # Извлекаем URL изображения из ответа
+                image_url = self._extract_image_url(image_data)
+                
+                logger.info(f"[IMAGE] SUCCESS! Провайдер: {current_provider}, время: {response_time}с")
+                
+                # Возвращаем успешный результат
+                return {
+                    "success": True,
+                    "image_url": image_url,
+                    "image_data": image_data,
+                    "provider": current_provider,
+                    "response_time": response_time,
+                    "prompt": prompt
+                }
+                
+            except asyncio.TimeoutError:
+                logger.warning(f"[IMAGE] Таймаут при генерации изображения с {current_provider}")
+                last_error = f"Превышено время ожидания ответа от {current_provider}"
+                continue
+                
+            except Exception as e:
+                error_msg = str(e)
+                logger.error(f"[IMAGE] Ошибка при генерации изображения с {current_provider}: {error_msg}")
+                
+                # Проверяем на ошибку квоты
+                if any(keyword in error_msg.lower() for keyword in ["quota", "квота", "exceeded", "gpu quota", "limit"]):
+                    wait_time_match = re.search(r'(\d+)\s*(s|sec|seconds|секунд)', error_msg.lower())
+                    wait_time = wait_time_match.group(1) if wait_time_match else "неизвестно"
+                    
+                    quota_error = f"Квота провайдера {current_provider} исчерпана. Время ожидания: {wait_time} секунд"
+                    quota_errors.append(quota_error)
+                    last_error = quota_error
+                else:
+                    last_error = f"Ошибка провайдера {current_provider}: {error_msg}"
+                
+                continue
+        
+        # Если все провайдеры не сработали
+        if quota_errors:
+            return {
+                "success": False,
+                "error": "Все провайдеры изображений исчерпали квоту",
+                "quota_errors": quota_errors,
+                "message": "Квота на генерацию изображений исчерпана. Пожалуйста, попробуйте позже."
+            }
+        else:
+            return {
+                "success": False,
+                "error": last_error or "Не удалось сгенерировать изображение",
+                "providers_tried": providers_to_try,
+                "message": "Не удалось сгенерировать изображение. Пожалуйста, попробуйте другой запрос."
+            }
+    
+    @staticmethod
+    def _extract_image_url(text):
+        """Универсальная функция для извлечения URL изображения из разных форматов текста"""
+        if not text or not isinstance(text, str):
+            return None
+            
+        # Метод 1: Извлечение URL из Markdown-формата [![alt](url)](url)
+        pattern1 = r'!\[.*?\]\((https?://[^)]+)\)'
+        match1 = re.search(pattern1, text)
+        if match1:
+            return match1.group(1)
+        
+        # Метод 2: Извлечение URL из обычного Markdown ![alt](url)
+        pattern2 = r'!\[(.*?)\]\((https?://[^)]+)\)'
+        match2 = re.search(pattern2, text)
+        if match2:
+            return match2.group(2)
+        
+        # Метод 3: Поиск любого URL в тексте
+        pattern3 = r'(https?://[^\s)]+)'
+        match3 = re.search(pattern3, text)
+        if match3:
+            return match3.group(1)
+        
+        # Метод 4: URL с относительным путем
+        pattern4 = r'(//[^\s)]+)'
+        match4 = re.search(pattern4, text)
+        if match4:
+            return f"https:{match4.group(1)}"
+        
+        # Метод 5: URL начинается с www.
+        pattern5 = r'(www\.[^\s)]+)'
+        match5 = re.search(pattern5, text)
+        if match5:
+            return f"https://{match5.group(1)}"
+            
+        return None
+
+# Глобальный сервис генерации изображений (общий для бота и GPTService)
+image_generation_service = ImageGenerationService(
+    workers=config.IMAGE_JOB_WORKERS,
+    per_provider=config.IMAGE_JOB_PER_PROVIDER,
+    max_pending=config.IMAGE_JOB_MAX_PENDING,
+)
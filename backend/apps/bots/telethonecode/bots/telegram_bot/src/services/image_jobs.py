@@ -0,0 +1,374 @@
+"""
+Фоновая очередь генерации изображений
+
+Генерация (Flux и др.) занимает 20+ секунд. Раньше она шла прямо в корутине запроса
+и держала обработчик все это время, а число одновременных генераций ничем не
+ограничивалось. Теперь запрос ставит задачу в очередь и сразу получает ее ID;
+генерацию выполняют фоновые воркеры (не больше workers одновременно и не больше
+per_provider на одного провайдера). Результат доставляется колбэком (например,
+в чат), статус можно запросить по ID, записи задач сохраняются в БД (image_jobs).
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Статусы задачи
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+ProgressCallback = Callable[['ImageJob'], Awaitable[None]]
+
+
+class ImageJob:
+    """Задача генерации изображения"""
+
+    __slots__ = ('job_id', 'prompt', 'chat_id', 'user_id', 'provider_name', 'status', 'provider',
+                 'result', 'error', 'created_at', 'started_at', 'finished_at',
+                 'on_complete', 'on_progress', 'done', 'sequence')
+
+    def __init__(self, prompt: str, chat_id: int = None, user_id: int = None, provider_name: str = None,
+                 on_complete: ProgressCallback = None, on_progress: ProgressCallback = None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.prompt = prompt
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.provider_name = provider_name  # Провайдер, выбранный пользователем (None - любой)
+        self.status = QUEUED
+        self.provider: Optional[str] = None  # Провайдер текущей попытки / давший результат
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.on_complete = on_complete
+        self.on_progress = on_progress
+        self.done = asyncio.Event()
+        self.sequence = 0  # Порядковый номер постановки в очередь (для позиции)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Статус задачи (для опроса и записи в БД)"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "prompt": self.prompt,
+            "chat_id": self.chat_id,
+            "user_id": self.user_id,
+            "provider": self.provider,
+            "image_url": (self.result or {}).get("image_url"),
+            "error": self.error,
+            "response_time": (self.result or {}).get("response_time"),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ImageJobQueue:
+    """
+    Очередь задач генерации изображений
+
+    generator - корутина (prompt, provider_name, job) -> результат в формате
+    ImageGenerationService.generate; перебирает провайдеров сама, занимая слот каждого
+    через provider_slot(). Завершенные задачи хранятся в памяти (последние
+    keep_finished) и в БД, если она подключена.
+
+    Учет без обхода всех задач: позиция в очереди - разность порядковых номеров
+    (воркеры берут задачи строго по порядку), завершенные - в отдельной очереди
+    для вытеснения самых старых.
+    """
+
+    def __init__(self, generator: Callable[..., Awaitable[Dict[str, Any]]], workers: int = 2,
+                 per_provider: int = 1, max_pending: int = 100, keep_finished: int = 500):
+        self.generator = generator
+        self.workers = workers
+        self.per_provider = per_provider
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+
+        self.jobs: Dict[str, ImageJob] = {}  # job_id -> ImageJob (ожидающие, выполняемые, последние завершенные)
+        self._finished: deque = deque()  # job_id завершенных, от старых к новым
+        self._submitted_count = 0  # Поставлено в очередь за все время
+        self._taken_count = 0  # Взято воркерами
+        self._running = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._provider_slots: Dict[str, asyncio.Semaphore] = {}
+        self._provider_busy: Dict[str, int] = {}
+        self._recovered = False
+        self._started_at = datetime.utcnow()  # Задачи старше - прерваны прошлым запуском
+
+        self.stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0,
+                      "wait_seconds": 0.0, "run_seconds": 0.0}
+
+    # --- Жизненный цикл ---
+
+    def start(self):
+        """Запустить воркеры (вызывается при первой задаче, нужен работающий event loop)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        logger.info(f"[IMAGE_JOBS] Очередь запущена: {self.workers} воркеров, "
+                    f"{self.per_provider} на провайдера, до {self.max_pending} в ожидании")
+
+    async def stop(self):
+        """Остановить воркеры (незавершенные задачи остаются в БД со своим статусом)"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._queue = None
+
+    # --- Задачи ---
+
+    async def submit(self, prompt: str, chat_id: int = None, user_id: int = None, provider_name: str = None,
+                     on_complete: ProgressCallback = None,
+                     on_progress: ProgressCallback = None) -> Optional[ImageJob]:
+        """
+        Поставить генерацию в очередь, не дожидаясь ее
+
+        Args:
+            on_complete: Вызывается с задачей после завершения (успех или ошибка)
+            on_progress: Вызывается при смене статуса и каждой новой попытке с провайдером
+
+        Returns:
+            Задача (job_id - для опроса статуса) или None, если очередь переполнена
+        """
+        self.start()
+        await self._recover()
+
+        if self._queue.full():
+            return self._reject()
+
+        # Запись queued - до постановки в очередь, чтобы не перезаписать running воркера
+        job = ImageJob(prompt, chat_id, user_id, provider_name, on_complete, on_progress)
+        await self._save(job)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            job.status = FAILED
+            job.error = "Очередь переполнена"
+            await self._save(job)
+            return self._reject()
+
+        self.stats["submitted"] += 1
+        self._submitted_count += 1
+        job.sequence = self._submitted_count
+        self.jobs[job.job_id] = job
+        logger.info(f"[IMAGE_JOBS] Задача {job.job_id} в очереди (позиция {self._queue.qsize()}): '{prompt[:50]}'")
+        return job
+
+    def _reject(self) -> None:
+        self.stats["rejected"] += 1
+        logger.warning(f"[IMAGE_JOBS] Очередь переполнена ({self.max_pending}), задача отклонена")
+        return None
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи: из памяти или, для старых задач, из БД"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            status = job.to_dict()
+            if job.status == QUEUED:
+                status["position"] = self._position(job)
+            return status
+
+        db_manager = self._db()
+        if db_manager is None:
+            return None
+        try:
+            record = await db_manager.get_image_job(job_id)
+        except Exception as e:
+            logger.warning(f"[IMAGE_JOBS] Не удалось прочитать задачу {job_id} из БД: {e}")
+            return None
+        return record
+
+    async def wait(self, job_id: str, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """Дождаться завершения задачи из этого процесса (для синхронных вызовов)"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        await asyncio.wait_for(job.done.wait(), timeout)
+        return job.result
+
+    @asynccontextmanager
+    async def provider_slot(self, provider_name: str) -> AsyncIterator[None]:
+        """Слот провайдера: `async with queue.provider_slot(name)` вокруг запроса к нему"""
+        slot = self._provider_slots.get(provider_name)
+        if slot is None:
+            slot = self._provider_slots[provider_name] = asyncio.Semaphore(self.per_provider)
+        async with slot:
+            self._provider_busy[provider_name] = self._provider_busy.get(provider_name, 0) + 1
+            try:
+                yield
+            finally:
+                self._provider_busy[provider_name] -= 1
+
+    async def report(self, job: Optional[ImageJob], provider: str):
+        """Новая попытка генерации (вызывается генератором перед запросом к провайдеру)"""
+        if job is None:
+            return
+        job.provider = provider
+        await self._notify(job.on_progress, job)
+
+    # --- Воркеры ---
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            self._taken_count += 1
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"[IMAGE_JOBS] Воркер {index}: ошибка задачи {job.job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: ImageJob):
+        job.status = RUNNING
+        self._running += 1
+        job.started_at = datetime.utcnow()
+        self.stats["wait_seconds"] += (job.started_at - job.created_at).total_seconds()
+        await self._save(job)
+        await self._notify(job.on_progress, job)
+
+        started = time.perf_counter()
+        try:
+            result = await self.generator(job.prompt, job.provider_name, job=job)
+        except Exception as e:
+            result = {"success": False, "error": str(e),
+                      "message": "Не удалось сгенерировать изображение. Пожалуйста, попробуйте другой запрос."}
+        self.stats["run_seconds"] += time.perf_counter() - started
+        self._running -= 1
+
+        job.result = result
+        job.finished_at = datetime.utcnow()
+        if result.get("success"):
+            job.status = DONE
+            job.provider = result.get("provider")
+            self.stats["completed"] += 1
+            logger.info(f"[IMAGE_JOBS] Задача {job.job_id} готова ({job.provider}, {result.get('response_time')}с)")
+        else:
+            job.status = FAILED
+            job.error = result.get("error")
+            self.stats["failed"] += 1
+            logger.warning(f"[IMAGE_JOBS] Задача {job.job_id} не выполнена: {job.error}")
+
+        job.done.set()
+        self._forget_finished(job)
+        await self._save(job)
+        await self._notify(job.on_complete, job)
+
+    async def _notify(self, callback: Optional[ProgressCallback], job: ImageJob):
+        """Колбэк не должен ронять воркер"""
+        if callback is None:
+            return
+        try:
+            await callback(job)
+        except Exception as e:
+            logger.warning(f"[IMAGE_JOBS] Ошибка колбэка задачи {job.job_id}: {e}")
+
+    def _position(self, job: ImageJob) -> int:
+        """Место в очереди (1 - следующая)"""
+        return max(0, job.sequence - self._taken_count)
+
+    def _forget_finished(self, job: ImageJob):
+        """Запомнить завершенную задачу, забывая самые старые сверх keep_finished"""
+        self._finished.append(job.job_id)
+        while len(self._finished) > self.keep_finished:
+            self.jobs.pop(self._finished.popleft(), None)
+
+    # --- Записи в БД ---
+
+    @staticmethod
+    def _db():
+        from ..database import manager as database
+        return database.db_manager
+
+    async def _save(self, job: ImageJob):
+        """Записать состояние задачи (без БД - только память)"""
+        db_manager = self._db()
+        if db_manager is None:
+            return
+        try:
+            await db_manager.save_image_job(job.to_dict())
+        except Exception as e:
+            logger.warning(f"[IMAGE_JOBS] Не удалось сохранить задачу {job.job_id}: {e}")
+
+    async def _recover(self):
+        """
+        Задачи, прерванные перезапуском (queued/running в БД), помечаются как failed
+
+        Колбэки доставки не переживают перезапуск, поэтому такие задачи не
+        перезапускаются: пользователь не получил бы результат. Трогаются только
+        задачи, созданные до старта этого процесса: у других реплик бота с той же
+        БД свежие queued/running задачи живые.
+        """
+        if self._recovered:
+            return
+        db_manager = self._db()
+        if db_manager is None:
+            return
+        self._recovered = True
+        try:
+            interrupted = await db_manager.fail_unfinished_image_jobs("Прервано перезапуском бота",
+                                                                    created_before=self._started_at)
+        except Exception as e:
+            logger.warning(f"[IMAGE_JOBS] Не удалось проверить незавершенные задачи: {e}")
+            return
+        if interrupted:
+            logger.info(f"[IMAGE_JOBS] Задач, прерванных перезапуском: {interrupted}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **{key: round(value, 2) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "pending": self._queue.qsize() if self._queue else 0,
+            "running": self._running,
+            "workers": self.workers,
+            "per_provider": self.per_provider,
+            "busy_providers": {name: busy for name, busy in self._provider_busy.items() if busy},
+        }
+
+
+def chat_delivery(bot) -> ProgressCallback:
+    """
+    on_complete для доставки результата в чат задачи через Telegram бота
+
+    Успех - фото по URL (если URL не извлечен - текстом), ошибка - сообщение для пользователя.
+    """
+    async def deliver(job: ImageJob):
+        if job.chat_id is None:
+            return
+        result = job.result or {}
+        if job.status == DONE and result.get("image_url"):
+            await bot.send_photo(chat_id=job.chat_id, photo=result["image_url"], caption=job.prompt[:1024])
+        elif job.status == DONE:
+            await bot.send_message(chat_id=job.chat_id, text=str(result.get("image_data"))[:4096])
+        else:
+            await bot.send_message(chat_id=job.chat_id,
+                                   text=result.get("message") or "Не удалось сгенерировать изображение.")
+    return deliver
+
+
+def chat_progress(bot) -> ProgressCallback:
+    """on_progress: индикатор "отправляет фото" в чате задачи, пока идет генерация"""
+    async def progress(job: ImageJob):
+        if job.chat_id is not None and job.status == RUNNING:
+            await bot.send_chat_action(chat_id=job.chat_id, action='upload_photo')
+    return progress
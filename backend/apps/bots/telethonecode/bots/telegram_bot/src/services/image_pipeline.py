@@ -0,0 +1,143 @@
+"""
+Подготовка фото из Telegram для vision запросов
+
+Раньше бралось самое большое фото (message.photo[-1], до 2560 px и нескольких МБ)
+и целиком уходило провайдеру в base64. Теперь выбирается наименьший размер, которого
+хватает для распознавания, при необходимости уменьшается и пережимается в пуле
+потоков и кэшируется по file_unique_id. Байты не копируются (memoryview на буфер
+загрузки), base64 строится один раз и только перед отправкой провайдеру.
+Подготовленные фото также сохраняются на диск (vision_cache) и переживают перезапуск.
+"""
+import io
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Sequence
+
+from ...config import config
+from ..utils.executor import cpu_executor
+from ..utils.images import ImageAttachment, select_photo_size, downscale_image
+from .vision_cache import vision_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePipeline:
+    """
+    Фото Telegram -> ImageAttachment для vision
+
+    Из размеров фото (PhotoSize) берется наименьший, у которого большая сторона
+    не меньше max_side; если он все же крупнее max_side - уменьшается до max_side
+    и пережимается в JPEG с качеством quality. Кэш - LRU по file_unique_id,
+    ограничен числом записей и суммарным размером.
+    """
+
+    def __init__(self, max_side: int = 1024, quality: int = 85, cache_entries: int = 128,
+                 cache_bytes: int = 64 * 1024 * 1024):
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_entries = cache_entries
+        self.cache_bytes = cache_bytes
+
+        self._cache: OrderedDict = OrderedDict()  # file_unique_id -> ImageAttachment
+        self._cached_bytes = 0
+
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "disk_hits": 0,
+            "downloaded_bytes": 0,
+            "largest_size_bytes": 0,  # Сколько весили бы самые большие размеры фото
+            "payload_bytes": 0,  # Байты изображений, ушедших в запросы (до base64)
+            "downscaled": 0,
+            "process_seconds": 0.0,
+        }
+
+    async def prepare(self, bot, photo_sizes: Sequence[Any]) -> ImageAttachment:
+        """
+        Изображение из сообщения (message.photo) для get_response_async(image_data=...)
+
+        Args:
+            bot: context.bot (для get_file)
+            photo_sizes: Размеры фото, по возрастанию
+        """
+        self.stats["requests"] += 1
+        photo = select_photo_size(photo_sizes, self.max_side)
+
+        cached = self._cache.get(photo.file_unique_id)
+        if cached is not None:
+            self._cache.move_to_end(photo.file_unique_id)
+            self.stats["cache_hits"] += 1
+            logger.info(f"[IMAGE] Фото {photo.file_unique_id} из кэша")
+            return cached
+
+        # Фото уже скачивали (возможно, до перезапуска) - берем с диска
+        stored = await vision_cache.read_image(photo.file_unique_id)
+        if stored is not None:
+            self.stats["disk_hits"] += 1
+            logger.info(f"[IMAGE] Фото {photo.file_unique_id} с диска")
+            self._remember(photo.file_unique_id, stored)
+            return stored
+
+        file = await bot.get_file(photo.file_id)
+        buffer = io.BytesIO()
+        await file.download_to_memory(buffer)
+        raw_image = buffer.getbuffer()  # Без копии, в отличие от getvalue()
+        image_bytes = raw_image
+
+        # Размер из Telegram уже подходит - Pillow не нужен
+        if max(photo.width, photo.height) > self.max_side:
+            # Уменьшение - в пуле: мегабайтный снимок не должен блокировать другие чаты
+            # (в пул процессов memoryview не передать - только копией)
+            source = bytes(raw_image) if cpu_executor.kind == 'process' else raw_image
+            started = time.perf_counter()
+            image_bytes, new_size = await cpu_executor.run(downscale_image, source, self.max_side, self.quality,
+                                                           size=len(raw_image))
+            self.stats["process_seconds"] += time.perf_counter() - started
+            if new_size:
+                self.stats["downscaled"] += 1
+
+        attachment = ImageAttachment(image_bytes)
+        attachment.file_unique_id = photo.file_unique_id
+        largest = photo_sizes[-1]
+        self.stats["downloaded_bytes"] += len(raw_image)
+        self.stats["largest_size_bytes"] += largest.file_size or len(raw_image)
+        self.stats["payload_bytes"] += len(attachment)
+        logger.info(f"[IMAGE] Фото {photo.width}x{photo.height} ({len(raw_image) // 1024} КБ, "
+                    f"самый большой размер {largest.width}x{largest.height}) -> {len(attachment) // 1024} КБ")
+
+        # На диск - сейчас, пока байты не заменены data URL
+        await vision_cache.write_image(photo.file_unique_id, attachment)
+        self._remember(photo.file_unique_id, attachment)
+        return attachment
+
+    def _remember(self, file_unique_id: str, attachment: ImageAttachment):
+        """Положить в кэш, вытесняя самые старые записи сверх лимитов"""
+        # Учитываем размер с base64: после первого запроса в записи остается data URL
+        if attachment.encoded_size > self.cache_bytes:
+            return
+        # То же фото могли положить параллельно (два вопроса о нем, диск и загрузка) -
+        # прежняя запись заменяется, ее размер не должен остаться в счетчике
+        previous = self._cache.pop(file_unique_id, None)
+        if previous is not None:
+            self._cached_bytes -= previous.encoded_size
+        self._cache[file_unique_id] = attachment
+        self._cached_bytes += attachment.encoded_size
+        while self._cache and (len(self._cache) > self.cache_entries or self._cached_bytes > self.cache_bytes):
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.encoded_size
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **{key: round(value, 4) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "cached": len(self._cache),
+            "cached_bytes": self._cached_bytes,
+            "max_side": self.max_side,
+        }
+
+# Глобальный конвейер подготовки изображений
+image_pipeline = ImagePipeline(
+    max_side=config.IMAGE_MAX_SIDE,
+    quality=config.IMAGE_JPEG_QUALITY,
+    cache_entries=config.IMAGE_CACHE_ENTRIES,
+)
@@ -0,0 +1,707 @@
+"""
+Единый шлюз к LLM-провайдерам g4f
+
+Общий движок для BotGPTService (телеграм бот) и GPTService (старый сервис):
+каталог провайдеров, выбор модели, обход провайдеров в пределах дедлайна
+(последовательно или с hedged-запросами), учет здоровья провайдеров, circuit
+breaker, общий пул соединений и единая статистика. Сервисы остаются тонкими
+адаптерами: свой системный промпт, свой источник истории и свое форматирование.
+"""
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from ...config import config
+from .g4f_registry import g4f_registry
+from .http_pool import http_pool
+from .deadline import RequestDeadline
+from .provider_health import provider_health
+from .circuit_breaker import circuit_breakers, classify_error
+from ..utils.images import ImageAttachment
+from ..utils.executor import cpu_executor
+
+logger = logging.getLogger(__name__)
+
+# ПРОВЕРЕННЫЕ РАБОЧИЕ ПРОВАЙДЕРЫ (протестировано 2025-07-05, 16 из 90)
+
+# Быстрые провайдеры (до 3 секунд)
+FAST_PROVIDERS = [
+    'Chatai',             # 0.78с - самый быстрый
+    'AnyProvider',        # 0.98с - очень быстрый
+    'Blackbox',           # 2.14с - стабильный для кода
+    'OpenAIFM',           # 2.34с - быстрый
+    'Qwen_Qwen_2_5_Max',  # 2.46с - быстрый
+    'OIVSCodeSer0501',    # 2.53с - стабильный
+    'WeWordle',           # 2.54с - быстрый
+    'CohereForAI_C4AI_Command', # 2.58с - стабильный
+]
+
+# Средние провайдеры (3-6 секунд) - БЕЗ Free2GPT!
+MEDIUM_PROVIDERS = [
+    'OIVSCodeSer2',       # 4.76с - стабильный
+    'Qwen_Qwen_2_5',      # 5.25с - хороший (НЕ поддерживает vision!)
+    'Yqcloud',            # 5.64с - работает
+]
+
+# Медленные провайдеры (больше 6 секунд, но работают)
+SLOW_PROVIDERS = [
+    'ImageLabs',          # 8.27с - для изображений
+    'Qwen_Qwen_3',        # 15.45с - умный но медленный
+    'LambdaChat',         # 16.67с - с рассуждениями
+    'BlackForestLabs_Flux1Dev', # 23.02с - для изображений
+]
+
+# Провайдеры с поддержкой изображений (vision)
+VISION_PROVIDERS = [
+    'PollinationsAI',     # ✅ 8.95с - РАБОТАЕТ с gpt-4o, РЕАЛЬНО ВИДИТ ИЗОБРАЖЕНИЯ!
+]
+
+# Провайдеры для генерации изображений
+IMAGE_PROVIDERS = [
+    'ImageLabs',          # ✅ Генерирует изображения (SD XL)
+    'BlackForestLabs_Flux1Dev',  # ✅ Генерирует изображения (Flux.1 Dev)
+]
+
+# Проблематичные провайдеры (исключаются всегда)
+PROBLEMATIC_PROVIDERS = [
+    'Free2GPT',           # Отправляет ответы на китайском языке
+]
+
+AUTO_MODEL = 'gpt-4'      # Модель для авто режима
+VISION_MODEL = 'gpt-4o'   # Лучшая модель для vision от OpenAI
+
+# Модели vision для конкретных провайдеров
+VISION_MODEL_MAP = {
+    'PollinationsAI': 'gpt-4o',
+}
+
+# Сколько последних сообщений чата читается из БД при промахе кэша контекста
+HISTORY_LIMIT = 20
+
+
+# === СБОРКА ИСТОРИИ ===
+
+def turns_from_db_history(db_history: List[Dict[str, Any]], message: str = None) -> List[Dict[str, str]]:
+    """
+    История из БД (get_chat_history) -> реплики для модели
+
+    Текущее сообщение могло уже попасть в БД - оно добавляется отдельно, поэтому убирается.
+    """
+    turns = []
+    for hist_msg in db_history:
+        if hist_msg.get("message_type") == "user":
+            turns.append({"role": "user", "content": str(hist_msg.get("message", ""))})
+        elif hist_msg.get("message_type") == "assistant":
+            response_text = hist_msg.get("response") or hist_msg.get("message", "")
+            turns.append({"role": "assistant", "content": str(response_text)})
+
+    if turns and turns[-1]["role"] == "user" and turns[-1]["content"] == str(message):
+        turns.pop()
+    return turns
+
+
+def turns_from_conversation(conversation_history: list) -> List[Dict[str, str]]:
+    """Переданная вызывающим кодом история [{"message": ..., "response": ...}] -> реплики"""
+    turns = []
+    for msg in conversation_history or []:
+        if msg.get("message"):
+            turns.append({"role": "user", "content": str(msg.get("message"))})
+        if msg.get("response"):
+            turns.append({"role": "assistant", "content": str(msg.get("response"))})
+    return turns
+
+
+def user_message(message: str, image_data: Union[str, ImageAttachment] = None,
+                 image_prompt: str = "Опиши что ты видишь на изображении") -> Dict[str, Any]:
+    """
+    Текущее сообщение пользователя (с изображением - мультимодальный формат)
+
+    image_data - ImageAttachment (остается в сообщении как есть, base64 строит шлюз
+    перед отправкой - см. materialize_images), data URL или base64 строка.
+    """
+    if not image_data:
+        return {"role": "user", "content": str(message)}
+
+    if isinstance(image_data, ImageAttachment) or image_data.startswith('data:'):
+        image_url = image_data
+    else:
+        image_url = f"data:image/jpeg;base64,{image_data}"
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": str(message) if message else image_prompt},
+            {"type": "image_url", "image_url": {"url": image_url, "detail": "high"}},
+        ]
+    }
+
+
+def materialize_images(chat_history: list) -> list:
+    """
+    История для провайдера: ImageAttachment в сообщениях -> data URL
+
+    Вызывается один раз на запрос, непосредственно перед обходом провайдеров:
+    запросы, обслуженные кэшем или чужим single-flight вызовом, base64 не строят вовсе.
+    Исходная история не меняется (копируются только сообщения с изображениями).
+    Сама строка строится один раз на изображение (см. ImageAttachment.data_url).
+    """
+    materialized = None
+    for index, msg in enumerate(chat_history):
+        content = msg.get("content")
+        if not isinstance(content, list):
+            continue
+        if not any(isinstance(part.get("image_url", {}).get("url"), ImageAttachment) for part in content):
+            continue
+        parts = []
+        for part in content:
+            url = part.get("image_url", {}).get("url")
+            if isinstance(url, ImageAttachment):
+                part = {**part, "image_url": {**part["image_url"], "url": url.data_url()}}
+            parts.append(part)
+        if materialized is None:
+            materialized = list(chat_history)
+        materialized[index] = {**msg, "content": parts}
+    return materialized if materialized is not None else chat_history
+
+
+# === МАРШРУТИЗАЦИЯ ===
+
+class RoutingPolicy:
+    """
+    Какие провайдеры пробовать, в каком порядке и с какой моделью
+
+    По умолчанию: vision-запросы - только vision провайдеры, авто режим - рабочие
+    (быстрые + средние), конкретная модель - все; порядок - по живой статистике
+    provider_health, список проходится по кругу max_cycles раз. Другое поведение -
+    подкласс с переопределенными select()/order().
+    """
+
+    def __init__(self, max_cycles: int = 2, max_attempts: int = 15):
+        self.max_cycles = max_cycles
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def model_for(model: str = None, image_data: str = None) -> str:
+        """Модель запроса (по ней же подбирается бюджет контекста)"""
+        if image_data:
+            return VISION_MODEL
+        if model and model != 'auto':
+            return model
+        return AUTO_MODEL
+
+    def select(self, gateway: 'LLMGateway', model: str = None, providers: list = None,
+               image_data: str = None) -> Tuple[List[str], Optional[str]]:
+        """Кандидаты и модель"""
+        if image_data:
+            logger.info(f"[VISION] Используем vision провайдеры: {gateway.vision_providers}")
+            return gateway.vision_providers, VISION_MODEL
+        if providers:
+            return providers, model
+        if model and model != 'auto':
+            return gateway.working_providers + gateway.backup_providers, model
+        return gateway.working_providers, AUTO_MODEL
+
+    def order(self, candidates: List[str]) -> List[str]:
+        """Порядок по живой статистике (задержка, доля успехов)"""
+        return provider_health.rank(candidates)
+
+    def plan(self, gateway: 'LLMGateway', model: str = None, providers: list = None,
+             image_data: str = None) -> Tuple[List[str], Optional[str]]:
+        """
+        Returns:
+            (список попыток с циклическим обходом, модель)
+        """
+        candidates, model_to_use = self.select(gateway, model, providers, image_data)
+        candidates = self.order([p for p in candidates if p not in gateway.problematic_providers])
+        logger.info(f"[PROVIDERS] Порядок: {candidates}")
+        return (candidates * self.max_cycles)[:self.max_attempts], model_to_use
+
+
+class StreamOutcome:
+    """Итог потокового ответа (заполняется шлюзом после завершения потока)"""
+
+    def __init__(self):
+        self.result: Optional[Dict[str, Any]] = None
+
+
+# === ШЛЮЗ ===
+
+class LLMGateway:
+    """
+    Обход провайдеров g4f до первого непустого ответа
+
+    - complete(): ответ целиком; max_parallel > 1 включает hedged-запросы
+      (следующий провайдер подключается, если текущий не ответил за свой p50)
+    - stream(): потоковый ответ с переключением провайдера до первого фрагмента
+    - provider_stats и stats - общие для всех сервисов
+    """
+
+    def __init__(self, policy: RoutingPolicy = None, max_parallel: int = 1, hedge_delay: float = 3.0,
+                 min_hedge_delay: float = 0.5, stream_chunk_timeout: float = 60,
+                 stream_timeout: float = 90):
+        self.fast_providers = list(FAST_PROVIDERS)
+        self.medium_providers = list(MEDIUM_PROVIDERS)
+        self.slow_providers = list(SLOW_PROVIDERS)
+        self.vision_providers = list(VISION_PROVIDERS)
+        self.image_providers = list(IMAGE_PROVIDERS)
+        self.problematic_providers = list(PROBLEMATIC_PROVIDERS)
+        self.vision_model_map = dict(VISION_MODEL_MAP)
+
+        self.policy = policy or RoutingPolicy()
+        self.max_parallel = max_parallel
+        self.hedge_delay = hedge_delay          # Пока по провайдеру мало замеров (дальше - его p50)
+        self.min_hedge_delay = min_hedge_delay
+        self.stream_chunk_timeout = stream_chunk_timeout  # Сколько ждать очередной фрагмент потока
+        self.stream_timeout = stream_timeout  # Сколько провайдер может генерировать весь поток
+
+        self.current_provider = 'Chatai'  # Самый быстрый
+        self.provider_stats: Dict[str, int] = {}
+        self.stats = {"requests": 0, "successes": 0, "failures": 0, "timeouts": 0, "hedged_wins": 0}
+
+    # --- Каталог ---
+
+    @property
+    def working_providers(self) -> List[str]:
+        """Основные рабочие провайдеры (быстрые + средние)"""
+        return self.fast_providers + self.medium_providers
+
+    @property
+    def backup_providers(self) -> List[str]:
+        """Резервные провайдеры (медленные)"""
+        return self.slow_providers
+
+    def get_all_providers(self) -> List[str]:
+        """Все текстовые провайдеры без дубликатов: быстрые, средние, медленные"""
+        return list(dict.fromkeys(self.fast_providers + self.medium_providers + self.slow_providers))
+
+    def resolve_model(self, model_to_use: str, provider_name: str, image_data: str = None):
+        """Модель g4f для конкретного провайдера (для vision - из vision_model_map)"""
+        if image_data and provider_name in self.vision_model_map:
+            model_to_use = self.vision_model_map[provider_name]
+        return g4f_registry.model(model_to_use)
+
+    def warm_up(self, models: List[str] = ()) -> Dict[str, Any]:
+        """Импорт g4f и разрешение всех провайдеров и моделей заранее (синхронно - запускать в потоке)"""
+        return g4f_registry.warm_up(
+            providers=self.get_all_providers() + self.vision_providers + self.image_providers,
+            models=[AUTO_MODEL, VISION_MODEL, *models, *self.vision_model_map.values()],
+        )
+
+    # --- Ответ целиком ---
+
+    async def complete(self, chat_history: list, model: str = None, providers: list = None,
+                       image_data: str = None, deadline: RequestDeadline = None,
+                       policy: RoutingPolicy = None, max_parallel: int = None,
+                       proxy: str = None, proxy_after_attempt: int = 2) -> Dict[str, Any]:
+        """
+        Ответ модели на готовую историю сообщений
+
+        Args:
+            deadline: Бюджет времени на все попытки (по умолчанию - по типу запроса)
+            policy: Маршрутизация вместо политики шлюза
+            max_parallel: Сколько провайдеров может отвечать одновременно (1 - строго по очереди)
+            proxy: Прокси для попыток с номером (с нуля) больше proxy_after_attempt
+
+        Returns:
+            success=True и raw_response, provider_used, model_used, attempt_number,
+            response_time, hedged - или результат ошибки (с текстом для пользователя в response)
+        """
+        await g4f_registry.ensure_loaded()
+        deadline = deadline or RequestDeadline.for_request(image_data)
+        attempts, model_to_use = (policy or self.policy).plan(self, model, providers, image_data)
+        circuit_skipped = set()
+        self.stats["requests"] += 1
+        if isinstance(image_data, ImageAttachment) and not image_data.materialized and cpu_executor.kind == 'thread':
+            # base64 мегабайтного снимка - в пуле потоков (в пул процессов memoryview не передать)
+            await cpu_executor.run(image_data.data_url, size=len(image_data))
+        chat_history = materialize_images(chat_history)
+
+        result = await self._race(attempts, chat_history, model_to_use, image_data, deadline, circuit_skipped,
+                                  max_parallel or self.max_parallel, proxy, proxy_after_attempt)
+        if result:
+            provider_name = result["provider_used"]
+            logger.info(f"[SUCCESS] Провайдер: {provider_name}, время: {result['response_time']}с")
+            self.provider_stats[provider_name] = self.provider_stats.get(provider_name, 0) + 1
+            self.current_provider = provider_name
+            self.stats["successes"] += 1
+            if result["hedged"]:
+                self.stats["hedged_wins"] += 1
+            return result
+
+        if deadline.expired:
+            logger.warning(f"[DEADLINE] Бюджет {deadline.budget:.0f}с исчерпан после {deadline.attempts} попыток")
+            self.stats["timeouts"] += 1
+            return deadline.timeout_result(image_data)
+
+        self.stats["failures"] += 1
+        return self._failure_result(attempts, circuit_skipped, image_data)
+
+    async def _race(self, attempts: list, chat_history: list, model_to_use: str, image_data: str,
+                    deadline: RequestDeadline, circuit_skipped: set, max_parallel: int,
+                    proxy: str, proxy_after_attempt: int) -> Optional[Dict[str, Any]]:
+        """
+        Обход провайдеров: первый запрос уходит сразу, следующий провайдер подключается,
+        если за hedge_delay ответа нет (при max_parallel > 1). Побеждает первый непустой
+        ответ, остальные запросы отменяются. Все попытки укладываются в дедлайн.
+        """
+        pending = {}  # task -> (номер попытки, провайдер, время старта)
+        next_index = 0
+
+        def launch_next() -> bool:
+            nonlocal next_index
+            while next_index < len(attempts):
+                if deadline.expired:
+                    return False
+                attempt = next_index
+                provider_name = attempts[attempt]
+                next_index += 1
+
+                # Не запускаем второй параллельный запрос к тому же провайдеру
+                if any(name == provider_name for _, name, _ in pending.values()):
+                    continue
+
+                if image_data and provider_name not in self.vision_providers:
+                    logger.warning(f"[VISION_SKIP] Пропускаем {provider_name} - не поддерживает vision")
+                    continue
+
+                provider = g4f_registry.provider(provider_name)
+                if not provider:
+                    logger.warning(f"[ERROR] Провайдер {provider_name} не найден")
+                    continue
+
+                # Цепь разомкнута - провайдер на кулдауне (или уже идет пробный запрос)
+                if not circuit_breakers.allow(provider_name):
+                    circuit_skipped.add(provider_name)
+                    continue
+
+                attempt_timeout = deadline.start_attempt(provider_name)
+                logger.info(f"[ATTEMPT] Попытка {attempt + 1}/{len(attempts)}: {provider_name} "
+                            f"(таймаут {attempt_timeout:.1f}с)")
+                task = asyncio.create_task(self._attempt(
+                    provider_name, provider, chat_history, model_to_use, image_data, attempt_timeout,
+                    proxy if proxy and attempt > proxy_after_attempt else None
+                ))
+                # Забираем исключения у проигравших/отмененных задач, чтобы не было предупреждений asyncio
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                pending[task] = (attempt, provider_name, time.time())
+                return True
+            return False
+
+        try:
+            while True:
+                if not pending and not launch_next():
+                    return None
+
+                hedge_delay = None
+                if len(pending) < max_parallel and next_index < len(attempts):
+                    # Ждем последнего запущенного провайдера столько, сколько он обычно отвечает
+                    _, newest_provider, newest_start = max(pending.values(), key=lambda info: info[2])
+                    hedge_delay = max(0.0, self._hedge_delay(newest_provider) - (time.time() - newest_start))
+
+                # Дольше остатка бюджета не ждем никого
+                waits_for_deadline = hedge_delay is None or deadline.remaining <= hedge_delay
+                done, _ = await asyncio.wait(
+                    pending.keys(),
+                    timeout=deadline.remaining if waits_for_deadline else hedge_delay,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done and waits_for_deadline:
+                    slow = ", ".join(name for _, name, _ in pending.values())
+                    logger.warning(f"[DEADLINE] Бюджет {deadline.budget:.0f}с исчерпан, отменяем: {slow}")
+                    return None
+
+                if not done:
+                    # Провайдер отвечает дольше обычного - подключаем следующего
+                    slow = ", ".join(name for _, name, _ in pending.values())
+                    if launch_next():
+                        logger.info(f"[HEDGE] {slow} не ответил вовремя, запускаем параллельный запрос")
+                    continue
+
+                for task in done:
+                    attempt, provider_name, started_at = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except asyncio.TimeoutError:
+                        logger.warning(f"[TIMEOUT] {provider_name}: превышен таймаут")
+                        provider_health.record_failure(provider_name, 'timeout', time.time() - started_at)
+                        circuit_breakers.record_failure(provider_name, 'timeout')
+                        continue
+                    except Exception as e:
+                        self.record_provider_error(provider_name, e, image_data)
+                        continue
+
+                    if result:
+                        provider_health.record_success(provider_name, result["response_time"])
+                        circuit_breakers.record_success(provider_name)
+                        result["attempt_number"] = attempt + 1
+                        result["hedged"] = len(pending) > 0
+                        if pending:
+                            losers = ", ".join(name for _, name, _ in pending.values())
+                            logger.info(f"[HEDGE] {provider_name} ответил первым, отменяем: {losers}")
+                        return result
+
+                    logger.warning(f"[WARNING] {provider_name} вернул пустой ответ")
+                    provider_health.record_failure(provider_name, 'empty')
+                    circuit_breakers.record_failure(provider_name, 'error')
+        finally:
+            for task, (_, provider_name, _) in pending.items():
+                task.cancel()
+                # Отмененный пробный запрос не должен держать цепь в half-open
+                circuit_breakers.release(provider_name)
+
+    def _hedge_delay(self, provider_name: str) -> float:
+        """Задержка перед hedged-запросом: p50 провайдера, пока статистики нет - hedge_delay"""
+        p50 = provider_health.p50(provider_name)
+        if p50 is None:
+            return self.hedge_delay
+        return min(max(p50, self.min_hedge_delay), self.hedge_delay * 3)
+
+    async def _attempt(self, provider_name: str, provider, chat_history: list, model_to_use: str,
+                       image_data: str, timeout: float, proxy: str = None) -> Optional[Dict[str, Any]]:
+        """Одна попытка запроса к провайдеру. Возвращает None при пустом ответе"""
+        final_model_to_use = self.resolve_model(model_to_use, provider_name, image_data)
+        request_kwargs = {
+            "model": final_model_to_use,
+            "messages": chat_history,
+            "provider": provider,
+            "timeout": timeout,  # Из остатка бюджета запроса и p95 провайдера
+        }
+        if proxy:
+            request_kwargs["proxy"] = proxy
+            logger.info(f"[PROXY] Используем прокси: {proxy}")
+        else:
+            # Общий пул соединений (с прокси провайдер открывает соединение сам)
+            request_kwargs.update(http_pool.request_kwargs(provider_name, provider))
+
+        start_time = time.time()
+        # Не все провайдеры соблюдают timeout - ограничиваем сами
+        response = await asyncio.wait_for(g4f_registry.create_async(**request_kwargs), timeout)
+        response_time = round(time.time() - start_time, 2)
+
+        response_text = str(response).strip() if response else ""
+        if not response_text:
+            return None
+        return {
+            "success": True,
+            "raw_response": response_text,
+            "provider_used": provider_name,
+            "model_used": str(final_model_to_use),
+            "response_time": response_time,
+        }
+
+    # --- Потоковый ответ ---
+
+    async def stream(self, chat_history: list, outcome: StreamOutcome, model: str = None,
+                     providers: list = None, deadline: RequestDeadline = None,
+                     policy: RoutingPolicy = None) -> AsyncIterator[str]:
+        """
+        Фрагменты ответа с переключением провайдера до первого фрагмента (только текст)
+
+        Дедлайн ограничивает ожидание первого фрагмента и переключения; начатый поток
+        не обрывается - пользователь уже видит ответ. Итог - в outcome.result (raw_response,
+        provider_used, first_chunk_time, partial и т.д. или результат ошибки).
+        """
+        await g4f_registry.ensure_loaded()
+        deadline = deadline or RequestDeadline.for_request()
+        attempts, model_to_use = (policy or self.policy).plan(self, model, providers)
+        circuit_skipped = set()
+        self.stats["requests"] += 1
+        chat_history = materialize_images(chat_history)
+
+        for attempt, provider_name in enumerate(attempts):
+            if deadline.expired:
+                logger.warning(f"[DEADLINE] Бюджет {deadline.budget:.0f}с исчерпан после {deadline.attempts} попыток (поток)")
+                break
+
+            provider = g4f_registry.provider(provider_name)
+            if not provider:
+                logger.warning(f"[ERROR] Провайдер {provider_name} не найден")
+                continue
+
+            if not circuit_breakers.allow(provider_name):
+                circuit_skipped.add(provider_name)
+                continue
+
+            attempt_timeout = deadline.start_attempt(provider_name)
+            logger.info(f"[STREAM] Попытка {attempt + 1}: {provider_name} (первый фрагмент - до {attempt_timeout:.1f}с)")
+
+            final_model_to_use = self.resolve_model(model_to_use, provider_name)
+            request_kwargs = {
+                "model": final_model_to_use,
+                "messages": chat_history,
+                "provider": provider,
+                # Таймаут всего потока у провайдера (не меньше ожидания первого фрагмента -
+                # attempt_timeout из бюджета запроса)
+                "timeout": max(attempt_timeout, self.stream_timeout),
+                **http_pool.request_kwargs(provider_name, provider),
+            }
+
+            start_time = time.time()
+            first_chunk_time = None
+            chunks = []
+            error = None
+
+            try:
+                async for delta in self._iter_provider_stream(request_kwargs, attempt_timeout):
+                    if first_chunk_time is None:
+                        first_chunk_time = round(time.time() - start_time, 2)
+                        logger.info(f"[STREAM] {provider_name}: первый фрагмент через {first_chunk_time}с")
+                    chunks.append(delta)
+                    yield delta
+            except (GeneratorExit, asyncio.CancelledError):
+                # Потребитель прервал поток - пробный запрос не должен держать цепь в half-open
+                circuit_breakers.release(provider_name)
+                raise
+            except Exception as e:
+                error = e
+
+            response_time = round(time.time() - start_time, 2)
+            response_text = "".join(chunks).strip()
+
+            if error is not None:
+                if isinstance(error, asyncio.TimeoutError):
+                    wait_limit = self.stream_chunk_timeout if chunks else attempt_timeout
+                    logger.warning(f"[TIMEOUT] {provider_name}: поток не отвечает дольше {wait_limit:.1f}с")
+                    provider_health.record_failure(provider_name, 'timeout', response_time)
+                    circuit_breakers.record_failure(provider_name, 'timeout')
+                else:
+                    self.record_provider_error(provider_name, error)
+
+                # Часть ответа уже показана пользователю - переключать провайдера поздно
+                if not response_text:
+                    continue
+                logger.warning(f"[STREAM] {provider_name}: поток оборвался, отдаем полученную часть ({len(response_text)} символов)")
+            elif not response_text:
+                logger.warning(f"[WARNING] {provider_name} вернул пустой поток")
+                provider_health.record_failure(provider_name, 'empty')
+                circuit_breakers.record_failure(provider_name, 'error')
+                continue
+            else:
+                provider_health.record_success(provider_name, response_time)
+                circuit_breakers.record_success(provider_name)
+
+            logger.info(f"[SUCCESS] Провайдер: {provider_name}, время: {response_time}с (поток)")
+            self.provider_stats[provider_name] = self.provider_stats.get(provider_name, 0) + 1
+            self.current_provider = provider_name
+            self.stats["successes"] += 1
+
+            outcome.result = {
+                "success": True,
+                "raw_response": response_text,
+                "model_used": str(final_model_to_use),
+                "provider_used": provider_name,
+                "attempt_number": attempt + 1,
+                "response_time": response_time,
+                "first_chunk_time": first_chunk_time,
+                "partial": error is not None,
+            }
+            return
+
+        if deadline.expired:
+            self.stats["timeouts"] += 1
+            outcome.result = deadline.timeout_result()
+        else:
+            self.stats["failures"] += 1
+            outcome.result = self._failure_result(attempts, circuit_skipped)
+
+    async def _iter_provider_stream(self, request_kwargs: dict, first_chunk_timeout: float) -> AsyncIterator[str]:
+        """
+        Текстовые фрагменты от провайдера (g4f stream=True); без поддержки stream - весь ответ одним фрагментом
+
+        Первый фрагмент (или полный ответ) ждем не дольше first_chunk_timeout,
+        следующие - не дольше stream_chunk_timeout.
+        """
+        started = time.monotonic()
+        try:
+            response = g4f_registry.create_stream(**request_kwargs)
+            if inspect.isawaitable(response):
+                response = await asyncio.wait_for(response, first_chunk_timeout)
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            # StreamNotSupportedError и подобные - провайдер умеет только целый ответ
+            if "stream" not in str(e).lower():
+                raise
+            logger.info("[STREAM] Провайдер не поддерживает stream, ждем полный ответ")
+            response = await asyncio.wait_for(
+                g4f_registry.create_async(**request_kwargs),
+                max(0.0, first_chunk_timeout - (time.monotonic() - started))
+            )
+
+        if not hasattr(response, '__aiter__'):
+            if response:
+                yield str(response)
+            return
+
+        iterator = response.__aiter__()
+        received = False
+        while True:
+            timeout = (self.stream_chunk_timeout if received
+                       else max(0.0, first_chunk_timeout - (time.monotonic() - started)))
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                break
+            # Кроме текста g4f отдает служебные объекты (FinishReason, Usage и т.п.)
+            if isinstance(chunk, str) and chunk:
+                received = True
+                yield chunk
+
+    # --- Ошибки и статистика ---
+
+    def record_provider_error(self, provider_name: str, error: Exception, image_data: str = None):
+        """Классификация ошибки провайдера (логирование + учет в health и circuit breaker)"""
+        error_msg = str(error)
+        error_class = classify_error(error_msg)
+        lower = error_msg.lower()
+
+        if error_class == 'rate_limit':
+            logger.warning(f"[RATE_LIMIT] {provider_name}: превышен лимит - {error_msg}")
+            provider_health.record_failure(provider_name, 'rate_limit')
+        elif error_class == 'unavailable':
+            logger.warning(f"[RATE_LIMIT] {provider_name}: временно недоступен - {error_msg}")
+            provider_health.record_failure(provider_name, 'rate_limit')
+        else:
+            if error_class == 'blocked':
+                logger.warning(f"[BLOCKED] {provider_name}: заблокирован - {error_msg}")
+            elif image_data and any(word in lower for word in ("vision", "image", "multimodal", "unsupported")):
+                logger.warning(f"[VISION_ERROR] {provider_name}: ошибка обработки изображения - {error_msg}")
+            elif "proxy" in lower:
+                logger.warning(f"[PROXY] {provider_name}: проблема с прокси - {error_msg}")
+            elif "connection" in lower or "network" in lower or isinstance(error, ConnectionError):
+                logger.warning(f"[CONNECTION] {provider_name}: проблема соединения - {error_msg}")
+            else:
+                logger.warning(f"[ERROR] {provider_name}: {error_msg}")
+            provider_health.record_failure(provider_name, 'error')
+        circuit_breakers.record_failure(provider_name, error_class, error_msg)
+
+    def _failure_result(self, attempts: list, circuit_skipped: set, image_data: str = None) -> Dict[str, Any]:
+        """Ответ, когда ни один провайдер не сработал"""
+        error_type = "vision провайдеры" if image_data else "AI провайдеры"
+        logger.error(f"[FAILED] Все {error_type} недоступны! Попыток: {len(attempts)}, "
+                     f"отключены: {len(circuit_skipped)}")
+        return {
+            "success": False,
+            "error": f"Все {error_type} недоступны",
+            "response": f"🚫 Извините, все {error_type} временно недоступны. Попробуйте позже.",
+            "total_attempts": len(attempts),
+            "rate_limited_count": len(circuit_skipped),
+            "image_request": bool(image_data)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Общая статистика: шлюз, провайдеры, health, circuit breaker, g4f, пул соединений"""
+        return {
+            "gateway": dict(self.stats),
+            "current": self.current_provider,
+            "provider_stats": self.provider_stats,
+            "provider_health": provider_health.snapshot(),
+            "circuit_breakers": circuit_breakers.snapshot(),
+            "g4f": g4f_registry.get_stats(),
+            "http_pool": http_pool.get_stats(),
+        }
+
+# Глобальный шлюз к провайдерам (общий для всех сервисов)
+llm_gateway = LLMGateway(stream_timeout=config.STREAM_TIMEOUT)
@@ -0,0 +1,181 @@
+"""
+Реестр здоровья AI провайдеров: живая статистика задержек и ошибок
+"""
+import logging
+import random
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Задержки из разового теста (2025-07-05) - используются только как априорная
+# оценка, пока по провайдеру не накопилось живых замеров
+BASELINE_LATENCIES = {
+    'Chatai': 0.78,
+    'AnyProvider': 0.98,
+    'Blackbox': 2.14,
+    'OpenAIFM': 2.34,
+    'Qwen_Qwen_2_5_Max': 2.46,
+    'OIVSCodeSer0501': 2.53,
+    'WeWordle': 2.54,
+    'CohereForAI_C4AI_Command': 2.58,
+    'OIVSCodeSer2': 4.76,
+    'Qwen_Qwen_2_5': 5.25,
+    'Yqcloud': 5.64,
+    'ImageLabs': 8.27,
+    'PollinationsAI': 8.95,
+    'Qwen_Qwen_3': 15.45,
+    'LambdaChat': 16.67,
+    'BlackForestLabs_Flux1Dev': 23.02,
+}
+DEFAULT_BASELINE_LATENCY = 10.0
+
+# Виды неудачных попыток
+FAILURE_KINDS = ('error', 'rate_limit', 'empty', 'timeout')
+
+
+class ProviderHealth:
+    """Скользящая статистика одного провайдера"""
+
+    def __init__(self, name: str, baseline_latency: float, window: int = 50):
+        self.name = name
+        self.latencies = deque(maxlen=window)  # Последние успешные замеры
+        self.ewma_latency = baseline_latency
+        self.ewma_success = 1.0  # Оптимистичный старт - новый провайдер стоит попробовать
+        self.successes = 0
+        self.failures = 0
+        self.rate_limit_hits = 0
+        self.empty_responses = 0
+        self.timeouts = 0
+        self.last_seen: Optional[float] = None
+
+    @property
+    def attempts(self) -> int:
+        return self.successes + self.failures
+
+    @property
+    def success_ratio(self) -> Optional[float]:
+        if not self.attempts:
+            return None
+        return self.successes / self.attempts
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль задержки по скользящему окну (q от 0 до 1)"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self.percentile(0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self.percentile(0.95)
+
+    def expected_cost(self) -> float:
+        """Ожидаемое время до успешного ответа: задержка / вероятность успеха"""
+        return self.ewma_latency / max(self.ewma_success, 0.05)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "p50": self.p50,
+            "p95": self.p95,
+            "ewma_latency": round(self.ewma_latency, 2),
+            "success_ratio": self.success_ratio,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rate_limit_hits": self.rate_limit_hits,
+            "empty_responses": self.empty_responses,
+            "timeouts": self.timeouts,
+        }
+
+
+class ProviderHealthRegistry:
+    """
+    Реестр здоровья провайдеров (общий для всех GPT сервисов процесса)
+
+    Порядок обхода провайдеров строится по EWMA ожидаемой стоимости
+    (задержка / доля успехов). С вероятностью exploration первым ставится
+    случайный провайдер, чтобы оценки "забытых" провайдеров обновлялись.
+    """
+
+    def __init__(self, alpha: float = 0.3, window: int = 50, exploration: float = 0.05,
+                 baseline: Dict[str, float] = None):
+        self.alpha = alpha
+        self.window = window
+        self.exploration = exploration
+        self.baseline = baseline if baseline is not None else BASELINE_LATENCIES
+        self.providers: Dict[str, ProviderHealth] = {}
+
+    def get(self, name: str) -> ProviderHealth:
+        """Получить (или создать) запись провайдера"""
+        health = self.providers.get(name)
+        if health is None:
+            health = ProviderHealth(name, self.baseline.get(name, DEFAULT_BASELINE_LATENCY), self.window)
+            self.providers[name] = health
+        return health
+
+    def record_success(self, name: str, latency: float):
+        """Учесть успешный ответ провайдера"""
+        health = self.get(name)
+        health.successes += 1
+        health.latencies.append(latency)
+        health.ewma_latency += self.alpha * (latency - health.ewma_latency)
+        health.ewma_success += self.alpha * (1.0 - health.ewma_success)
+        health.last_seen = time.time()
+
+    def record_failure(self, name: str, kind: str = 'error', latency: float = None):
+        """
+        Учесть неудачную попытку
+
+        Args:
+            name: Имя провайдера
+            kind: Вид ошибки ('error', 'rate_limit', 'empty', 'timeout')
+            latency: Сколько длилась попытка (для таймаутов сдвигает оценку задержки)
+        """
+        health = self.get(name)
+        health.failures += 1
+        if kind == 'rate_limit':
+            health.rate_limit_hits += 1
+        elif kind == 'empty':
+            health.empty_responses += 1
+        elif kind == 'timeout':
+            health.timeouts += 1
+        if latency is not None and latency > health.ewma_latency:
+            health.ewma_latency += self.alpha * (latency - health.ewma_latency)
+        health.ewma_success += self.alpha * (0.0 - health.ewma_success)
+        health.last_seen = time.time()
+
+    def rank(self, providers: List[str]) -> List[str]:
+        """Упорядочить провайдеров от самого выгодного к самому медленному/ненадежному"""
+        ranked = sorted(providers, key=lambda name: self.get(name).expected_cost())
+        if len(ranked) > 1 and random.random() < self.exploration:
+            explore = ranked.pop(random.randrange(1, len(ranked)))
+            ranked.insert(0, explore)
+            logger.debug(f"[HEALTH] Исследуем провайдера {explore}")
+        return ranked
+
+    def p50(self, name: str, min_samples: int = 5) -> Optional[float]:
+        """Медианная задержка провайдера (None, пока замеров мало)"""
+        health = self.providers.get(name)
+        if not health or len(health.latencies) < min_samples:
+            return None
+        return health.p50
+
+    def p95(self, name: str, min_samples: int = 5) -> Optional[float]:
+        """p95 задержки провайдера (None, пока замеров мало)"""
+        health = self.providers.get(name)
+        if not health or len(health.latencies) < min_samples:
+            return None
+        return health.p95
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Снимок статистики по всем провайдерам"""
+        return {name: health.to_dict() for name, health in self.providers.items()}
+
+# Глобальный реестр здоровья провайдеров
+provider_health = ProviderHealthRegistry()
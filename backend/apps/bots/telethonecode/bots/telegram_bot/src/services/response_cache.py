@@ -0,0 +1,259 @@
+"""
+Кэш ответов GPT для повторяющихся запросов ("Привет", вопросы о статусе и т.п.)
+"""
+import copy
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable, Tuple
+
+from ...config import config
+
+logger = logging.getLogger(__name__)
+
+# Всё, кроме букв, цифр и пробелов, при нормализации выбрасывается
+NON_WORD_PATTERN = re.compile(r'[^\w\s]+', re.UNICODE)
+SPACES_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кэша: регистр, пунктуация, лишние пробелы"""
+    text = NON_WORD_PATTERN.sub(' ', str(text).casefold())
+    return SPACES_PATTERN.sub(' ', text).strip()
+
+
+def _trigrams(text: str) -> frozenset:
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class CacheEntry:
+    """Закэшированный ответ"""
+
+    __slots__ = ('response', 'expires_at', 'hits')
+
+    def __init__(self, response: Dict[str, Any], expires_at: float):
+        self.response = response
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов
+
+    1. Точный LRU: ключ - хэш нормализованных системного промпта, хвоста истории
+       и сообщения. Размер ограничен max_entries, у записей есть TTL.
+    2. Похожие сообщения (опционально, только для коротких сообщений): в том же
+       контексте (системный промпт + хвост истории) ищется сообщение с похожестью
+       по триграммам не ниже similarity_threshold.
+
+    Запросы с изображениями и чаты, отключившие кэш, идут мимо.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: int = 3600, history_tail: int = 2,
+                 similarity_enabled: bool = True, similarity_threshold: float = 0.85,
+                 similarity_max_length: int = 64, similarity_candidates: int = 200,
+                 enabled: bool = True, disabled_chats: Iterable[int] = ()):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_tail = history_tail
+        self.similarity_enabled = similarity_enabled
+        self.similarity_threshold = similarity_threshold
+        self.similarity_max_length = similarity_max_length
+        self.similarity_candidates = similarity_candidates
+        self.disabled_chats = set(disabled_chats)
+
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Контекст -> {нормализованное сообщение: (триграммы, ключ точного кэша)}
+        self.similarity_index: Dict[str, "OrderedDict[str, Tuple[frozenset, str]]"] = {}
+
+        self.stats = {
+            "exact_hits": 0,
+            "similar_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    # --- Настройки по чатам ---
+
+    def is_enabled_for(self, chat_id: Optional[int]) -> bool:
+        return self.enabled and chat_id not in self.disabled_chats
+
+    def set_chat_enabled(self, chat_id: int, enabled: bool):
+        """Включить/отключить кэш для конкретного чата"""
+        if enabled:
+            self.disabled_chats.discard(chat_id)
+        else:
+            self.disabled_chats.add(chat_id)
+            logger.info(f"[CACHE] Кэш отключен для чата {chat_id}")
+
+    # --- Ключи ---
+
+    def _context_key(self, chat_history: list) -> str:
+        """Хэш системного промпта и хвоста истории (всё, кроме текущего сообщения)"""
+        previous = chat_history[:-1]
+        system = [m for m in previous if m.get("role") == "system"]
+        dialog = [m for m in previous if m.get("role") != "system"]
+        tail = dialog[-self.history_tail:] if self.history_tail else []
+        payload = [(m.get("role"), normalize_text(m.get("content", ""))) for m in system + tail]
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _exact_key(context_key: str, normalized_message: str, model: Optional[str]) -> str:
+        raw = f"{context_key}\x00{model or ''}\x00{normalized_message}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # --- Чтение / запись ---
+
+    def get(self, chat_history: list, message: str, model: str = None, chat_id: int = None,
+            image_data: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Найти ответ в кэше
+
+        Returns:
+            Копия закэшированного результата с пометками cached/cache_tier или None
+        """
+        if image_data or not self.is_enabled_for(chat_id):
+            self.stats["bypassed"] += 1
+            return None
+
+        normalized = normalize_text(message)
+        if not normalized:
+            self.stats["bypassed"] += 1
+            return None
+
+        context_key = self._context_key(chat_history)
+        key = self._exact_key(context_key, normalized, model)
+
+        entry = self._lookup(key)
+        tier = 'exact'
+        if entry is None and self.similarity_enabled and len(normalized) <= self.similarity_max_length:
+            entry = self._lookup_similar(context_key, normalized, model)
+            tier = 'similar'
+
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        entry.hits += 1
+        self.stats[f"{tier}_hits"] += 1
+        logger.info(f"[CACHE] Попадание ({tier}) для '{message[:30]}...'")
+
+        result = copy.deepcopy(entry.response)
+        result["cached"] = True
+        result["cache_tier"] = tier
+        result["response_time"] = 0.0
+        return result
+
+    def put(self, chat_history: list, message: str, result: Dict[str, Any], model: str = None,
+            chat_id: int = None, image_data: str = None):
+        """Сохранить успешный ответ"""
+        if image_data or not self.is_enabled_for(chat_id) or not result.get("success") or result.get("partial"):
+            return
+
+        normalized = normalize_text(message)
+        if not normalized:
+            return
+
+        context_key = self._context_key(chat_history)
+        key = self._exact_key(context_key, normalized, model)
+
+        self.entries[key] = CacheEntry(copy.deepcopy(result), time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        self.stats["stores"] += 1
+
+        if self.similarity_enabled and len(normalized) <= self.similarity_max_length:
+            index = self.similarity_index.setdefault(context_key, OrderedDict())
+            index[f"{model or ''}\x00{normalized}"] = (_trigrams(normalized), key)
+            index.move_to_end(f"{model or ''}\x00{normalized}")
+            while len(index) > self.similarity_candidates:
+                index.popitem(last=False)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _lookup(self, key: str) -> Optional[CacheEntry]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            self.stats["expired"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _lookup_similar(self, context_key: str, normalized: str, model: Optional[str]) -> Optional[CacheEntry]:
+        index = self.similarity_index.get(context_key)
+        if not index:
+            return None
+
+        prefix = f"{model or ''}\x00"
+        grams = _trigrams(normalized)
+        best_key, best_score = None, 0.0
+        for index_key, (candidate_grams, exact_key) in reversed(index.items()):
+            if not index_key.startswith(prefix):
+                continue
+            union = len(grams | candidate_grams)
+            score = len(grams & candidate_grams) / union if union else 0.0
+            if score > best_score:
+                best_key, best_score = exact_key, score
+
+        if best_key is None or best_score < self.similarity_threshold:
+            return None
+        return self._lookup(best_key)
+
+    # --- Обслуживание ---
+
+    def cleanup(self):
+        """Удалить просроченные записи и осиротевшие ссылки индекса похожести"""
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self.entries[key]
+        self.stats["expired"] += len(expired)
+
+        for context_key in list(self.similarity_index):
+            index = self.similarity_index[context_key]
+            for index_key in [k for k, (_, exact_key) in index.items() if exact_key not in self.entries]:
+                del index[index_key]
+            if not index:
+                del self.similarity_index[context_key]
+
+        if expired:
+            logger.info(f"[CACHE] Удалено просроченных записей: {len(expired)}")
+
+    def clear(self):
+        self.entries.clear()
+        self.similarity_index.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики кэша"""
+        hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "enabled": self.enabled,
+            "disabled_chats": len(self.disabled_chats),
+        }
+
+# Глобальный кэш ответов
+response_cache = ResponseCache(
+    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=config.RESPONSE_CACHE_TTL,
+    similarity_enabled=config.RESPONSE_CACHE_SIMILARITY,
+    enabled=config.RESPONSE_CACHE_ENABLED,
+    disabled_chats=config.RESPONSE_CACHE_DISABLED_CHATS,
+)
@@ -0,0 +1,90 @@
+"""
+Объединение одинаковых одновременных запросов к GPT (single-flight)
+
+В группах несколько человек часто присылают одно и то же сообщение или картинку
+с разницей в секунды. Пока первый такой запрос идет по провайдерам, остальные
+ждут его результата, а не запускают свой каскад попыток.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from ...config import config
+from .response_cache import normalize_text
+from ..utils.images import ImageAttachment
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Один вызов провайдеров на группу одинаковых запросов
+
+    Ключ - хэш нормализованного сообщения, контекста (системный промпт и вся
+    история), модели и изображения. Если ведущий запрос упал или был отменен,
+    ожидающие выполняют запрос сами.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "fallbacks": 0}
+
+    @staticmethod
+    def make_key(chat_history: list, message: str, model: str = None, providers: list = None,
+                 image_data: Union[str, ImageAttachment] = None) -> str:
+        """Ключ запроса: контекст (всё, кроме текущего сообщения) + нормализованное сообщение"""
+        context = [(m.get("role"), m.get("content")) for m in chat_history[:-1]]
+        payload = json.dumps([context, normalize_text(message or ""), model, providers],
+                             ensure_ascii=False, default=str)
+        digest = hashlib.sha256(payload.encode('utf-8'))
+        if image_data:
+            digest.update(b'\x00')
+            if isinstance(image_data, ImageAttachment):
+                digest.update(image_data.digest)
+            else:
+                digest.update(image_data.encode('ascii', 'ignore'))
+        return digest.hexdigest()
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Выполнить call() или дождаться такого же запроса, который уже выполняется
+
+        Returns:
+            Результат call(); у присоединившихся - копия с пометкой coalesced=True
+        """
+        if not self.enabled:
+            return await call()
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            logger.info("[SINGLE_FLIGHT] Присоединяемся к запросу, который уже выполняется")
+            result = await asyncio.shield(future)
+            if result is not None:
+                result = copy.deepcopy(result)
+                result["coalesced"] = True
+                return result
+            # Ведущий запрос не дал результата - выполняем свой
+            self.stats["fallbacks"] += 1
+            return await call()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.stats["leaders"] += 1
+        result: Optional[Dict[str, Any]] = None
+        try:
+            result = await call()
+            return result
+        finally:
+            del self._inflight[key]
+            future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": len(self._inflight), "enabled": self.enabled}
+
+# Глобальный объединитель одинаковых запросов
+single_flight = SingleFlight(enabled=config.SINGLE_FLIGHT_ENABLED)
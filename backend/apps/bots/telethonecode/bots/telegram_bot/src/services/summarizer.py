@@ -0,0 +1,194 @@
+"""
+Фоновое сжатие старой части разговора в резюме
+
+Запрос к модели собирается как "системный промпт + резюме + последние реплики",
+поэтому размер промпта не растет с возрастом чата. Резюме обновляется фоновым
+asyncio-воркером вне пути обработки сообщения.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+
+from ...config import config
+from .context_cache import context_cache
+from .llm_gateway import llm_gateway
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Сожми переписку пользователя с ассистентом в краткое резюме (не больше {max_words} слов).
+Сохрани факты, договоренности, имена, цифры и открытые вопросы. Пиши от третьего лица,
+без приветствий, эмодзи и форматирования. Ответь только текстом резюме.
+
+{previous}ПЕРЕПИСКА:
+{dialog}"""
+
+
+class ConversationSummarizer:
+    """
+    Резюме разговоров по чатам
+
+    - note_exchange(): после каждого ответа; каждые min_batch обменов чат ставится в очередь
+    - воркер сжимает сообщения старше keep_recent последних в резюме (вместе с предыдущим)
+    - get_summary_info(): резюме для сборки промпта и id последнего сжатого сообщения
+      (из памяти, БД - только при промахе); история чата грузится только после этого id
+    """
+
+    def __init__(self, keep_recent: int = 10, min_batch: int = 10, max_words: int = 200,
+                 enabled: bool = True, max_cached: int = 1000):
+        self.keep_recent = keep_recent
+        self.min_batch = min_batch
+        self.max_words = max_words
+        self.enabled = enabled
+        self.max_cached = max_cached
+
+        # chat_id -> (резюме, id последнего сжатого сообщения); (None, 0) - резюме в БД нет
+        self.summaries: "OrderedDict[int, Tuple[Optional[str], int]]" = OrderedDict()
+        self.exchanges: Dict[int, int] = {}
+        self.queued: Set[int] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {"summarized": 0, "messages": 0, "failed": 0, "skipped": 0}
+
+    # --- Жизненный цикл ---
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._worker())
+            logger.info(f"[SUMMARY] Фоновое сжатие истории включено: последние {self.keep_recent} сообщений "
+                        f"как есть, остальное - в резюме")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.queue.get()
+            self.queued.discard(chat_id)
+            try:
+                await self.summarize_chat(chat_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"[SUMMARY] Ошибка сжатия истории чата {chat_id}: {e}")
+
+    # --- Планирование ---
+
+    def note_exchange(self, chat_id: int):
+        """Учесть очередной вопрос-ответ; каждые min_batch обменов - пересчет резюме"""
+        if not self.enabled or not chat_id:
+            return
+        count = self.exchanges.get(chat_id, 0) + 1
+        if count >= self.min_batch:
+            count = 0
+            self.schedule(chat_id)
+        self.exchanges[chat_id] = count
+
+    def schedule(self, chat_id: int):
+        if chat_id not in self.queued:
+            self.queued.add(chat_id)
+            self.queue.put_nowait(chat_id)
+
+    # --- Чтение ---
+
+    async def get_summary(self, chat_id: int) -> Optional[str]:
+        """Резюме старой части разговора или None"""
+        summary, _ = await self.get_summary_info(chat_id)
+        return summary
+
+    async def get_summary_info(self, chat_id: int) -> Tuple[Optional[str], int]:
+        """
+        Резюме и id последнего сообщения, которое в него вошло
+
+        Returns:
+            (резюме или None, id) - сообщения с id <= этого уже в резюме, отправлять
+            их модели как есть не нужно; (None, 0), если резюме нет
+        """
+        if not self.enabled or not chat_id:
+            return None, 0
+        if chat_id in self.summaries:
+            self.summaries.move_to_end(chat_id)
+            return self.summaries[chat_id]
+
+        from ..database import manager as database
+        if not database.db_manager:
+            return None, 0
+        try:
+            row = await database.db_manager.get_chat_summary(chat_id)
+        except Exception as e:
+            logger.warning(f"[SUMMARY] Не удалось загрузить резюме чата {chat_id}: {e}")
+            return None, 0
+        if row:
+            self._remember(chat_id, row.summary, row.last_message_id)
+        else:
+            self._remember(chat_id, None, 0)
+        return self.summaries[chat_id]
+
+    def _remember(self, chat_id: int, summary: Optional[str], last_message_id: int):
+        self.summaries[chat_id] = (summary, last_message_id)
+        self.summaries.move_to_end(chat_id)
+        while len(self.summaries) > self.max_cached:
+            self.summaries.popitem(last=False)
+
+    # --- Сжатие ---
+
+    async def summarize_chat(self, chat_id: int) -> bool:
+        """Сжать накопившиеся старые сообщения чата в резюме"""
+        from ..database import manager as database
+        db = database.db_manager
+        if not db:
+            return False
+
+        current = await db.get_chat_summary(chat_id)
+        after_message_id = current.last_message_id if current else 0
+        messages = await db.get_messages_to_summarize(chat_id, after_message_id, self.keep_recent)
+        if len(messages) < self.min_batch:
+            self.stats["skipped"] += 1
+            return False
+
+        lines = []
+        for message in messages:
+            if message.message_text:
+                lines.append(f"Пользователь: {message.message_text}")
+            if message.gpt_response:
+                lines.append(f"Ассистент: {message.gpt_response}")
+        previous = f"ПРЕДЫДУЩЕЕ РЕЗЮМЕ:\n{current.summary}\n\n" if current else ""
+        prompt = SUMMARY_PROMPT.format(max_words=self.max_words, previous=previous, dialog="\n".join(lines))
+
+        # Напрямую через шлюз: фоновый запрос не должен попадать в кэш ответов и single-flight
+        result = await llm_gateway.complete([{"role": "user", "content": prompt}], model='auto')
+        if not result.get("success"):
+            self.stats["failed"] += 1
+            logger.warning(f"[SUMMARY] Не удалось сжать историю чата {chat_id}: {result.get('error')}")
+            return False
+
+        summary = str(result.get("raw_response")).strip()
+        await db.save_chat_summary(chat_id, summary, messages[-1].id, len(messages))
+        self._remember(chat_id, summary, messages[-1].id)
+        # В кэше контекста остались сообщения, которые теперь в резюме - следующий запрос
+        # загрузит из БД только более новые
+        context_cache.invalidate(chat_id)
+
+        self.stats["summarized"] += 1
+        self.stats["messages"] += len(messages)
+        logger.info(f"[SUMMARY] Чат {chat_id}: {len(messages)} сообщений сжато в резюме ({len(summary)} символов)")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "queued": len(self.queued), "cached": len(self.summaries), "enabled": self.enabled}
+
+# Глобальный сервис резюме разговоров
+conversation_summarizer = ConversationSummarizer(
+    keep_recent=config.SUMMARY_KEEP_RECENT,
+    min_batch=config.SUMMARY_MIN_BATCH,
+    max_words=config.SUMMARY_MAX_WORDS,
+    enabled=config.SUMMARY_ENABLED,
+)
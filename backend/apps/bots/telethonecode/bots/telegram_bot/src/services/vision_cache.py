@@ -0,0 +1,256 @@
+"""
+Кэш vision запросов по file_unique_id фото Telegram
+
+Одно и то же фото часто пересылают в несколько чатов или спрашивают о нем повторно.
+Каждый раз это было скачивание и полный vision запрос к единственному медленному
+провайдеру (PollinationsAI, около 9 с). Теперь ответ на тот же вопрос о том же фото
+берется из памяти, а подготовленные байты фото - с диска (переживают перезапуск).
+"""
+import asyncio
+import copy
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from ...config import config
+from .response_cache import normalize_text
+from ..utils.images import ImageAttachment
+
+logger = logging.getLogger(__name__)
+
+# file_unique_id - base64url; все прочее из имени файла выбрасываем
+UNSAFE_NAME_PATTERN = re.compile(r'[^A-Za-z0-9_-]+')
+
+
+class VisionCache:
+    """
+    Двухуровневый кэш для запросов с фото
+
+    1. Ответы: (file_unique_id, нормализованный вопрос, модель) -> результат
+       get_response_async; в памяти, LRU на max_entries записей с TTL.
+    2. Байты подготовленных фото (после выбора размера и уменьшения): файлы в
+       cache_dir, LRU по времени последнего обращения, общий размер не больше
+       disk_bytes. Чтение и запись файлов - в потоке, не в event loop.
+
+    Чаты, отключившие кэш ответов (RESPONSE_CACHE_DISABLED_CHATS), идут мимо кэша ответов.
+    """
+
+    def __init__(self, enabled: bool = True, ttl: int = 86400, max_entries: int = 500,
+                 cache_dir: Optional[str] = 'cache/vision', disk_bytes: int = 256 * 1024 * 1024,
+                 disabled_chats: Iterable[int] = ()):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.disk_bytes = disk_bytes
+        self.disabled_chats = set(disabled_chats)
+
+        self.answers: OrderedDict = OrderedDict()  # ключ -> (результат, expires_at)
+        self._disk_index: Optional[OrderedDict] = None  # имя файла -> размер (порядок - LRU)
+        self._disk_total = 0
+
+        self.stats = {
+            "answer_hits": 0, "answer_misses": 0, "answer_stores": 0, "answer_expired": 0,
+            "disk_hits": 0, "disk_misses": 0, "disk_writes": 0, "disk_evictions": 0, "disk_errors": 0,
+        }
+
+    def is_enabled_for(self, chat_id: int = None) -> bool:
+        return self.enabled and chat_id not in self.disabled_chats
+
+    # --- Ответы ---
+
+    @staticmethod
+    def _answer_key(file_unique_id: str, message: str, model: Optional[str]) -> str:
+        raw = f"{file_unique_id}\x00{model or ''}\x00{normalize_text(message or '')}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_answer(self, image_data: Any, message: str, model: str = None,
+                   chat_id: int = None) -> Optional[Dict[str, Any]]:
+        """
+        Готовый ответ на тот же вопрос о том же фото
+
+        Returns:
+            Копия результата с пометками cached/cache_tier='vision' или None
+        """
+        file_unique_id = getattr(image_data, 'file_unique_id', None)
+        if not file_unique_id or not self.is_enabled_for(chat_id):
+            return None
+
+        key = self._answer_key(file_unique_id, message, model)
+        entry = self.answers.get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            del self.answers[key]
+            self.stats["answer_expired"] += 1
+            entry = None
+        if entry is None:
+            self.stats["answer_misses"] += 1
+            return None
+
+        self.answers.move_to_end(key)
+        self.stats["answer_hits"] += 1
+        logger.info(f"[VISION_CACHE] Ответ о фото {file_unique_id} из кэша")
+
+        result = copy.deepcopy(entry[0])
+        result["cached"] = True
+        result["cache_tier"] = 'vision'
+        result["response_time"] = 0.0
+        return result
+
+    def put_answer(self, image_data: Any, message: str, result: Dict[str, Any], model: str = None,
+                   chat_id: int = None):
+        """Сохранить успешный ответ о фото"""
+        file_unique_id = getattr(image_data, 'file_unique_id', None)
+        if not file_unique_id or not self.is_enabled_for(chat_id) or not result.get("success"):
+            return
+
+        key = self._answer_key(file_unique_id, message, model)
+        self.answers[key] = (copy.deepcopy(result), time.monotonic() + self.ttl)
+        self.answers.move_to_end(key)
+        self.stats["answer_stores"] += 1
+        while len(self.answers) > self.max_entries:
+            self.answers.popitem(last=False)
+
+    # --- Байты фото на диске ---
+
+    def _file_name(self, file_unique_id: str) -> str:
+        return UNSAFE_NAME_PATTERN.sub('', file_unique_id) + '.img'
+
+    def _load_disk_index(self):
+        """Содержимое каталога кэша (один раз, при первом обращении; вызывается в потоке)"""
+        index = OrderedDict()
+        total = 0
+        if self.cache_dir.is_dir():
+            files = []
+            for path in self.cache_dir.glob('*.img'):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path.name, stat.st_size))
+            for _, name, size in sorted(files):
+                index[name] = size
+                total += size
+        return index, total
+
+    async def _ensure_disk_index(self) -> bool:
+        if not self.enabled or self.cache_dir is None:
+            return False
+        if self._disk_index is None:
+            index, total = await asyncio.to_thread(self._load_disk_index)
+            if self._disk_index is None:
+                self._disk_index, self._disk_total = index, total
+                logger.info(f"[VISION_CACHE] На диске {len(index)} фото, {total // 1024} КБ")
+        return True
+
+    async def read_image(self, file_unique_id: str, mime_type: str = 'image/jpeg') -> Optional[ImageAttachment]:
+        """Подготовленное фото с диска или None"""
+        if not await self._ensure_disk_index():
+            return None
+
+        name = self._file_name(file_unique_id)
+        if name not in self._disk_index:
+            self.stats["disk_misses"] += 1
+            return None
+
+        path = self.cache_dir / name
+        try:
+            data = await asyncio.to_thread(self._read_and_touch, path)
+        except OSError as e:
+            # Файл удалили снаружи или он не читается - забываем его
+            logger.warning(f"[VISION_CACHE] Ошибка чтения {name}: {e}")
+            self._disk_total -= self._disk_index.pop(name, 0)
+            self.stats["disk_errors"] += 1
+            return None
+
+        self._disk_index.move_to_end(name)
+        self.stats["disk_hits"] += 1
+        attachment = ImageAttachment(data, mime_type)
+        attachment.file_unique_id = file_unique_id
+        return attachment
+
+    @staticmethod
+    def _read_and_touch(path: Path) -> bytes:
+        data = path.read_bytes()
+        os.utime(path)  # Время обращения для LRU после перезапуска
+        return data
+
+    async def write_image(self, file_unique_id: str, attachment: ImageAttachment):
+        """Сохранить подготовленное фото (до того, как его байты уйдут в base64)"""
+        if attachment.data is None or len(attachment) > self.disk_bytes:
+            return
+        if not await self._ensure_disk_index():
+            return
+
+        name = self._file_name(file_unique_id)
+        try:
+            await asyncio.to_thread(self._write_file, self.cache_dir / name, attachment.data)
+        except OSError as e:
+            logger.warning(f"[VISION_CACHE] Ошибка записи {name}: {e}")
+            self.stats["disk_errors"] += 1
+            return
+
+        self._disk_total += len(attachment) - self._disk_index.pop(name, 0)
+        self._disk_index[name] = len(attachment)
+        self.stats["disk_writes"] += 1
+
+        evicted = []
+        while self._disk_total > self.disk_bytes and len(self._disk_index) > 1:
+            old_name, size = self._disk_index.popitem(last=False)
+            self._disk_total -= size
+            evicted.append(self.cache_dir / old_name)
+        if evicted:
+            self.stats["disk_evictions"] += len(evicted)
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    @staticmethod
+    def _write_file(path: Path, data: memoryview):
+        """Атомарная запись: временный файл + rename
+
+        У временного файла уникальное имя: одно фото могут сохранять параллельно
+        (два обработчика, несколько процессов с общим каталогом).
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.stem + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "answers": len(self.answers),
+            "disk_files": len(self._disk_index) if self._disk_index is not None else None,
+            "disk_bytes": self._disk_total,
+        }
+
+# Глобальный кэш vision запросов
+vision_cache = VisionCache(
+    enabled=config.VISION_CACHE_ENABLED,
+    ttl=config.VISION_CACHE_TTL,
+    max_entries=config.VISION_CACHE_MAX_ENTRIES,
+    cache_dir=config.VISION_CACHE_DIR or None,
+    disk_bytes=config.VISION_CACHE_DISK_MB * 1024 * 1024,
+    disabled_chats=config.RESPONSE_CACHE_DISABLED_CHATS,
+)
@@ -5,12 +5,20 @@ from .logging_utils import (
     setup_logging, escape_markdown, format_duration, 
     truncate_text, get_user_mention, validate_admin_id, split_long_message
 )
-from .rate_limiter import RateLimiter, rate_limiter
+from .rate_limiter import (
+    RateLimiter, MemoryRateLimitBackend, TokenBucketRateLimitBackend, RedisRateLimitBackend, rate_limiter
+)
 from .complexity_analyzer import QuestionComplexityAnalyzer, complexity_analyzer
+from .formatting import format_chatgpt_markdown, format_for_telegram
+from .images import ImageAttachment, encode_image_data_url, select_photo_size, downscale_image
+from .executor import CPUOffloader, cpu_executor
 
 __all__ = [
     'setup_logging', 'escape_markdown', 'format_duration', 
     'truncate_text', 'get_user_mention', 'validate_admin_id', 'split_long_message',
-    'RateLimiter', 'rate_limiter',
-    'QuestionComplexityAnalyzer', 'complexity_analyzer'
+    'RateLimiter', 'MemoryRateLimitBackend', 'TokenBucketRateLimitBackend', 'RedisRateLimitBackend', 'rate_limiter',
+    'QuestionComplexityAnalyzer', 'complexity_analyzer',
+    'format_chatgpt_markdown', 'format_for_telegram',
+    'ImageAttachment', 'encode_image_data_url', 'select_photo_size', 'downscale_image',
+    'CPUOffloader', 'cpu_executor'
 ]
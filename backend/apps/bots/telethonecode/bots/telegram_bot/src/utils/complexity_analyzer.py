@@ -2,11 +2,91 @@
 Сервис для анализа сложности вопросов
 """
 import re
+import hashlib
 import logging
-from typing import Dict, List, Tuple
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterable, List, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Вопросительные конструкции (+1 к сложности за каждую)
+QUESTION_PATTERNS = [
+    re.compile(r'как\s+(?:можно\s+)?(?:лучше\s+)?(?:правильно\s+)?\w+'),
+    re.compile(r'каким\s+способом'),
+    re.compile(r'в\s+чем\s+(?:разница|отличие)'),
+    re.compile(r'почему\s+(?:так\s+происходит|это\s+работает)'),
+    re.compile(r'что\s+происходит\s+(?:когда|если)'),
+]
+
+
+def _trie_regex(words: List[str]) -> str:
+    """
+    Регулярка-дерево из списка слов: общие префиксы проверяются один раз,
+    из нескольких слов с общим началом выбирается самое длинное
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Слово может закончиться здесь - продолжение необязательное (жадно, т.е. длинное слово в приоритете)
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Поиск всех ключевых слов (как подстрок) за один проход скомпилированной регуляркой
+
+    Регулярка-дерево находит самое длинное слово в каждом месте текста. Слова
+    внутри найденного (кеш -> кеширование, api -> rest api) берутся из заранее
+    посчитанной таблицы, а слова, которые начинаются внутри найденного и выходят
+    за его конец, проверяются точечно - только для тех слов, где это возможно.
+    """
+
+    def __init__(self, words: List[str]):
+        self.words = list(dict.fromkeys(words))
+        self.order = {word: i for i, word in enumerate(self.words)}
+        self.pattern = re.compile(_trie_regex(self.words))
+        # Слова, целиком входящие в слово
+        self.contained = {
+            word: frozenset(other for other in self.words if other != word and other in word)
+            for word in self.words
+        }
+        # Смещения внутри слова, с которых может начаться более длинное слово, выходящее за его конец
+        self.overlaps = {
+            word: tuple(k for k in range(1, len(word))
+                        if any(len(other) > len(word) - k and other.startswith(word[k:]) for other in self.words))
+            for word in self.words
+        }
+
+    def find_all(self, text: str) -> List[str]:
+        """Все слова, встречающиеся в тексте, в порядке исходного списка"""
+        found = set()
+        for match in self.pattern.finditer(text):
+            word = match.group()
+            found.add(word)
+            found.update(self.contained[word])
+            for offset in self.overlaps[word]:
+                crossing = self.pattern.match(text, match.start() + offset)
+                if crossing:
+                    found.add(crossing.group())
+                    found.update(self.contained[crossing.group()])
+        return sorted(found, key=self.order.__getitem__)
+
+    def contains_any(self, text: str) -> bool:
+        return self.pattern.search(text) is not None
+
+
 class QuestionComplexityAnalyzer:
     """Анализатор сложности вопросов"""
     
@@ -99,6 +179,29 @@ class QuestionComplexityAnalyzer:
             r'техническое\s+решение',
             r'архитектурное\s+решение',
         ]
+        
+        # Все ключевые слова ищутся за один проход, паттерны компилируются один раз
+        self.complex_matcher = KeywordMatcher(self.complex_keywords)
+        self.simple_matcher = KeywordMatcher(self.simple_indicators)
+        self.compiled_complex_patterns = [(pattern, re.compile(pattern)) for pattern in self.complex_patterns]
+        
+        # Кэш результатов: одни и те же сообщения ("привет", "спасибо") анализируются один раз
+        self.cache_size = 2048
+        self._cache: "OrderedDict[bytes, Dict[str, any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+    
+    def __getstate__(self):
+        # Для ProcessPoolExecutor: блокировка не сериализуется, кэш у процесса свой
+        state = self.__dict__.copy()
+        del state['_cache_lock']
+        state['_cache'] = OrderedDict()
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache_lock = threading.Lock()
     
     def analyze_complexity(self, text: str) -> Dict[str, any]:
         """
@@ -110,29 +213,44 @@ class QuestionComplexityAnalyzer:
         Returns:
             Словарь с результатами анализа
         """
+        key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._copy_result(cached)
+            self.cache_misses += 1
+        
+        result = self._analyze(text)
+        
+        with self._cache_lock:
+            self._cache[key] = self._copy_result(result)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+    
+    @staticmethod
+    def _copy_result(result: Dict[str, any]) -> Dict[str, any]:
+        """Копия результата: вызывающий код может менять списки"""
+        return {**result, "found_keywords": list(result["found_keywords"]),
+                "found_patterns": list(result["found_patterns"])}
+    
+    def _analyze(self, text: str) -> Dict[str, any]:
+        """Анализ без кэша"""
         text_lower = text.lower()
         
-        # Подсчет индикаторов сложности
-        complexity_score = 0
-        found_keywords = []
-        found_patterns = []
+        # Простые индикаторы
+        simple_found = self.simple_matcher.contains_any(text_lower)
+        
+        # Сложные ключевые слова - все за один проход
+        found_keywords = self.complex_matcher.find_all(text_lower)
+        complexity_score = 2 * len(found_keywords)
         
-        # Проверяем простые индикаторы
-        simple_found = False
-        for indicator in self.simple_indicators:
-            if indicator in text_lower:
-                simple_found = True
-                break
-        
-        # Проверяем сложные ключевые слова
-        for keyword in self.complex_keywords:
-            if keyword in text_lower:
-                complexity_score += 2
-                found_keywords.append(keyword)
-        
-        # Проверяем сложные паттерны
-        for pattern in self.complex_patterns:
-            if re.search(pattern, text_lower):
+        # Сложные паттерны
+        found_patterns = []
+        for pattern, compiled in self.compiled_complex_patterns:
+            if compiled.search(text_lower):
                 complexity_score += 3
                 found_patterns.append(pattern)
         
@@ -145,27 +263,12 @@ class QuestionComplexityAnalyzer:
             complexity_score += 2
         
         # Проверяем наличие вопросительных конструкций
-        question_patterns = [
-            r'как\s+(?:можно\s+)?(?:лучше\s+)?(?:правильно\s+)?\w+',
-            r'каким\s+способом',
-            r'в\s+чем\s+(?:разница|отличие)',
-            r'почему\s+(?:так\s+происходит|это\s+работает)',
-            r'что\s+происходит\s+(?:когда|если)',
-        ]
-        
-        for pattern in question_patterns:
-            if re.search(pattern, text_lower):
+        for compiled in QUESTION_PATTERNS:
+            if compiled.search(text_lower):
                 complexity_score += 1
         
         # Определяем уровень сложности
-        if simple_found and complexity_score < 2:
-            complexity_level = "simple"
-        elif complexity_score < 4:
-            complexity_level = "medium"
-        elif complexity_score < 8:
-            complexity_level = "complex"
-        else:
-            complexity_level = "very_complex"
+        complexity_level = self._complexity_level(complexity_score, simple_found)
         
         result = {
             "complexity_level": complexity_level,
@@ -181,6 +284,43 @@ class QuestionComplexityAnalyzer:
         
         return result
     
+    @staticmethod
+    def _complexity_level(complexity_score: int, simple_found: bool) -> str:
+        if simple_found and complexity_score < 2:
+            return "simple"
+        elif complexity_score < 4:
+            return "medium"
+        elif complexity_score < 8:
+            return "complex"
+        return "very_complex"
+    
+    # === ПАКЕТНЫЙ АНАЛИЗ (аналитика, пересчет истории) ===
+    
+    def analyze_many(self, texts: Iterable[str]) -> List[Dict[str, any]]:
+        """
+        Анализ пачки текстов; результат для каждого - как у analyze_complexity
+        
+        Кэш не используется: пересчет истории вытеснил бы из него живые сообщения.
+        """
+        return [self._analyze(text) for text in texts]
+    
+    async def analyze_stored_messages(self, chunk_size: int = 5000,
+                                      after_id: int = 0) -> AsyncIterator[List[Tuple[int, Dict[str, any]]]]:
+        """
+        Пересчет сложности сохраненных сообщений пачками
+        
+        Сообщения читаются из БД порциями по chunk_size, каждая порция анализируется
+        в пуле cpu_executor, чтобы не блокировать бота. Выдает списки (message_id, результат).
+        """
+        from ..database import manager as database
+        from .executor import cpu_executor
+        if not database.db_manager:
+            return
+        
+        async for rows in database.db_manager.iter_message_texts(chunk_size=chunk_size, after_id=after_id):
+            results = await cpu_executor.run(self.analyze_many, [text for _, text in rows])
+            yield [(message_id, result) for (message_id, _), result in zip(rows, results)]
+    
     def should_use_human_behavior(self, text: str, is_ask_command: bool = False) -> bool:
         """
         Определяет, нужно ли использовать эмуляцию человеческого поведения
@@ -0,0 +1,110 @@
+"""
+Вынос CPU-нагрузки из event loop бота
+
+Форматирование длинных ответов, анализ сложности, base64 изображений и разбиение
+сообщений выполняются в пуле потоков (или процессов). Маленькие входные данные
+обрабатываются прямо в цикле - передача в пул стоит дороже самой работы.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+from ...config import config
+
+logger = logging.getLogger(__name__)
+
+SLOW_INLINE_CALL = 0.05  # Синхронный вызов дольше 50 мс заметно задерживает другие чаты
+
+
+class CPUOffloader:
+    """
+    Запуск CPU-тяжелых функций вне event loop
+
+    Режимы (kind):
+        'thread'  - ThreadPoolExecutor: без накладных расходов на pickle
+        'process' - ProcessPoolExecutor: настоящий параллелизм, функции и аргументы должны сериализоваться
+        'inline'  - все в текущем цикле (для отладки)
+
+    Метрика loop_blocked_seconds - сколько всего времени цикл провел в синхронных
+    вызовах через run(); по ней видно, не пора ли понизить inline_threshold.
+    """
+
+    def __init__(self, kind: str = 'thread', max_workers: int = 2, inline_threshold: int = 4000):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.inline_threshold = inline_threshold
+        self._executor: Optional[Executor] = None
+
+        self.stats = {
+            "inline_calls": 0,
+            "offloaded_calls": 0,
+            "loop_blocked_seconds": 0.0,
+            "max_inline_seconds": 0.0,
+            "slow_inline_calls": 0,
+            "offloaded_seconds": 0.0,
+        }
+
+    @property
+    def executor(self) -> Optional[Executor]:
+        """Пул создается при первом тяжелом вызове"""
+        if self._executor is None and self.kind != 'inline':
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cpu')
+            logger.info(f"[EXECUTOR] Пул для CPU-задач: {self.kind}, воркеров: {self.max_workers}")
+        return self._executor
+
+    async def run(self, func: Callable, *args, size: int = None) -> Any:
+        """
+        Выполнить func(*args) вне event loop (или прямо в нем для маленьких данных)
+
+        Args:
+            func: Синхронная функция
+            size: Размер входных данных (символы, байты); None - всегда в пул
+        """
+        if self.kind == 'inline' or (size is not None and size < self.inline_threshold):
+            return self.run_inline(func, *args)
+
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+        self.stats["offloaded_calls"] += 1
+        self.stats["offloaded_seconds"] += time.perf_counter() - started
+        return result
+
+    def run_inline(self, func: Callable, *args) -> Any:
+        """Синхронный вызов с учетом времени блокировки цикла"""
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats["inline_calls"] += 1
+            self.stats["loop_blocked_seconds"] += elapsed
+            if elapsed > self.stats["max_inline_seconds"]:
+                self.stats["max_inline_seconds"] = elapsed
+            if elapsed > SLOW_INLINE_CALL:
+                self.stats["slow_inline_calls"] += 1
+                logger.warning(f"[EXECUTOR] {getattr(func, '__name__', func)} заблокировал цикл на {elapsed * 1000:.0f} мс")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **{key: round(value, 4) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "kind": self.kind,
+            "inline_threshold": self.inline_threshold,
+        }
+
+# Глобальный пул для CPU-задач
+cpu_executor = CPUOffloader(
+    kind=config.CPU_EXECUTOR,
+    max_workers=config.CPU_EXECUTOR_WORKERS,
+    inline_threshold=config.CPU_INLINE_THRESHOLD,
+)
@@ -0,0 +1,126 @@
+"""
+Форматирование ответов GPT (общее для GPTService и BotGPTService)
+
+Все регулярные выражения компилируются один раз при импорте, строки
+обрабатываются за один проход с заглядыванием на следующую строку по индексу.
+"""
+import re
+
+# Блок кода: ``` и содержимое выносятся на отдельные строки
+CODE_FENCE_PATTERN = re.compile(r'```\n?(.*?)\n?```', re.DOTALL)
+# Блок кода с языком (Telegram язык не показывает - убираем)
+CODE_FENCE_LANG_PATTERN = re.compile(r'```(\w+)\n(.*?)\n```', re.DOTALL)
+# Markdown заголовок "# Текст"
+HEADING_PATTERN = re.compile(r'^#{1,6}\s+(.+)', re.MULTILINE)
+# Элементы списков: "1. ", "- ", "* ", "+ "
+BULLET_ITEM_PATTERN = re.compile(r'^[-\*\+]\s+')
+LIST_ITEM_PATTERN = re.compile(r'^(?:\d+\.|[-\*\+])\s+')
+# Слова в КАПСЕ и ключевые подписи "Результат:" / "Пример:" (выделяются жирным за один проход)
+EMPHASIS_PATTERN = re.compile(r'\b([А-ЯЁ]{3,})\b|\b(Результат|Вывод|Output|Result|Пример|Example):\s*')
+EXTRA_NEWLINES_PATTERN = re.compile(r'\n{3,}')
+
+TITLE_KEYWORDS_PATTERN = re.compile('|'.join(map(re.escape, (
+    'пример', 'example', 'результат', 'вывод', 'output', 'result',
+    'решение', 'ответ', 'объяснение', 'концепции', 'моменты',
+    'использование', 'применение', 'как', 'что', 'зачем'
+))))
+
+TELEGRAM_MAX_LENGTH = 4000
+
+
+def _emphasis(match: re.Match) -> str:
+    if match.group(1):
+        return f"**{match.group(1)}**"
+    return f"**{match.group(2)}:**\n"
+
+
+def _looks_like_title(stripped: str) -> bool:
+    """Короткая строка, заканчивающаяся двоеточием ("Пример использования:")"""
+    return (stripped.endswith(':') and
+            len(stripped) < 80 and
+            not stripped.startswith('#') and
+            len(stripped.split()) <= 8)
+
+
+def format_chatgpt_markdown(response_text: str) -> str:
+    """Форматирование ответа как в ChatGPT с markdown разметкой"""
+    if not response_text:
+        return response_text
+
+    # 1. Блоки кода: ``` на отдельных строках
+    formatted_text = CODE_FENCE_PATTERN.sub('```\n\\1\n```', response_text)
+
+    # 2. Заголовки и списки - один проход по строкам
+    lines = formatted_text.split('\n')
+    formatted_lines = []
+    in_code_block = False
+
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+
+        if stripped.startswith('```'):
+            in_code_block = not in_code_block
+            formatted_lines.append(line)
+            continue
+
+        if in_code_block:
+            formatted_lines.append(line)
+            continue
+
+        if _looks_like_title(stripped):
+            # Заголовком считаем только строку с ключевым словом
+            if TITLE_KEYWORDS_PATTERN.search(stripped.lower()):
+                formatted_lines.append(f"## {stripped}")
+            else:
+                formatted_lines.append(line)
+        elif LIST_ITEM_PATTERN.match(stripped):
+            formatted_lines.append(line)
+        elif stripped and not stripped.startswith('#') and len(stripped) < 200:
+            # Строка между элементами списка тоже становится элементом
+            prev_line = formatted_lines[-1].strip() if formatted_lines else ""
+            next_line = lines[i + 1].strip() if i + 1 < len(lines) else ""
+            is_list_context = LIST_ITEM_PATTERN.match(prev_line) or LIST_ITEM_PATTERN.match(next_line)
+
+            if is_list_context and len(stripped.split()) < 15:
+                formatted_lines.append(f"- {stripped}")
+            else:
+                formatted_lines.append(line)
+        else:
+            formatted_lines.append(line)
+
+    formatted_text = '\n'.join(formatted_lines)
+
+    # 3. Выделение важного текста (только вне блоков кода)
+    parts = formatted_text.split('```')
+    for i in range(0, len(parts), 2):
+        parts[i] = EMPHASIS_PATTERN.sub(_emphasis, parts[i])
+    formatted_text = '```'.join(parts)
+
+    # 4. Убираем лишние пустые строки
+    return EXTRA_NEWLINES_PATTERN.sub('\n\n', formatted_text).strip()
+
+
+def format_for_telegram(response_text: str) -> str:
+    """Форматирование ответа специально для Telegram"""
+    if not response_text:
+        return response_text
+
+    # 1. Убираем язык у блоков кода, заголовки превращаем в жирный текст
+    formatted_text = CODE_FENCE_LANG_PATTERN.sub('```\n\\2\n```', response_text)
+    formatted_text = HEADING_PATTERN.sub(r'*\1*', formatted_text)
+
+    # 2. Маркированные списки приводим к единому формату, нумерованные оставляем
+    lines = formatted_text.split('\n')
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        bullet = BULLET_ITEM_PATTERN.match(stripped)
+        if bullet:
+            lines[i] = f"• {stripped[bullet.end():]}"
+    formatted_text = '\n'.join(lines)
+
+    # 3. Ограничиваем длину для Telegram (максимум 4096 символов)
+    if len(formatted_text) > TELEGRAM_MAX_LENGTH:
+        formatted_text = formatted_text[:3950] + "\n\n... _(сообщение обрезано)_"
+
+    # 4. Убираем лишние пустые строки
+    return EXTRA_NEWLINES_PATTERN.sub('\n\n', formatted_text).strip()
@@ -0,0 +1,152 @@
+"""
+Подготовка изображений для vision запросов
+"""
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import threading
+from typing import Any, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+B64_CHUNK = 3 * 64 * 1024  # Кратно 3 - куски base64 склеиваются без паддинга внутри
+
+_pil_image = None
+_pil_checked = False
+
+
+def _get_pil():
+    """PIL.Image (Pillow в requirements.txt; без него изображения не пережимаются)"""
+    global _pil_image, _pil_checked
+    if not _pil_checked:
+        _pil_checked = True
+        try:
+            from PIL import Image
+            _pil_image = Image
+        except ImportError:
+            logger.warning("[IMAGE] Pillow не установлен - изображения отправляются без пережатия (IMAGE_MAX_SIDE не действует)")
+    return _pil_image
+
+
+def encode_image_data_url(image_bytes: bytes, mime_type: str = 'image/jpeg') -> str:
+    """Байты изображения -> data URL для messages[].content[].image_url"""
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+class ImageAttachment:
+    """
+    Изображение для vision запроса
+
+    Байты хранятся как memoryview (например, на буфер BytesIO, куда скачан файл) -
+    без getvalue() и других копий. data URL строится только перед отправкой
+    провайдеру (llm_gateway.materialize_images), один раз на изображение: за один
+    проход в заранее выделенный буфер, без промежуточных bytes и склейки строк.
+    После этого исходные байты освобождаются, а все запросы с этим изображением
+    (кэш image_pipeline, одновременные запросы) используют одну и ту же строку.
+    """
+
+    __slots__ = ('data', 'mime_type', 'size', 'file_unique_id', '_digest', '_data_url', '_lock')
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview], mime_type: str = 'image/jpeg'):
+        self.data: Optional[memoryview] = data if isinstance(data, memoryview) else memoryview(data)
+        self.mime_type = mime_type
+        self.size = self.data.nbytes
+        self.file_unique_id: Optional[str] = None  # Фото Telegram - ключ vision_cache
+        self._digest: Optional[bytes] = None
+        self._data_url: Optional[str] = None
+        self._lock = threading.Lock()  # data_url() может выполняться в пуле потоков
+
+    @classmethod
+    def from_buffer(cls, buffer: io.BytesIO, mime_type: str = 'image/jpeg') -> 'ImageAttachment':
+        """Без копирования: представление внутреннего буфера BytesIO (менять буфер после этого нельзя)"""
+        return cls(buffer.getbuffer(), mime_type)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    @property
+    def encoded_size(self) -> int:
+        """Размер data URL в символах (без его построения)"""
+        return len(f"data:{self.mime_type};base64,") + 4 * ((self.size + 2) // 3)
+
+    @property
+    def materialized(self) -> bool:
+        return self._data_url is not None
+
+    @property
+    def digest(self) -> bytes:
+        """sha256 байтов изображения (для ключей кэшей; считается один раз)"""
+        with self._lock:
+            if self._digest is None:
+                self._digest = hashlib.sha256(self.data).digest()
+            return self._digest
+
+    def data_url(self) -> str:
+        """data URL для messages[].content[].image_url"""
+        with self._lock:
+            if self._data_url is None:
+                if self._digest is None:
+                    self._digest = hashlib.sha256(self.data).digest()  # Пока байты не освобождены
+
+                prefix = f"data:{self.mime_type};base64,".encode('ascii')
+                out = bytearray(self.encoded_size)
+                out[:len(prefix)] = prefix
+                position = len(prefix)
+                for start in range(0, self.size, B64_CHUNK):
+                    encoded = binascii.b2a_base64(self.data[start:start + B64_CHUNK], newline=False)
+                    out[position:position + len(encoded)] = encoded
+                    position += len(encoded)
+                self._data_url = out.decode('ascii')
+
+                # Байты больше не нужны - отпускаем буфер загрузки
+                self.data.release()
+                self.data = None
+            return self._data_url
+
+
+def select_photo_size(photo_sizes: Sequence[Any], max_side: int) -> Any:
+    """
+    Наименьший из размеров фото Telegram (PhotoSize), у которого большая сторона не меньше max_side
+
+    Если все размеры меньше max_side - самый большой (Telegram присылает их по возрастанию).
+    """
+    good_enough = [size for size in photo_sizes if max(size.width, size.height) >= max_side]
+    if not good_enough:
+        return photo_sizes[-1]
+    return min(good_enough, key=lambda size: size.width * size.height)
+
+
+def downscale_image(image_bytes: Union[bytes, memoryview], max_side: int,
+                    quality: int = 85) -> Tuple[Union[bytes, memoryview], Optional[Tuple[int, int]]]:
+    """
+    Уменьшить изображение до max_side по большей стороне и пережать в JPEG
+
+    Returns:
+        (JPEG - memoryview на буфер кодировщика, новый размер) или исходные байты и None,
+        если пережимать не нужно или нечем (нет Pillow, неизвестный формат)
+    """
+    image_module = _get_pil()
+    if image_module is None:
+        return image_bytes, None
+
+    try:
+        with image_module.open(io.BytesIO(image_bytes)) as image:
+            if max(image.size) <= max_side:
+                return image_bytes, None
+            image.draft('RGB', (max_side, max_side))  # JPEG декодируется сразу в уменьшенном масштабе
+            image = image.convert('RGB')
+            image.thumbnail((max_side, max_side), image_module.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"[IMAGE] Не удалось пережать изображение: {e}")
+        return image_bytes, None
+
+    if output.tell() >= len(image_bytes):
+        return image_bytes, None
+    return output.getbuffer(), image.size
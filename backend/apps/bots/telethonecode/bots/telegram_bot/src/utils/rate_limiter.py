@@ -1,16 +1,24 @@
 """
 Утилиты для работы с rate limiting
 """
+import heapq
+import inspect
+import logging
+import math
 import time
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 from collections import defaultdict, deque
 from datetime import datetime, timedelta
 
-class RateLimiter:
+logger = logging.getLogger(__name__)
+
+class MemoryRateLimitBackend:
     """
-    Класс для ограничения частоты запросов
+    Ограничение частоты запросов в памяти процесса (скользящее окно)
     """
     
+    name = 'memory'
+    
     def __init__(self):
         # Словарь для хранения истории запросов по пользователям
         # user_id -> deque of timestamps
@@ -153,5 +161,345 @@ class RateLimiter:
         for user_id in last_requests_to_remove:
             del self.last_request[user_id]
 
+
+class BucketState:
+    """Состояние пользователя в GCRA: два числа вместо истории запросов"""
+    
+    __slots__ = ('tat', 'last')
+    
+    def __init__(self, tat: float, last: float):
+        self.tat = tat    # Theoretical arrival time - когда "ведро" снова будет полным
+        self.last = last  # Время последнего разрешенного запроса (для cooldown)
+
+
+class TokenBucketRateLimitBackend:
+    """
+    Ограничение частоты запросов в памяти по GCRA (эквивалент token bucket)
+    
+    На пользователя хранится BucketState из двух float, проверка O(1). Записи
+    истекают лениво: у каждой одна запись в куче по времени истечения, при
+    проверках снимается несколько истекших, а cleanup() снимает все истекшие -
+    без полного обхода всех пользователей.
+    """
+    
+    name = 'token_bucket'
+    
+    def __init__(self, expire_per_call: int = 8):
+        self.states: Dict[int, BucketState] = {}
+        self.expiry_heap: List[Tuple[float, int]] = []  # (время истечения, user_id)
+        self.expire_per_call = expire_per_call
+        self.max_cooldown = 0.0  # Самый длинный cooldown из проверок - запись не истечет раньше него
+        
+        # Настройки по умолчанию
+        self.default_max_requests = 10
+        self.default_time_window = 60
+        self.default_cooldown = 1
+    
+    def _expires_at(self, state: BucketState) -> float:
+        return max(state.tat, state.last + self.max_cooldown)
+    
+    def _expire(self, now: float, limit: int = None) -> int:
+        """Снять истекшие записи с вершины кучи (не больше limit)"""
+        removed = 0
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            if limit is not None and removed >= limit:
+                break
+            _, user_id = heapq.heappop(self.expiry_heap)
+            state = self.states.get(user_id)
+            if state is None:
+                continue  # Запись уже сброшена через reset_user
+            expires_at = self._expires_at(state)
+            if expires_at > now:
+                # Пользователь был активен - переносим запись на новое время истечения
+                heapq.heappush(self.expiry_heap, (expires_at, user_id))
+            else:
+                del self.states[user_id]
+                removed += 1
+        return removed
+    
+    def is_allowed(self, user_id: int, max_requests: int = None,
+                   time_window: int = None, cooldown: int = None) -> Tuple[bool, str]:
+        now = time.monotonic()
+        max_requests = max_requests or self.default_max_requests
+        time_window = time_window or self.default_time_window
+        cooldown = cooldown or self.default_cooldown
+        self.max_cooldown = max(self.max_cooldown, cooldown)
+        
+        self._expire(now, self.expire_per_call)
+        
+        emission = time_window / max_requests
+        tolerance = time_window - emission
+        
+        state = self.states.get(user_id)
+        if state is not None:
+            since_last = now - state.last
+            if since_last < cooldown:
+                return False, f"Подождите {cooldown - since_last:.1f} секунд перед следующим запросом"
+            tat = max(state.tat, now)
+            if tat - now > tolerance:
+                return False, f"Превышен лимит запросов. Попробуйте через {tat - now - tolerance:.1f} секунд"
+            state.tat = tat + emission
+            state.last = now
+        else:
+            state = BucketState(now + emission, now)
+            self.states[user_id] = state
+            heapq.heappush(self.expiry_heap, (self._expires_at(state), user_id))
+        
+        return True, ""
+    
+    def get_user_stats(self, user_id: int, time_window: int = None) -> Dict[str, any]:
+        now = time.monotonic()
+        time_window = time_window or self.default_time_window
+        max_requests = self.default_max_requests
+        
+        state = self.states.get(user_id)
+        backlog = max(0.0, state.tat - now) if state else 0.0
+        requests_in_window = min(max_requests, math.ceil(backlog / (time_window / max_requests) - 1e-9))
+        time_since_last = now - state.last if state else None
+        
+        return {
+            "requests_in_window": requests_in_window,
+            "max_requests": max_requests,
+            "time_window": time_window,
+            "last_request_ago": time_since_last,
+            "can_request_now": requests_in_window < max_requests and
+                              (time_since_last is None or time_since_last >= self.default_cooldown)
+        }
+    
+    def reset_user(self, user_id: int):
+        # Запись в куче останется и будет отброшена при снятии
+        self.states.pop(user_id, None)
+    
+    def cleanup(self, max_age_hours: int = 24):
+        # Истекшие записи лежат на вершине кучи - обход всех пользователей не нужен
+        removed = self._expire(time.monotonic())
+        # Куча разрастается только из-за сброшенных пользователей - перестраиваем редко
+        if len(self.expiry_heap) > 2 * len(self.states) + 1024:
+            self.expiry_heap = [(self._expires_at(state), user_id) for user_id, state in self.states.items()]
+            heapq.heapify(self.expiry_heap)
+        if removed:
+            logger.debug(f"[RATE_LIMIT] Истекло записей: {removed}")
+
+
+# GCRA (generic cell rate algorithm) одним атомарным скриптом: на пользователя один
+# hash {tat, last}, проверка O(1). Время берется у Redis, чтобы реплики не зависели
+# от расхождения своих часов.
+#   KEYS[1] - ключ пользователя
+#   ARGV[1] - интервал между запросами (time_window / max_requests)
+#   ARGV[2] - допустимый всплеск (time_window - интервал)
+#   ARGV[3] - cooldown
+#   ARGV[4] - 1 = учесть запрос, 0 = только посмотреть состояние
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local cooldown = tonumber(ARGV[3])
+local consume = tonumber(ARGV[4])
+
+local data = redis.call('HMGET', KEYS[1], 'tat', 'last')
+local tat = tonumber(data[1]) or now
+local last = tonumber(data[2])
+if tat < now then tat = now end
+
+if consume == 0 then
+    return {1, tostring(tat - now), tostring(last and (now - last) or -1), 'state'}
+end
+
+if last and now - last < cooldown then
+    return {0, tostring(cooldown - (now - last)), tostring(now - last), 'cooldown'}
+end
+
+if tat - now > tolerance then
+    return {0, tostring(tat - now - tolerance), tostring(last and (now - last) or -1), 'limit'}
+end
+
+tat = tat + emission
+redis.call('HSET', KEYS[1], 'tat', tostring(tat), 'last', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((tat - now + cooldown) * 1000) + 1000)
+return {1, tostring(tat - now), '0', 'ok'}
+"""
+
+
+class RedisRateLimitBackend:
+    """
+    Общий для всех реплик бота лимит в Redis (GCRA в Lua-скрипте)
+    
+    Если Redis недоступен, проверки временно уходят в fallback-бэкенд в памяти,
+    чтобы бот не перестал отвечать из-за лимитера. Клиент асинхронный (redis.asyncio):
+    проверка - сетевой запрос, он не должен блокировать event loop.
+    """
+    
+    name = 'redis'
+    
+    def __init__(self, redis_url: str, prefix: str = 'tgbot:ratelimit:',
+                 fallback: MemoryRateLimitBackend = None, retry_interval: int = 30):
+        from redis import asyncio as redis  # Опциональная зависимость - нужна только для этого бэкенда
+        
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.script = self.client.register_script(GCRA_SCRIPT)
+        self.prefix = prefix
+        self.fallback = fallback or MemoryRateLimitBackend()
+        self.retry_interval = retry_interval
+        self.unavailable_until = 0.0
+        
+        self.default_max_requests = self.fallback.default_max_requests
+        self.default_time_window = self.fallback.default_time_window
+        self.default_cooldown = self.fallback.default_cooldown
+    
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+    
+    async def _run(self, user_id: int, max_requests: int, time_window: int, cooldown: int, consume: bool):
+        """Выполнить скрипт; None - Redis недоступен, надо идти в fallback"""
+        if time.monotonic() < self.unavailable_until:
+            return None
+        emission = time_window / max_requests
+        try:
+            allowed, value, since_last, reason = await self.script(
+                keys=[self._key(user_id)],
+                args=[emission, time_window - emission, cooldown, 1 if consume else 0]
+            )
+        except Exception as e:
+            logger.warning(f"[RATE_LIMIT] Redis недоступен, используем лимитер в памяти: {e}")
+            self.unavailable_until = time.monotonic() + self.retry_interval
+            return None
+        reason = reason.decode() if isinstance(reason, bytes) else reason
+        return int(allowed), float(value), float(since_last), reason
+    
+    async def is_allowed(self, user_id: int, max_requests: int = None,
+                         time_window: int = None, cooldown: int = None) -> Tuple[bool, str]:
+        max_requests = max_requests or self.default_max_requests
+        time_window = time_window or self.default_time_window
+        cooldown = cooldown or self.default_cooldown
+        
+        result = await self._run(user_id, max_requests, time_window, cooldown, consume=True)
+        if result is None:
+            return self.fallback.is_allowed(user_id, max_requests, time_window, cooldown)
+        
+        allowed, wait_time, _, reason = result
+        if allowed:
+            return True, ""
+        if reason == 'cooldown':
+            return False, f"Подождите {wait_time:.1f} секунд перед следующим запросом"
+        return False, f"Превышен лимит запросов. Попробуйте через {wait_time:.1f} секунд"
+    
+    async def get_user_stats(self, user_id: int, time_window: int = None) -> Dict[str, any]:
+        time_window = time_window or self.default_time_window
+        max_requests = self.default_max_requests
+        
+        result = await self._run(user_id, max_requests, time_window, self.default_cooldown, consume=False)
+        if result is None:
+            return self.fallback.get_user_stats(user_id, time_window)
+        
+        _, backlog, since_last, _ = result
+        # В GCRA "занятость" окна - это насколько TAT ушел вперед от текущего времени
+        requests_in_window = min(max_requests, math.ceil(backlog / (time_window / max_requests) - 1e-9))
+        time_since_last = since_last if since_last >= 0 else None
+        
+        return {
+            "requests_in_window": requests_in_window,
+            "max_requests": max_requests,
+            "time_window": time_window,
+            "last_request_ago": time_since_last,
+            "can_request_now": requests_in_window < max_requests and
+                              (time_since_last is None or time_since_last >= self.default_cooldown)
+        }
+    
+    async def reset_user(self, user_id: int):
+        try:
+            await self.client.delete(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"[RATE_LIMIT] Не удалось сбросить лимит в Redis: {e}")
+        self.fallback.reset_user(user_id)
+    
+    def cleanup(self, max_age_hours: int = 24):
+        # Ключи в Redis истекают сами (PEXPIRE), чистим только fallback
+        self.fallback.cleanup(max_age_hours)
+    
+    async def close(self):
+        await self.client.aclose()
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов с подключаемым бэкендом
+    
+    По умолчанию лимиты хранятся в памяти процесса (скользящее окно). use_backend()
+    подключает, например, TokenBucketRateLimitBackend (O(1) памяти на пользователя),
+    use_redis() - общий для всех реплик Redis с тем же контрактом is_allowed().
+    
+    Методы проверки асинхронные: бэкенды в памяти отвечают сразу, Redis-бэкенд
+    ждет ответа сервера, не блокируя event loop.
+    """
+    
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryRateLimitBackend()
+    
+    def use_backend(self, backend):
+        """Подключить другой бэкенд (MemoryRateLimitBackend, TokenBucketRateLimitBackend, ...)"""
+        self.backend = backend
+        logger.info(f"[RATE_LIMIT] Бэкенд лимитов: {backend.name}")
+    
+    async def use_redis(self, redis_url: str, prefix: str = 'tgbot:ratelimit:') -> bool:
+        """
+        Переключиться на Redis-бэкенд
+        
+        Returns:
+            True, если переключились; False - остаемся на лимитере в памяти
+        """
+        try:
+            backend = RedisRateLimitBackend(redis_url, prefix=prefix, fallback=self.backend)
+            await backend.client.ping()
+        except ImportError:
+            logger.warning("[RATE_LIMIT] Пакет redis не установлен - лимиты остаются в памяти процесса")
+            return False
+        except Exception as e:
+            logger.warning(f"[RATE_LIMIT] Redis недоступен ({e}) - лимиты остаются в памяти процесса")
+            return False
+        
+        self.backend = backend
+        logger.info("[RATE_LIMIT] Лимиты хранятся в Redis")
+        return True
+    
+    @property
+    def backend_name(self) -> str:
+        return self.backend.name
+    
+    @staticmethod
+    async def _resolve(result):
+        """Результат бэкенда: у синхронных - значение, у Redis - корутина"""
+        if inspect.isawaitable(result):
+            return await result
+        return result
+    
+    async def is_allowed(self, user_id: int, max_requests: int = None,
+                         time_window: int = None, cooldown: int = None) -> Tuple[bool, str]:
+        """
+        Проверить, разрешен ли запрос от пользователя
+        
+        Returns:
+            Tuple[bool, str]: (разрешен_ли_запрос, сообщение_об_ошибке)
+        """
+        return await self._resolve(self.backend.is_allowed(user_id, max_requests, time_window, cooldown))
+    
+    async def get_user_stats(self, user_id: int, time_window: int = None) -> Dict[str, any]:
+        """Получить статистику запросов пользователя"""
+        return await self._resolve(self.backend.get_user_stats(user_id, time_window))
+    
+    async def reset_user(self, user_id: int):
+        """Сбросить ограничения для пользователя (для админов)"""
+        await self._resolve(self.backend.reset_user(user_id))
+    
+    async def close(self):
+        """Закрыть соединение бэкенда (если оно есть)"""
+        close = getattr(self.backend, 'close', None)
+        if close is not None:
+            await close()
+    
+    def cleanup(self, max_age_hours: int = 24):
+        """Очистка старых записей для экономии памяти"""
+        self.backend.cleanup(max_age_hours)
+
 # Глобальный экземпляр rate limiter
 rate_limiter = RateLimiter()
@@ -0,0 +1,37 @@
+"""
+Общие фикстуры тестов бота
+
+Запуск (из каталога telegram_bot):
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+# Тесты импортируют бота как пакет telegram_bot (как main.py и бенчмарки)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+
+class FakeClock:
+    """Управляемые часы: подставляются вместо модуля time в тестируемом модуле"""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
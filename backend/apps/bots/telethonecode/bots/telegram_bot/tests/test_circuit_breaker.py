@@ -0,0 +1,93 @@
+"""Переходы состояний circuit breaker"""
+import pytest
+
+from telegram_bot.src.services import circuit_breaker
+from telegram_bot.src.services.circuit_breaker import (
+    CircuitBreakerRegistry, CLOSED, OPEN, HALF_OPEN, MAX_COOLDOWN, classify_error,
+)
+
+
+@pytest.fixture
+def breakers(monkeypatch, clock):
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return CircuitBreakerRegistry()
+
+
+def test_opens_after_threshold(breakers):
+    breakers.record_failure("P", 'error')
+    breakers.record_failure("P", 'error')
+    assert breakers.get("P").state == CLOSED
+    assert breakers.allow("P")
+
+    breakers.record_failure("P", 'error')
+    assert breakers.get("P").state == OPEN
+    assert not breakers.allow("P")
+    assert breakers.open_providers() == ["P"]
+
+
+def test_success_resets_failure_streak(breakers):
+    breakers.record_failure("P", 'timeout')
+    breakers.record_success("P")
+    breakers.record_failure("P", 'timeout')
+    assert breakers.get("P").state == CLOSED
+
+
+def test_half_open_allows_single_probe(breakers, clock):
+    breakers.record_failure("P", 'rate_limit')
+    clock.advance(59)
+    assert not breakers.allow("P")
+
+    clock.advance(2)
+    assert breakers.allow("P")
+    assert breakers.get("P").state == HALF_OPEN
+    assert not breakers.allow("P")  # Второй запрос ждет итога пробного
+
+    breakers.record_success("P")
+    assert breakers.get("P").state == CLOSED
+    assert breakers.allow("P")
+
+
+def test_failed_probe_doubles_cooldown(breakers, clock):
+    breakers.record_failure("P", 'timeout')
+    breakers.record_failure("P", 'timeout')
+    assert breakers.get("P").cooldown == 30
+
+    clock.advance(31)
+    assert breakers.allow("P")
+    breakers.record_failure("P", 'timeout')
+    assert breakers.get("P").state == OPEN
+    assert breakers.get("P").cooldown == 60
+    assert breakers.get("P").trips == 2
+
+
+def test_cooldown_is_capped(breakers, clock):
+    breakers.record_failure("P", 'blocked')
+    for _ in range(5):
+        clock.advance(breakers.get("P").cooldown + 1)
+        assert breakers.allow("P")
+        breakers.record_failure("P", 'blocked')
+    assert breakers.get("P").cooldown == MAX_COOLDOWN
+
+
+def test_released_probe_can_be_retried(breakers, clock):
+    breakers.record_failure("P", 'unavailable')
+    clock.advance(121)
+    assert breakers.allow("P")
+    breakers.release("P")
+    assert breakers.allow("P")
+
+
+def test_retry_after_from_error_text(breakers):
+    breakers.record_failure("P", 'unavailable', "Model available in 45 seconds")
+    assert breakers.get("P").cooldown == 45
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Provider available in 30s", 'unavailable'),
+    ("429 Too Many Requests", 'rate_limit'),
+    ("Rate limit exceeded", 'rate_limit'),
+    ("403 Forbidden", 'blocked'),
+    ("Connection reset", 'error'),
+])
+def test_classify_error(message, expected):
+    assert classify_error(message) == expected
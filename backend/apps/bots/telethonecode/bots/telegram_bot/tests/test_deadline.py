@@ -0,0 +1,55 @@
+"""Сквозной дедлайн запроса: таймауты попыток из остатка бюджета"""
+import pytest
+
+from telegram_bot.src.services import deadline as deadline_module
+from telegram_bot.src.services.deadline import RequestDeadline
+
+
+class FakeHealth:
+    def __init__(self, p95s):
+        self.p95s = p95s
+
+    def p95(self, name):
+        return self.p95s.get(name)
+
+
+@pytest.fixture
+def health(monkeypatch, clock):
+    monkeypatch.setattr(deadline_module, "time", clock)
+    fake = FakeHealth({"fast": 2.0, "slow": 30.0})
+    monkeypatch.setattr(deadline_module, "provider_health", fake)
+    return fake
+
+
+def test_attempt_timeout_from_p95(health):
+    deadline = RequestDeadline(20)
+    assert deadline.start_attempt("fast") == pytest.approx(3.0)  # p95 * 1.5
+    assert deadline.attempts == 1
+
+
+def test_unknown_provider_gets_share_of_budget(health):
+    assert RequestDeadline(20).attempt_timeout("new") == pytest.approx(10.0)
+
+
+def test_timeout_never_exceeds_remaining(health, clock):
+    deadline = RequestDeadline(20)
+    clock.advance(15)
+    assert deadline.attempt_timeout("slow") == pytest.approx(5.0)
+
+
+def test_last_attempt_gets_whole_remainder(health, clock):
+    deadline = RequestDeadline(20)
+    clock.advance(16)
+    # После 3с попытки осталась бы 1с - меньше min_attempt, поэтому отдаем все 4с
+    assert deadline.attempt_timeout("fast") == pytest.approx(4.0)
+
+
+def test_expired_and_timeout_result(health, clock):
+    deadline = RequestDeadline(20)
+    deadline.start_attempt("fast")
+    clock.advance(18.5)
+    assert deadline.expired
+    result = deadline.timeout_result()
+    assert result["success"] is False and result["timed_out"] is True
+    assert result["total_attempts"] == 1
+    assert result["elapsed"] == pytest.approx(18.5)
@@ -0,0 +1,43 @@
+"""Реестр g4f: ожидание импорта не блокирует event loop"""
+import asyncio
+import importlib
+import threading
+import types
+
+registry_module = importlib.import_module("telegram_bot.src.services.g4f_registry")
+
+
+def test_ensure_loaded_waits_for_warm_up_without_blocking_loop(monkeypatch):
+    release = threading.Event()
+    imports = []
+    fake_g4f = types.SimpleNamespace(name="g4f")
+
+    def slow_import(name):
+        imports.append(name)
+        release.wait(5)
+        return fake_g4f
+
+    monkeypatch.setattr(registry_module.importlib, "import_module", slow_import)
+    registry = registry_module.G4FRegistry()
+
+    async def scenario():
+        # Прогрев в потоке держит блокировку импорта
+        warm_up = threading.Thread(target=lambda: registry.g4f)
+        warm_up.start()
+        while not imports:
+            await asyncio.sleep(0.001)
+
+        waiters = [asyncio.ensure_future(registry.ensure_loaded()) for _ in range(3)]
+        ticks = 0
+        for _ in range(5):
+            await asyncio.sleep(0.001)
+            ticks += 1
+        assert ticks == 5  # Цикл событий продолжает работать
+        assert not any(waiter.done() for waiter in waiters)
+
+        release.set()
+        assert await asyncio.gather(*waiters) == [fake_g4f] * 3
+        warm_up.join()
+        assert imports == ["g4f"]  # Импорт один, корутины дождались прогрева
+        assert await registry.ensure_loaded() is fake_g4f
+    asyncio.run(scenario())
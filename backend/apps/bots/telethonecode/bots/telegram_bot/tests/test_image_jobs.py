@@ -0,0 +1,197 @@
+"""Очередь генерации изображений: статусы, позиция, лимиты, доставка"""
+import asyncio
+
+from telegram_bot.src.services.image_jobs import ImageJobQueue, QUEUED, RUNNING, DONE, FAILED, chat_delivery
+
+
+class ControlledGenerator:
+    """Генератор, который завершает задачи по команде теста"""
+
+    def __init__(self):
+        self.release = {}
+        self.started = []
+
+    async def __call__(self, prompt, provider_name=None, job=None):
+        self.started.append(prompt)
+        event = self.release.setdefault(prompt, asyncio.Event())
+        await event.wait()
+        if prompt.startswith("fail"):
+            raise RuntimeError("провайдер упал")
+        return {"success": True, "image_url": f"https://img/{prompt}", "provider": "P", "response_time": 1.0}
+
+    def finish(self, prompt):
+        self.release.setdefault(prompt, asyncio.Event()).set()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_job_lifecycle_and_queue_position():
+    async def scenario():
+        generator = ControlledGenerator()
+        queue = ImageJobQueue(generator, workers=1)
+        first = await queue.submit("a")
+        second = await queue.submit("b")
+        third = await queue.submit("c")
+        await settle()
+
+        assert (await queue.get(first.job_id))["status"] == RUNNING
+        assert (await queue.get(second.job_id))["position"] == 1
+        assert (await queue.get(third.job_id))["position"] == 2
+        assert queue.get_stats()["running"] == 1
+
+        generator.finish("a")
+        assert (await queue.wait(first.job_id, timeout=1))["image_url"] == "https://img/a"
+        await settle()
+        assert (await queue.get(first.job_id))["status"] == DONE
+        assert (await queue.get(second.job_id))["status"] == RUNNING
+        assert (await queue.get(third.job_id))["position"] == 1
+
+        generator.finish("b")
+        generator.finish("c")
+        await queue.wait(third.job_id, timeout=1)
+        assert queue.stats["completed"] == 3
+        assert queue.get_stats()["running"] == 0
+        await queue.stop()
+    asyncio.run(scenario())
+
+
+def test_generator_error_fails_job():
+    async def scenario():
+        generator = ControlledGenerator()
+        completed = []
+
+        async def on_complete(job):
+            completed.append(job.status)
+
+        queue = ImageJobQueue(generator, workers=1)
+        job = await queue.submit("fail-1", on_complete=on_complete)
+        generator.finish("fail-1")
+        result = await queue.wait(job.job_id, timeout=1)
+        assert result["success"] is False
+        assert job.status == FAILED
+        assert job.error == "провайдер упал"
+        assert completed == [FAILED]
+        await queue.stop()
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_submit():
+    async def scenario():
+        generator = ControlledGenerator()
+        queue = ImageJobQueue(generator, workers=1, max_pending=1)
+        await queue.submit("a")
+        await settle()  # Воркер забрал первую задачу
+        assert await queue.submit("b") is not None
+        assert await queue.submit("c") is None
+        assert queue.stats["rejected"] == 1
+        await queue.stop()
+    asyncio.run(scenario())
+
+
+def test_finished_jobs_are_bounded():
+    async def scenario():
+        generator = ControlledGenerator()
+        queue = ImageJobQueue(generator, workers=2, keep_finished=2)
+        jobs = [await queue.submit(prompt) for prompt in "abcd"]
+        for prompt in "abcd":
+            generator.finish(prompt)
+        for job in jobs:
+            await queue.wait(job.job_id, timeout=1)
+
+        assert [job.job_id for job in jobs if job.job_id in queue.jobs] == [jobs[2].job_id, jobs[3].job_id]
+        assert await queue.get(jobs[0].job_id) is None  # Без БД старые задачи забыты
+        await queue.stop()
+    asyncio.run(scenario())
+
+
+def test_provider_slot_limits_concurrency():
+    async def scenario():
+        queue = ImageJobQueue(ControlledGenerator(), per_provider=1)
+        active, peak = 0, 0
+
+        async def use_provider():
+            nonlocal active, peak
+            async with queue.provider_slot("Flux"):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        await asyncio.gather(*(use_provider() for _ in range(3)))
+        assert peak == 1
+    asyncio.run(scenario())
+
+
+def test_stop_cancels_workers():
+    async def scenario():
+        generator = ControlledGenerator()
+        queue = ImageJobQueue(generator, workers=2)
+        job = await queue.submit("a")
+        await settle()
+        await queue.stop()
+        assert queue._tasks == []
+        assert job.status == RUNNING  # Незавершенная задача остается со своим статусом
+    asyncio.run(scenario())
+
+
+def test_recover_fails_only_jobs_from_before_start(monkeypatch):
+    class FakeDB:
+        def __init__(self):
+            self.calls = []
+            self.saved = []
+
+        async def fail_unfinished_image_jobs(self, error, created_before=None):
+            self.calls.append(created_before)
+            return 0
+
+        async def save_image_job(self, job):
+            self.saved.append(job)
+
+    async def scenario():
+        db = FakeDB()
+        monkeypatch.setattr(ImageJobQueue, "_db", staticmethod(lambda: db))
+        generator = ControlledGenerator()
+        queue = ImageJobQueue(generator, workers=1)
+        first = await queue.submit("a")
+        await queue.submit("b")
+
+        # Задачи других реплик, созданные после старта, не трогаем; проверка - один раз
+        assert db.calls == [queue._started_at]
+        assert first.created_at >= queue._started_at
+        generator.finish("a")
+        generator.finish("b")
+        await queue.wait(first.job_id, timeout=1)
+        await queue.stop()
+    asyncio.run(scenario())
+
+
+def test_chat_delivery_sends_photo_or_error():
+    class FakeBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_photo(self, **kwargs):
+            self.sent.append(("photo", kwargs))
+
+        async def send_message(self, **kwargs):
+            self.sent.append(("message", kwargs))
+
+    async def scenario():
+        bot = FakeBot()
+        generator = ControlledGenerator()
+        queue = ImageJobQueue(generator, workers=1)
+        ok = await queue.submit("a", chat_id=7, on_complete=chat_delivery(bot))
+        failed = await queue.submit("fail-b", chat_id=7, on_complete=chat_delivery(bot))
+        assert ok.status == QUEUED
+        generator.finish("a")
+        generator.finish("fail-b")
+        await queue.wait(failed.job_id, timeout=1)
+        await settle()
+
+        assert bot.sent[0] == ("photo", {"chat_id": 7, "photo": "https://img/a", "caption": "a"})
+        assert bot.sent[1][0] == "message"
+        await queue.stop()
+    asyncio.run(scenario())
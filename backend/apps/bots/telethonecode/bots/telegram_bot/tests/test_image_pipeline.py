@@ -0,0 +1,42 @@
+"""Кэш подготовленных фото в ImagePipeline"""
+from telegram_bot.src.services.image_pipeline import ImagePipeline
+from telegram_bot.src.utils.images import ImageAttachment
+
+
+def attachment(size: int) -> ImageAttachment:
+    return ImageAttachment(b"x" * size, 'image/jpeg')
+
+
+def test_storing_same_photo_again_does_not_inflate_size():
+    one = attachment(300)
+    pipeline = ImagePipeline(cache_bytes=3 * one.encoded_size)
+    for _ in range(3):
+        pipeline._remember("A", attachment(300))
+    assert len(pipeline._cache) == 1
+    assert pipeline._cached_bytes == one.encoded_size
+
+    # Место под новые фото не "утекло"
+    pipeline._remember("B", attachment(300))
+    pipeline._remember("C", attachment(300))
+    assert list(pipeline._cache) == ["A", "B", "C"]
+    assert pipeline._cached_bytes == 3 * one.encoded_size
+
+
+def test_eviction_by_bytes_and_entries():
+    one = attachment(300)
+    pipeline = ImagePipeline(cache_entries=2, cache_bytes=10 * one.encoded_size)
+    for key in "ABC":
+        pipeline._remember(key, attachment(300))
+    assert list(pipeline._cache) == ["B", "C"]
+    assert pipeline._cached_bytes == 2 * one.encoded_size
+
+    pipeline = ImagePipeline(cache_bytes=2 * one.encoded_size)
+    for key in "ABC":
+        pipeline._remember(key, attachment(300))
+    assert list(pipeline._cache) == ["B", "C"]
+
+
+def test_photo_larger_than_cache_is_not_stored():
+    pipeline = ImagePipeline(cache_bytes=100)
+    pipeline._remember("A", attachment(300))
+    assert pipeline._cache == {} and pipeline._cached_bytes == 0
@@ -0,0 +1,102 @@
+"""Бэкенды rate limiter в памяти: скользящее окно и GCRA (token bucket)"""
+import asyncio
+import importlib
+
+import pytest
+
+# Пакет utils реэкспортирует одноименный экземпляр - берем сам модуль
+limiter_module = importlib.import_module("telegram_bot.src.utils.rate_limiter")
+MemoryRateLimitBackend = limiter_module.MemoryRateLimitBackend
+TokenBucketRateLimitBackend = limiter_module.TokenBucketRateLimitBackend
+RateLimiter = limiter_module.RateLimiter
+
+
+@pytest.fixture
+def backend(request, monkeypatch, clock):
+    monkeypatch.setattr(limiter_module, "time", clock)
+    return request.param()
+
+
+in_memory_backends = pytest.mark.parametrize(
+    "backend", [MemoryRateLimitBackend, TokenBucketRateLimitBackend], indirect=True, ids=["memory", "token_bucket"]
+)
+
+
+@in_memory_backends
+def test_limit_within_window(backend, clock):
+    for _ in range(3):
+        assert backend.is_allowed(1, max_requests=3, time_window=60, cooldown=1)[0]
+        clock.advance(1)
+
+    allowed, message = backend.is_allowed(1, max_requests=3, time_window=60, cooldown=1)
+    assert not allowed
+    assert "Превышен лимит" in message
+    assert backend.is_allowed(2, max_requests=3, time_window=60, cooldown=1)[0]  # Другой пользователь
+
+
+@in_memory_backends
+def test_cooldown_between_requests(backend, clock):
+    assert backend.is_allowed(1, max_requests=10, time_window=60, cooldown=5)[0]
+    clock.advance(2)
+    allowed, message = backend.is_allowed(1, max_requests=10, time_window=60, cooldown=5)
+    assert not allowed
+    assert "Подождите" in message
+    clock.advance(3)
+    assert backend.is_allowed(1, max_requests=10, time_window=60, cooldown=5)[0]
+
+
+@in_memory_backends
+def test_window_frees_up(backend, clock):
+    for _ in range(3):
+        backend.is_allowed(1, max_requests=3, time_window=60, cooldown=1)
+        clock.advance(1)
+    clock.advance(60)
+    assert backend.is_allowed(1, max_requests=3, time_window=60, cooldown=1)[0]
+
+
+@in_memory_backends
+def test_reset_user(backend, clock):
+    for _ in range(3):
+        backend.is_allowed(1, max_requests=3, time_window=60, cooldown=1)
+        clock.advance(1)
+    backend.reset_user(1)
+    assert backend.is_allowed(1, max_requests=3, time_window=60, cooldown=1)[0]
+
+
+@in_memory_backends
+def test_user_stats(backend, clock):
+    backend.is_allowed(1)
+    clock.advance(2)
+    backend.is_allowed(1)
+    stats = backend.get_user_stats(1)
+    assert stats["requests_in_window"] == 2
+    assert stats["last_request_ago"] == pytest.approx(0)
+    assert stats["can_request_now"] is False  # Cooldown еще идет
+
+
+@pytest.mark.parametrize("backend", [TokenBucketRateLimitBackend], indirect=True)
+def test_token_bucket_refills_gradually(backend, clock):
+    # 6 запросов в минуту - одно место освобождается каждые 10 секунд
+    for _ in range(6):
+        assert backend.is_allowed(1, max_requests=6, time_window=60, cooldown=1)[0]
+        clock.advance(1)
+    assert not backend.is_allowed(1, max_requests=6, time_window=60, cooldown=1)[0]
+    clock.advance(4)  # 10 секунд с первого запроса
+    assert backend.is_allowed(1, max_requests=6, time_window=60, cooldown=1)[0]
+    clock.advance(1)
+    assert not backend.is_allowed(1, max_requests=6, time_window=60, cooldown=1)[0]
+
+
+@pytest.mark.parametrize("backend", [TokenBucketRateLimitBackend], indirect=True)
+def test_token_bucket_expires_idle_users(backend, clock):
+    for user_id in range(100):
+        backend.is_allowed(user_id)
+    clock.advance(61)
+    backend.cleanup()
+    assert backend.states == {}
+
+
+def test_facade_awaits_sync_backends():
+    limiter = RateLimiter(TokenBucketRateLimitBackend())
+    assert asyncio.run(limiter.is_allowed(1)) == (True, "")
+    assert limiter.backend_name == 'token_bucket'
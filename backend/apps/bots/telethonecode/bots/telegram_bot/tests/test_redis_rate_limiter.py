@@ -0,0 +1,65 @@
+"""Redis-бэкенд rate limiter: GCRA в Lua-скрипте и fallback в память"""
+import asyncio
+import importlib
+
+import pytest
+
+# Пакет utils реэкспортирует одноименный экземпляр - берем сам модуль
+limiter_module = importlib.import_module("telegram_bot.src.utils.rate_limiter")
+MemoryRateLimitBackend = limiter_module.MemoryRateLimitBackend
+RedisRateLimitBackend = limiter_module.RedisRateLimitBackend
+RateLimiter = limiter_module.RateLimiter
+
+
+def make_redis_backend(**kwargs):
+    pytest.importorskip("redis")
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Lua-скрипты в fakeredis
+    backend = RedisRateLimitBackend("redis://localhost:6379/0", **kwargs)
+    backend.client = fakeredis.FakeAsyncRedis()
+    backend.script = backend.client.register_script(limiter_module.GCRA_SCRIPT)
+    return backend
+
+
+def test_redis_limit_and_cooldown():
+    async def scenario():
+        backend = make_redis_backend()
+        assert await backend.is_allowed(1, max_requests=2, time_window=60, cooldown=0.001) == (True, "")
+        await asyncio.sleep(0.01)
+        assert (await backend.is_allowed(1, max_requests=2, time_window=60, cooldown=0.001))[0]
+        await asyncio.sleep(0.01)
+        allowed, message = await backend.is_allowed(1, max_requests=2, time_window=60, cooldown=0.001)
+        assert not allowed and "Превышен лимит" in message
+
+        allowed, message = await backend.is_allowed(2, max_requests=10, time_window=60, cooldown=30)
+        assert allowed
+        allowed, message = await backend.is_allowed(2, max_requests=10, time_window=60, cooldown=30)
+        assert not allowed and "Подождите" in message
+
+        stats = await backend.get_user_stats(1, time_window=60)
+        assert stats["last_request_ago"] is not None
+        await backend.reset_user(1)
+        assert (await backend.is_allowed(1, max_requests=2, time_window=60, cooldown=0.001))[0]
+        await backend.close()
+    asyncio.run(scenario())
+
+
+def test_redis_unavailable_falls_back_to_memory():
+    pytest.importorskip("redis")
+
+    async def scenario():
+        # Порт 1 закрыт - соединение отклоняется сразу
+        backend = RedisRateLimitBackend("redis://127.0.0.1:1/0", fallback=MemoryRateLimitBackend())
+        assert await backend.is_allowed(1, max_requests=1, time_window=60) == (True, "")
+        assert backend.unavailable_until > 0
+        assert not (await backend.is_allowed(1, max_requests=1, time_window=60))[0]
+        assert backend.fallback.get_user_stats(1)["requests_in_window"] == 1
+        await backend.close()
+    asyncio.run(scenario())
+
+
+def test_use_redis_keeps_memory_backend_when_unreachable():
+    pytest.importorskip("redis")
+    limiter = RateLimiter()
+    assert asyncio.run(limiter.use_redis("redis://127.0.0.1:1/0")) is False
+    assert limiter.backend_name == 'memory'
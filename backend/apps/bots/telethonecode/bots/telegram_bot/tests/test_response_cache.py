@@ -0,0 +1,71 @@
+"""Кэш ответов: точные попадания, TTL, LRU и похожие сообщения"""
+import importlib
+
+import pytest
+
+from telegram_bot.src.services.response_cache import ResponseCache
+
+# Пакет services реэкспортирует одноименный экземпляр - берем сам модуль
+response_cache_module = importlib.import_module("telegram_bot.src.services.response_cache")
+
+SYSTEM = {"role": "system", "content": "Ты - ассистент"}
+RESULT = {"success": True, "response": "Ответ", "raw_response": "Ответ"}
+
+
+def history(message, *previous):
+    return [SYSTEM, *previous, {"role": "user", "content": message}]
+
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(response_cache_module, "time", clock)
+    return ResponseCache(max_entries=3, ttl=60, similarity_threshold=0.6)
+
+
+def test_exact_hit_returns_marked_copy(cache):
+    cache.put(history("Что такое Python?"), "Что такое Python?", RESULT)
+    hit = cache.get(history("что такое python"), "что такое python")
+    assert hit["response"] == "Ответ"
+    assert hit["cached"] is True and hit["cache_tier"] == 'exact'
+
+    hit["response"] = "изменено"
+    assert cache.get(history("Что такое Python?"), "Что такое Python?")["response"] == "Ответ"
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.put(history("привет"), "привет", RESULT)
+    clock.advance(59)
+    assert cache.get(history("привет"), "привет") is not None
+    clock.advance(2)
+    assert cache.get(history("привет"), "привет") is None
+    assert cache.stats["expired"] == 1
+
+
+def test_lru_eviction(cache):
+    for message in ("один", "два", "три"):
+        cache.put(history(message), message, RESULT)
+    cache.get(history("один"), "один")  # "один" теперь самый свежий
+    cache.put(history("четыре"), "четыре", RESULT)
+    assert cache.get(history("два"), "два") is None
+    assert cache.get(history("один"), "один") is not None
+
+
+def test_similar_message_hit(cache):
+    cache.put(history("как установить python на windows"), "как установить python на windows", RESULT)
+    hit = cache.get(history("как установить python на windows 10"), "как установить python на windows 10")
+    assert hit is not None and hit["cache_tier"] == 'similar'
+    assert cache.get(history("рецепт борща"), "рецепт борща") is None
+
+
+def test_context_is_part_of_the_key(cache):
+    cache.put(history("а дальше?", {"role": "assistant", "content": "про Python"}), "а дальше?", RESULT)
+    assert cache.get(history("а дальше?", {"role": "assistant", "content": "про SQL"}), "а дальше?") is None
+
+
+def test_bypass_for_images_failures_and_disabled_chats(cache):
+    cache.put(history("фото"), "фото", RESULT, image_data="data:image/jpeg;base64,AAAA")
+    cache.put(history("ошибка"), "ошибка", {"success": False})
+    cache.set_chat_enabled(42, False)
+    cache.put(history("чат"), "чат", RESULT, chat_id=42)
+    assert cache.entries == {}
+    assert cache.get(history("чат"), "чат", chat_id=42) is None
@@ -0,0 +1,97 @@
+"""Объединение одинаковых одновременных запросов"""
+import asyncio
+
+import pytest
+
+from telegram_bot.src.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"success": True, "response": "ответ"}
+
+        results = await asyncio.gather(*(flight.run("key", call) for _ in range(3)))
+        assert len(calls) == 1
+        assert [result.get("coalesced", False) for result in results] == [False, True, True]
+        assert all(result["response"] == "ответ" for result in results)
+
+        results[1]["response"] = "изменено"  # У присоединившихся - копии
+        assert results[0]["response"] == "ответ"
+        assert flight.get_stats()["in_flight"] == 0
+    asyncio.run(scenario())
+
+
+def test_leader_error_propagates_and_followers_run_their_own_call():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def failing():
+            started.set()
+            await asyncio.sleep(0.01)
+            raise RuntimeError("провайдер упал")
+
+        async def succeeding():
+            return {"success": True, "response": "свой ответ"}
+
+        leader = asyncio.ensure_future(flight.run("key", failing))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.run("key", succeeding))
+
+        with pytest.raises(RuntimeError):
+            await leader
+        result = await follower
+        assert result == {"success": True, "response": "свой ответ"}
+        assert flight.stats["fallbacks"] == 1
+        assert flight.get_stats()["in_flight"] == 0
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_does_not_block_followers():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            return {"success": True}
+
+        leader = asyncio.ensure_future(flight.run("key", slow))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.run("key", fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == {"success": True}
+    asyncio.run(scenario())
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0)
+            return {"success": True}
+
+        await asyncio.gather(flight.run("a", call), flight.run("b", call))
+        assert len(calls) == 2
+    asyncio.run(scenario())
+
+
+def test_key_depends_on_context_and_normalized_message():
+    history = [{"role": "system", "content": "s"}, {"role": "user", "content": "Привет!"}]
+    other_history = [{"role": "system", "content": "другой"}, {"role": "user", "content": "Привет!"}]
+    assert SingleFlight.make_key(history, "Привет!") == SingleFlight.make_key(history, "  привет ")
+    assert SingleFlight.make_key(history, "Привет!") != SingleFlight.make_key(other_history, "Привет!")
+    assert SingleFlight.make_key(history, "Привет!") != SingleFlight.make_key(history, "Привет!", model="m")
@@ -0,0 +1,58 @@
+"""Потоковый ответ: заглушка, переход на новое сообщение и ошибки"""
+import asyncio
+
+from telegram_bot.src.bot.streaming import StreamingReply
+
+
+class FakeMessage:
+    """Сообщение Telegram: запоминает свой текст и ответы на него"""
+
+    def __init__(self, chat, text=""):
+        self.chat = chat
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        sent = FakeMessage(self.chat, text)
+        self.chat.append(sent)
+        return sent
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+
+
+def make_reply(edit_interval=0, **kwargs):
+    chat = []
+    return chat, StreamingReply(FakeMessage(chat), edit_interval=edit_interval, **kwargs)
+
+
+def test_error_replaces_placeholder():
+    async def scenario():
+        chat, reply = make_reply()
+        await reply.start()
+        await reply.fail("ошибка")
+        assert [message.text for message in chat] == ["ошибка"]
+    asyncio.run(scenario())
+
+
+def test_error_after_text_is_a_new_message():
+    async def scenario():
+        chat, reply = make_reply()
+        await reply.start()
+        await reply.push("начало ответа")
+        await reply.fail("ошибка")
+        assert [message.text for message in chat] == ["начало ответа", "ошибка"]
+    asyncio.run(scenario())
+
+
+def test_error_after_rollover_replaces_new_placeholder():
+    async def scenario():
+        chat, reply = make_reply(edit_interval=60, max_length=20)  # Промежуточных правок нет
+        await reply.start()
+        await reply.push("первая строка ответа\nпродолжение")
+        assert [message.text for message in chat] == ["первая строка ответа", "💭 ..."]
+
+        reply.next_edit_at = 0  # Окно правок открыто - fail() не ждет
+        await reply.fail("ошибка")
+        # Уже показанный текст не тронут, заглушка не осталась
+        assert [message.text for message in chat] == ["первая строка ответа", "ошибка"]
+    asyncio.run(scenario())
@@ -0,0 +1,78 @@
+"""Кэш vision запросов: ответы в памяти (LRU, TTL) и байты фото на диске"""
+import asyncio
+import importlib
+
+import pytest
+
+from telegram_bot.src.services.vision_cache import VisionCache
+from telegram_bot.src.utils.images import ImageAttachment
+
+# Пакет services реэкспортирует одноименный экземпляр - берем сам модуль
+vision_cache_module = importlib.import_module("telegram_bot.src.services.vision_cache")
+
+RESULT = {"success": True, "response": "На фото кот"}
+
+
+def photo(file_unique_id, data=b"jpeg-bytes"):
+    attachment = ImageAttachment(data, 'image/jpeg')
+    attachment.file_unique_id = file_unique_id
+    return attachment
+
+
+@pytest.fixture
+def cache(monkeypatch, clock, tmp_path):
+    monkeypatch.setattr(vision_cache_module, "time", clock)
+    return VisionCache(ttl=60, max_entries=2, cache_dir=str(tmp_path), disk_bytes=25)
+
+
+def test_answer_hit_for_same_photo_and_question(cache):
+    cache.put_answer(photo("A"), "Что на фото?", RESULT)
+    hit = cache.get_answer(photo("A"), "что на фото")
+    assert hit["response"] == "На фото кот" and hit["cache_tier"] == 'vision'
+    assert cache.get_answer(photo("A"), "Какого цвета кот?") is None
+    assert cache.get_answer(photo("B"), "Что на фото?") is None
+
+
+def test_answers_lru_and_ttl(cache, clock):
+    for file_unique_id in ("A", "B", "C"):
+        cache.put_answer(photo(file_unique_id), "вопрос", RESULT)
+    assert cache.get_answer(photo("A"), "вопрос") is None  # Вытеснено (max_entries=2)
+    assert cache.get_answer(photo("C"), "вопрос") is not None
+
+    clock.advance(61)
+    assert cache.get_answer(photo("C"), "вопрос") is None
+    assert cache.stats["answer_expired"] == 1
+
+
+def test_disabled_chat_bypasses_answers(cache):
+    cache.disabled_chats.add(42)
+    cache.put_answer(photo("A"), "вопрос", RESULT, chat_id=42)
+    assert cache.answers == {}
+
+
+def test_disk_roundtrip_and_eviction(cache, tmp_path):
+    async def scenario():
+        await cache.write_image("A", photo("A", b"a" * 10))
+        await cache.write_image("B", photo("B", b"b" * 10))
+        assert (await cache.read_image("A")).data == b"a" * 10  # A теперь свежее B
+
+        await cache.write_image("C", photo("C", b"c" * 10))  # 30 байт > 25 - вытесняется B
+        assert await cache.read_image("B") is None
+        assert (await cache.read_image("C")).file_unique_id == "C"
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["A.img", "C.img"]
+
+        # После "перезапуска" индекс читается с диска
+        restarted = VisionCache(cache_dir=str(tmp_path), disk_bytes=25)
+        assert (await restarted.read_image("A")).data == b"a" * 10
+    asyncio.run(scenario())
+
+
+def test_concurrent_writes_of_same_photo(cache, tmp_path):
+    async def scenario():
+        # Одно фото из двух обработчиков сразу: у каждой записи свой временный файл
+        await asyncio.gather(*(cache.write_image("A", photo("A", b"a" * 10)) for _ in range(4)))
+        assert [path.name for path in tmp_path.iterdir()] == ["A.img"]
+        assert cache.get_stats()["disk_errors"] == 0
+        assert cache.get_stats()["disk_bytes"] == 10
+        assert (await cache.read_image("A")).data == b"a" * 10
+    asyncio.run(scenario())
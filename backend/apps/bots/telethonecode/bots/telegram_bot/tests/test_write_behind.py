@@ -0,0 +1,143 @@
+"""Отложенная запись в БД: сброс пачкой и возврат в очередь при ошибке"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram_bot.src.database.entity_cache import EntityCache
+from telegram_bot.src.database.write_behind import WriteBehindQueue
+
+
+class FakeResult:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.ids
+
+
+class FakeSession:
+    def __init__(self, db):
+        self.db = db
+
+    @asynccontextmanager
+    async def begin(self):
+        if self.db.fail:
+            raise ConnectionError("БД недоступна")
+        yield
+
+    async def execute(self, statement, params=None):
+        self.db.executed.append((statement, params))
+        if params and isinstance(params, list) and "telegram_message_id" in params[0]:
+            ids = list(range(self.db.next_id, self.db.next_id + len(params)))
+            self.db.next_id += len(params)
+            return FakeResult(ids)
+        return FakeResult([])
+
+
+class FakeManager:
+    """Минимум DatabaseManager, который нужен очереди"""
+
+    def __init__(self):
+        self.fail = False
+        self.executed = []
+        self.next_id = 1
+        self.user_cache = EntityCache('users')
+
+    @asynccontextmanager
+    async def _session(self):
+        yield FakeSession(self)
+
+    def async_session(self):
+        return self._session()
+
+    @staticmethod
+    def user_fingerprint(telegram_id, username=None, first_name=None, last_name=None, is_admin=False):
+        return (username, first_name, last_name, is_admin)
+
+
+def make_queue(**kwargs):
+    manager = FakeManager()
+    return manager, WriteBehindQueue(manager, **kwargs)
+
+
+def test_flush_writes_everything_in_one_pass():
+    async def scenario():
+        manager, queue = make_queue()
+        queue.touch_user(1, "alice")
+        message = queue.save_message(10, chat_id=5, user_id=1, message_text="привет")
+        queue.update_message_response(message, "ответ")
+        queue.log_request(1, 5, 'message')
+
+        await queue.flush()
+        assert queue.pending_count == 0
+        assert message.id == 1
+        assert message.values["gpt_response"] == "ответ"  # Ответ ушел одним INSERT с сообщением
+        assert queue.stats["rows"] == 3
+        assert manager.user_cache.is_fresh(1, ("alice", None, None, False))
+    asyncio.run(scenario())
+
+
+def test_failed_flush_requeues_and_retries():
+    async def scenario():
+        manager, queue = make_queue()
+        manager.fail = True
+        queue.touch_user(1, "alice")
+        message = queue.save_message(10, chat_id=5, user_id=1, message_text="привет")
+        queue.log_request(1, 5, 'message')
+
+        await queue.flush()
+        assert queue.stats["failed_flushes"] == 1
+        assert queue.pending_count == 3
+        assert message.id is None and not message.flushing
+
+        # Ответ к сообщению, вернувшемуся в очередь, по-прежнему уходит вместе с ним
+        queue.update_message_response(message, "ответ")
+        manager.fail = False
+        await queue.flush()
+        assert queue.pending_count == 0
+        assert message.id == 1
+        assert message.values["gpt_response"] == "ответ"
+    asyncio.run(scenario())
+
+
+def test_requeue_keeps_newer_user_profile():
+    async def scenario():
+        manager, queue = make_queue()
+        manager.fail = True
+        queue.touch_user(1, "old_name")
+        flush = asyncio.ensure_future(queue.flush())
+        await asyncio.sleep(0)
+        queue.touch_user(1, "new_name")  # Пришло, пока шел неудачный сброс
+        await flush
+        assert queue.pending_users[1]["username"] == "new_name"
+    asyncio.run(scenario())
+
+
+def test_requeue_drops_logs_first_on_overflow():
+    async def scenario():
+        manager, queue = make_queue(max_pending=3)
+        manager.fail = True
+        queue.save_message(10, chat_id=5, user_id=1)
+        queue.save_message(11, chat_id=5, user_id=1)
+        for _ in range(3):
+            queue.log_request(1, 5, 'message')
+
+        await queue.flush()
+        assert queue.pending_count == 3
+        assert len(queue.pending_messages) == 2
+        assert len(queue.pending_logs) == 1
+        assert queue.stats["dropped"] == 2
+    asyncio.run(scenario())
+
+
+def test_stop_flushes_pending():
+    async def scenario():
+        manager, queue = make_queue(flush_interval=60)
+        queue.start()
+        queue.log_request(1, 5, 'message')
+        await queue.stop()
+        assert queue.pending_count == 0
+        assert queue.stats["flushes"] == 1
+    asyncio.run(scenario())